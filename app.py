@@ -1,22 +1,67 @@
-from flask import Flask, render_template, request, jsonify, send_file, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, send_file, session, redirect, url_for, make_response
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm.attributes import set_committed_value
 from datetime import datetime
 import openpyxl
 from openpyxl.styles import Font, Alignment, Border, Side
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE, ERROR_CODES
+from openpyxl.utils.exceptions import IllegalCharacterError
+from xml.sax.saxutils import escape
 import os
+import io
+import re
+import csv
+import json
+import base64
+import hashlib
+import math
+import time
+import shutil
+import zipfile
 import tempfile
 import uuid
+import secrets
 import pytz
+import threading
+import multiprocessing
+import queue
+import sqlite3
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict, namedtuple
 from functools import wraps
+from contextlib import contextmanager
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///bom_system.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL') or 'sqlite:///bom_system.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'bom_system_secret_key_2025'  # 用于session加密
 app.config['SESSION_COOKIE_SECURE'] = False  # 开发环境设为False
 app.config['SESSION_COOKIE_HTTPONLY'] = True  # 防止XSS攻击
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # 跨站请求保护
 app.config['PERMANENT_SESSION_LIFETIME'] = 86400  # 会话有效期24小时
+app.config['RECIPE_CACHE_SIZE'] = 2048  # 配方缓存最多保存的配方数量
+app.config['BOM_JOB_WORKERS'] = 2  # 批量BOM后台任务的工作线程数
+app.config['BOM_PROCESS_WORKERS'] = os.cpu_count() or 1  # 多进程分片生成时的进程数
+app.config['BOM_SHARD_MIN_PARENTS'] = 200  # 每个分片至少包含的父物料数，避免分片过小
+app.config['SQLITE_JOURNAL_MODE'] = 'WAL'  # WAL模式下读操作不会被写操作阻塞
+app.config['SQLITE_BUSY_TIMEOUT'] = 30000  # 数据库被锁定时的最长等待时间（毫秒）
+app.config['SQLITE_SYNCHRONOUS'] = 'NORMAL'  # WAL模式下NORMAL即可保证数据库一致性
+app.config['ARTIFACT_DIR'] = os.environ.get('ARTIFACT_DIR') or os.path.join(tempfile.gettempdir(), 'bom_artifacts')  # 生成文件的存放目录
+app.config['ARTIFACT_MAX_BYTES'] = 1024 * 1024 * 1024  # 生成文件总大小上限（字节），超出时删除最久未下载的文件
+app.config['ARTIFACT_TTL'] = 86400  # 生成文件的保留时间（秒），过期后下载链接失效
+app.config['BOM_TEXT_ENCODING'] = 'utf-8'  # CSV/TSV格式BOM的文件编码
+app.config['METRICS_ENABLED'] = True  # 是否按接口记录性能指标并开放/metrics
+app.config['SLOW_REQUEST_THRESHOLD'] = 5.0  # 慢请求阈值（秒），处理耗时超过该值时保存调用栈采样和SQL记录；0表示关闭
+app.config['SLOW_REQUEST_DIR'] = os.environ.get('SLOW_REQUEST_DIR') or os.path.join(tempfile.gettempdir(), 'bom_slow_requests')  # 慢请求记录的存放目录
+app.config['SLOW_REQUEST_MAX_DUMPS'] = 50  # 最多保留的慢请求记录数，超出时删除最早的记录
+app.config['SLOW_REQUEST_SAMPLE_INTERVAL'] = 0.05  # 调用栈采样间隔（秒），有请求在处理时采样线程按此频率唤醒
 db = SQLAlchemy(app)
 
 # 登录验证装饰器
@@ -34,34 +79,1920 @@ def get_shanghai_time():
     shanghai_tz = pytz.timezone('Asia/Shanghai')
     return datetime.now(shanghai_tz)
 
+# SQLite连接设置：每个新连接都设置日志模式、忙等待超时和同步级别
+SQLITE_JOURNAL_MODES = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+SQLITE_SYNCHRONOUS_LEVELS = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+@event.listens_for(Engine, 'connect')
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    
+    journal_mode = str(app.config['SQLITE_JOURNAL_MODE']).upper()
+    synchronous = str(app.config['SQLITE_SYNCHRONOUS']).upper()
+    if journal_mode not in SQLITE_JOURNAL_MODES:
+        raise ValueError(f'不支持的SQLITE_JOURNAL_MODE：{journal_mode}')
+    if synchronous not in SQLITE_SYNCHRONOUS_LEVELS:
+        raise ValueError(f'不支持的SQLITE_SYNCHRONOUS：{synchronous}')
+    
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {int(app.config['SQLITE_BUSY_TIMEOUT'])}")
+    cursor.execute(f"PRAGMA journal_mode = {journal_mode}")
+    cursor.execute(f"PRAGMA synchronous = {synchronous}")
+    cursor.close()
+
+class MetricsRegistry:
+    """进程内性能指标，按接口（Flask endpoint）分别统计，以Prometheus文本格式导出
+    
+    当前线程正在处理的接口保存在线程局部变量中，SQL执行、输出行数、写出字节数等
+    在哪个线程发生就记在哪个接口下；后台线程（异步任务、流式下载等）通过scope()
+    指定归属，未指定时记为background。
+    """
+    
+    DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    # 指标名称 -> (类型, 说明)，导出时按此顺序
+    METRICS = OrderedDict([
+        ('bom_http_request_duration_seconds', ('histogram', '请求处理耗时（秒，不含流式响应的传输时间）')),
+        ('bom_sql_queries_total', ('counter', '执行的SQL语句数')),
+        ('bom_sql_query_duration_seconds_total', ('counter', 'SQL语句执行总耗时（秒）')),
+        ('bom_rows_rendered_total', ('counter', '写出的表格数据行数')),
+        ('bom_bytes_written_total', ('counter', '生成文件和流式下载写出的字节数')),
+        ('bom_excel_save_duration_seconds', ('histogram', 'Excel工作簿保存（序列化）耗时（秒）')),
+    ])
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = {}  # (指标名称, 标签) -> 累计值
+        self._histograms = {}  # (指标名称, 标签) -> [各桶计数..., 总和, 次数]
+    
+    @property
+    def enabled(self):
+        return app.config['METRICS_ENABLED']
+    
+    def current_endpoint(self):
+        return getattr(self._local, 'endpoint', None) or 'background'
+    
+    def bind(self, endpoint):
+        """设置当前线程的接口，返回原来的值"""
+        previous = getattr(self._local, 'endpoint', None)
+        self._local.endpoint = endpoint
+        return previous
+    
+    @contextmanager
+    def scope(self, endpoint):
+        """在后台线程中把指标记到endpoint下"""
+        previous = self.bind(endpoint)
+        try:
+            yield
+        finally:
+            self.bind(previous)
+    
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, self._labels(labels))
+        with self.lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+    
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, self._labels(labels))
+        with self.lock:
+            buckets = self._histograms.get(key)
+            if buckets is None:
+                buckets = self._histograms[key] = [0] * (len(self.DURATION_BUCKETS) + 2)
+            for i, bound in enumerate(self.DURATION_BUCKETS):
+                if value <= bound:
+                    buckets[i] += 1
+            buckets[-2] += value
+            buckets[-1] += 1
+    
+    @contextmanager
+    def timer(self, name):
+        """记录代码块耗时到当前接口的直方图"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+    
+    def _labels(self, labels):
+        labels.setdefault('endpoint', self.current_endpoint())
+        return tuple(sorted(labels.items()))
+    
+    def reset(self):
+        with self.lock:
+            self._counters.clear()
+            self._histograms.clear()
+    
+    def render(self):
+        """Prometheus文本格式（0.0.4）"""
+        with self.lock:
+            counters = dict(self._counters)
+            histograms = {key: list(buckets) for key, buckets in self._histograms.items()}
+        
+        lines = []
+        for name, (metric_type, help_text) in self.METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            if metric_type == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_prometheus_labels(labels)} {_prometheus_value(value)}')
+                continue
+            for (metric, labels), buckets in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(self.DURATION_BUCKETS + ('+Inf',), buckets[:-2] + [buckets[-1]]):
+                    le = bound if bound == '+Inf' else _prometheus_value(bound)
+                    lines.append(f'{name}_bucket{_prometheus_labels(labels + (("le", le),))} {count}')
+                lines.append(f'{name}_sum{_prometheus_labels(labels)} {_prometheus_value(buckets[-2])}')
+                lines.append(f'{name}_count{_prometheus_labels(labels)} {buckets[-1]}')
+        return '\n'.join(lines) + '\n'
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ''
+    escaped = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+def _prometheus_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+metrics = MetricsRegistry()
+
+class RequestTrace:
+    """一个请求处理期间的调用栈采样和SQL记录"""
+    
+    MAX_STATEMENTS = 2000  # 每个请求最多记录的SQL语句数，超出部分只计数
+    MAX_STACK_DEPTH = 100
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stacks = {}  # 调用栈（由外到内的(文件, 函数, 行号)元组） -> 采样次数
+        self.samples = 0
+        self.statements = []  # (SQL, 参数, 是否executemany, 耗时)
+        self.dropped_statements = 0
+    
+    @classmethod
+    def capture_stack(cls, frame):
+        """帧对应的调用栈，由外到内的(文件, 函数, 行号)元组"""
+        stack = []
+        while frame is not None and len(stack) < cls.MAX_STACK_DEPTH:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_name, frame.f_lineno))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+    
+    def add_sample(self, stack):
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+    
+    def add_statement(self, statement, parameters, executemany, elapsed):
+        if len(self.statements) < self.MAX_STATEMENTS:
+            self.statements.append((statement, parameters, executemany, elapsed))
+        else:
+            self.dropped_statements += 1
+
+class SlowRequestRecorder:
+    """慢请求记录
+    
+    请求处理期间，采样线程每隔SLOW_REQUEST_SAMPLE_INTERVAL记录一次请求线程的调用栈，
+    SQL事件记录每条语句及耗时；没有请求在处理时采样线程处于等待状态。处理耗时超过
+    SLOW_REQUEST_THRESHOLD时，把调用栈统计（折叠栈格式，可直接生成火焰图）、按总耗时排序的
+    SQL及其EXPLAIN QUERY PLAN、请求和响应大小保存为JSON文件，目录中只保留最新的
+    SLOW_REQUEST_MAX_DUMPS个；未超过阈值的请求直接丢弃内存中的记录。
+    """
+    
+    DUMP_ID_PATTERN = re.compile(r'^\d{8}-\d{6}-\d{6}-[0-9a-f]{6}$')  # 时间在前，按名称排序即按时间排序
+    MAX_EXPLAINED = 20  # 每个记录最多解释的SQL语句数
+    MAX_PARAMETERS_REPR = 1000  # 每条SQL记录的参数最多保存的字符数
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._requests_waiting = threading.Condition(self.lock)
+        self._active = {}  # 线程ID -> RequestTrace
+        self._local = threading.local()
+        self._sampler = None
+    
+    @property
+    def threshold(self):
+        return app.config['SLOW_REQUEST_THRESHOLD'] or 0
+    
+    def start(self):
+        """开始记录当前线程的请求"""
+        if self.threshold <= 0:
+            return
+        trace = self._local.trace = RequestTrace()
+        with self.lock:
+            self._active[threading.get_ident()] = trace
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._sample, name='slow-request-sampler', daemon=True)
+                self._sampler.start()
+            self._requests_waiting.notify()
+    
+    def record_statement(self, statement, parameters, executemany, elapsed):
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            trace.add_statement(statement, parameters, executemany, elapsed)
+    
+    def discard(self):
+        """停止记录当前线程的请求，返回其记录"""
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            self._local.trace = None
+            with self.lock:
+                self._active.pop(threading.get_ident(), None)
+        return trace
+    
+    def finish(self, response):
+        """结束记录，超过阈值时保存，返回记录ID（未保存时为None）"""
+        trace = self.discard()
+        if trace is None:
+            return None
+        
+        duration = time.perf_counter() - trace.started
+        if duration < self.threshold:
+            return None
+        try:
+            return self._save(trace, response, duration)
+        except Exception:
+            traceback.print_exc()
+            return None
+    
+    def _sample(self):
+        while True:
+            # 锁内只复制正在记录的请求，遍历调用栈在锁外进行，不阻塞请求线程的start/finish
+            with self.lock:
+                while not self._active:
+                    self._requests_waiting.wait()
+                active = list(self._active.items())
+            frames = sys._current_frames()
+            samples = [(thread_id, trace, RequestTrace.capture_stack(frames[thread_id]))
+                       for thread_id, trace in active if thread_id in frames]
+            del frames
+            # 期间已结束的请求不再计入，保存记录时调用栈统计不会再变化
+            with self.lock:
+                for thread_id, trace, stack in samples:
+                    if self._active.get(thread_id) is trace:
+                        trace.add_sample(stack)
+            time.sleep(app.config['SLOW_REQUEST_SAMPLE_INTERVAL'])
+    
+    @classmethod
+    def _preview(cls, parameters):
+        """参数的repr，最多MAX_PARAMETERS_REPR个字符
+        
+        导入、批量生成等executemany的参数列表可能有几十万组，只对前面几组生成repr。
+        """
+        if not isinstance(parameters, (list, tuple)):
+            return repr(parameters)[:cls.MAX_PARAMETERS_REPR]
+        parts = []
+        length = 0
+        for value in parameters:
+            if length >= cls.MAX_PARAMETERS_REPR:
+                parts.append('...')
+                break
+            text = repr(value)[:cls.MAX_PARAMETERS_REPR]
+            parts.append(text)
+            length += len(text) + 2
+        if isinstance(parameters, tuple) and len(parameters) == 1:
+            parts[0] += ','
+        brackets = '[]' if isinstance(parameters, list) else '()'
+        return (brackets[0] + ', '.join(parts) + brackets[1])[:cls.MAX_PARAMETERS_REPR]
+    
+    def _explain(self, statements):
+        """对SELECT语句执行EXPLAIN QUERY PLAN，返回 {SQL: 执行计划明细列表或错误信息}"""
+        plans = {}
+        connection = db.engine.raw_connection()
+        try:
+            for statement, parameters in statements:
+                try:
+                    rows = connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+                    plans[statement] = [row[-1] for row in rows]
+                except Exception as e:
+                    plans[statement] = f'无法获取执行计划：{e}'
+        finally:
+            connection.close()
+        return plans
+    
+    def _save(self, trace, response, duration):
+        # 相同的SQL合并统计，按总耗时排序
+        grouped = {}
+        for statement, parameters, executemany, elapsed in trace.statements:
+            entry = grouped.get(statement)
+            if entry is None:
+                entry = grouped[statement] = {'statement': statement, 'count': 0, 'total_seconds': 0.0,
+                                              'max_seconds': 0.0, 'parameters': self._preview(parameters),
+                                              'executemany': executemany, '_parameters': parameters}
+            entry['count'] += 1
+            entry['total_seconds'] += elapsed
+            entry['max_seconds'] = max(entry['max_seconds'], elapsed)
+        statements = sorted(grouped.values(), key=lambda entry: entry['total_seconds'], reverse=True)
+        
+        explainable = [(entry['statement'], entry['_parameters']) for entry in statements
+                       if not entry['executemany'] and entry['statement'].lstrip()[:6].upper() in ('SELECT', 'WITH')]
+        plans = self._explain(explainable[:self.MAX_EXPLAINED])
+        for entry in statements:
+            del entry['_parameters']
+            if entry['statement'] in plans:
+                entry['plan'] = plans[entry['statement']]
+        
+        stacks = [{'stack': ';'.join(f'{name} ({os.path.basename(filename)}:{line})' for filename, name, line in stack),
+                   'count': count}
+                  for stack, count in sorted(trace.stacks.items(), key=lambda item: item[1], reverse=True)]
+        
+        now = get_shanghai_time()
+        dump_id = f'{now:%Y%m%d-%H%M%S-%f}-{secrets.token_hex(3)}'
+        dump = {
+            'id': dump_id,
+            'created_at': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'duration_seconds': round(duration, 6),
+            'threshold_seconds': self.threshold,
+            'request': {
+                'method': request.method,
+                'path': request.path,
+                'query_string': request.query_string.decode('utf-8', 'replace'),
+                'endpoint': request.endpoint,
+                'content_length': request.content_length,
+                'content_type': request.content_type,
+                'remote_addr': request.remote_addr,
+            },
+            'response': {
+                'status': response.status_code,
+                'content_length': response.content_length,
+                'streamed': response.is_streamed,
+            },
+            'sql': {
+                'count': len(trace.statements) + trace.dropped_statements,
+                'recorded': len(trace.statements),
+                'total_seconds': sum(statement[3] for statement in trace.statements),
+                'statements': statements,
+            },
+            'profile': {
+                'interval_seconds': app.config['SLOW_REQUEST_SAMPLE_INTERVAL'],
+                'samples': trace.samples,
+                'stacks': stacks,
+            },
+        }
+        
+        directory = app.config['SLOW_REQUEST_DIR']
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, dump_id + '.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(dump, f, ensure_ascii=False, indent=1)
+        os.replace(path + '.tmp', path)
+        
+        # 不加锁：并发清理时同一文件可能被删除两次，忽略删除失败即可
+        for old_id in self.list_ids()[app.config['SLOW_REQUEST_MAX_DUMPS']:]:
+            try:
+                os.remove(os.path.join(directory, old_id + '.json'))
+            except OSError:
+                pass
+        return dump_id
+    
+    def list_ids(self):
+        """已保存的记录ID，最新的在前"""
+        directory = app.config['SLOW_REQUEST_DIR']
+        if not os.path.isdir(directory):
+            return []
+        ids = [name[:-5] for name in os.listdir(directory)
+               if name.endswith('.json') and self.DUMP_ID_PATTERN.match(name[:-5])]
+        return sorted(ids, reverse=True)
+    
+    def path(self, dump_id):
+        """记录文件路径，ID无效或文件不存在时返回None"""
+        if not self.DUMP_ID_PATTERN.match(dump_id or ''):
+            return None
+        path = os.path.join(app.config['SLOW_REQUEST_DIR'], dump_id + '.json')
+        return path if os.path.isfile(path) else None
+    
+    def summaries(self):
+        """各记录的摘要，供管理页面列表使用"""
+        result = []
+        for dump_id in self.list_ids():
+            try:
+                with open(os.path.join(app.config['SLOW_REQUEST_DIR'], dump_id + '.json'), encoding='utf-8') as f:
+                    dump = json.load(f)
+            except (OSError, ValueError):
+                continue
+            result.append({
+                'id': dump_id,
+                'created_at': dump['created_at'],
+                'duration_seconds': dump['duration_seconds'],
+                'method': dump['request']['method'],
+                'path': dump['request']['path'],
+                'status': dump['response']['status'],
+                'content_length': dump['request']['content_length'],
+                'sql_count': dump['sql']['count'],
+                'sql_seconds': dump['sql']['total_seconds'],
+                'samples': dump['profile']['samples'],
+            })
+        return result
+
+slow_requests = SlowRequestRecorder()
+
+# SQL语句计数和计时：每条语句开始时把开始时间压入连接的info，结束时弹出
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started_at', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started_at'].pop()
+    metrics.inc('bom_sql_queries_total')
+    metrics.inc('bom_sql_query_duration_seconds_total', elapsed)
+    slow_requests.record_statement(statement, parameters, executemany, elapsed)
+
+@event.listens_for(Engine, 'handle_error')
+def discard_query_timer(exception_context):
+    started = exception_context.connection.info.get('query_started_at') if exception_context.connection else None
+    if started:
+        started.pop()
+
+@app.before_request
+def start_request_metrics():
+    request.environ['bom.metrics_started_at'] = time.perf_counter()
+    metrics.bind(request.endpoint or 'unmatched')
+
+@app.after_request
+def record_request_metrics(response):
+    started = request.environ.get('bom.metrics_started_at')
+    if started is not None:
+        metrics.observe('bom_http_request_duration_seconds', time.perf_counter() - started,
+                        method=request.method, status=str(response.status_code))
+    metrics.bind(None)
+    return response
+
+@app.before_request
+def start_slow_request_trace():
+    slow_requests.start()
+
+@app.after_request
+def finish_slow_request_trace(response):
+    slow_requests.finish(response)
+    return response
+
+@app.teardown_request
+def discard_slow_request_trace(exception):
+    # 未处理的异常不会经过after_request
+    slow_requests.discard()
+
+class DatabaseWriter:
+    """数据库单写入者：所有写事务串行执行
+    
+    SQLite同一时间只允许一个写事务，多个线程同时写入时后到者只能等待或报错
+    “database is locked”。写接口通过lock依次执行；不需要等待结果的写入
+    （如BOM生成记录）放入队列，由后台写入线程依次提交，请求线程无需等待。
+    """
+    
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+    
+    def serialized(self, f):
+        """写接口装饰器：在写锁内执行整个请求"""
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with self.lock:
+                return f(*args, **kwargs)
+        return decorated_function
+    
+    def commit(self):
+        """在写锁内提交当前会话"""
+        with self.lock:
+            db.session.commit()
+    
+    def submit(self, func, *args):
+        """后台写入：func在写入线程的应用上下文中执行，随后提交"""
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name='db-writer', daemon=True)
+                self._thread.start()
+        self._queue.put((func, args))
+    
+    def join(self):
+        """等待队列中的后台写入全部完成"""
+        self._queue.join()
+    
+    def _worker(self):
+        while True:
+            func, args = self._queue.get()
+            try:
+                with app.app_context():
+                    with self.lock:
+                        try:
+                            func(*args)
+                            db.session.commit()
+                        except Exception:
+                            db.session.rollback()
+                            traceback.print_exc()
+            finally:
+                self._queue.task_done()
+
+db_writer = DatabaseWriter()
+
+class ArtifactStore:
+    """生成文件存储：BOM表、模板和导出文件统一保存在产物目录中，通过随机令牌下载
+    
+    每个文件旁边保存一个同名的.json元数据文件（下载文件名、大小、生成时间），
+    进程重启后令牌依然有效。新文件登记时先删除过期文件，总大小仍超出预算时
+    按最近最少下载的顺序删除。
+    """
+    
+    TOKEN_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.directory = None
+        self._artifacts = OrderedDict()  # 令牌 -> 元数据，按最近下载时间排序
+        self._total_bytes = 0
+    
+    def _data_path(self, token, meta):
+        return os.path.join(self.directory, token + meta['suffix'])
+    
+    def _meta_path(self, token):
+        return os.path.join(self.directory, token + '.json')
+    
+    def _ensure_loaded(self):
+        """首次使用时读取产物目录，恢复上次进程生成的文件"""
+        directory = app.config['ARTIFACT_DIR']
+        if self.directory == directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._artifacts.clear()
+        self._total_bytes = 0
+        
+        records = []
+        known_files = set()
+        for name in os.listdir(directory):
+            token, ext = os.path.splitext(name)
+            if ext != '.json' or not self.TOKEN_PATTERN.match(token):
+                continue
+            try:
+                with open(os.path.join(directory, name), encoding='utf-8') as f:
+                    meta = json.load(f)
+                meta['size'] = os.path.getsize(self._data_path(token, meta))
+                meta['accessed_at'] = os.path.getmtime(os.path.join(directory, name))
+            except (OSError, ValueError, KeyError):
+                self._remove_files(token, None)
+                continue
+            records.append((token, meta))
+            known_files.update((name, token + meta['suffix']))
+        
+        for token, meta in sorted(records, key=lambda record: record[1]['accessed_at']):
+            self._artifacts[token] = meta
+            self._total_bytes += meta['size']
+        
+        # 写入过程中进程退出留下的、没有元数据的残留文件
+        cutoff = time.time() - app.config['ARTIFACT_TTL']
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name not in known_files and self.TOKEN_PATTERN.match(name.split('.')[0]):
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except OSError:
+                    pass
+        
+        self._evict()
+    
+    def _remove_files(self, token, meta):
+        paths = [self._meta_path(token)]
+        if meta is not None:
+            paths.insert(0, self._data_path(token, meta))
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                # Windows下正在下载的文件无法删除，下次启动时作为残留文件清理
+                pass
+    
+    def _discard(self, token):
+        meta = self._artifacts.pop(token)
+        self._total_bytes -= meta['size']
+        self._remove_files(token, meta)
+    
+    def _expired(self, meta, now):
+        return now - meta['created_at'] > app.config['ARTIFACT_TTL']
+    
+    def _evict(self, keep=None):
+        """删除过期文件；总大小超出预算时再删除最久未下载的文件（keep除外）"""
+        now = time.time()
+        for token in [token for token, meta in self._artifacts.items() if self._expired(meta, now)]:
+            self._discard(token)
+        
+        max_bytes = app.config['ARTIFACT_MAX_BYTES']
+        for token in list(self._artifacts):
+            if self._total_bytes <= max_bytes:
+                break
+            if token != keep:
+                self._discard(token)
+    
+    def create(self, suffix, download_name, write):
+        """调用write(文件路径)生成新文件并登记，返回下载令牌"""
+        with self.lock:
+            self._ensure_loaded()
+        
+        token = secrets.token_hex(16)
+        meta = {'suffix': suffix, 'download_name': download_name}
+        path = self._data_path(token, meta)
+        try:
+            write(path)
+            meta['size'] = os.path.getsize(path)
+            metrics.inc('bom_bytes_written_total', meta['size'])
+            meta['created_at'] = time.time()
+            with open(self._meta_path(token), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+        except BaseException:
+            self._remove_files(token, meta)
+            raise
+        
+        with self.lock:
+            meta['accessed_at'] = meta['created_at']
+            self._artifacts[token] = meta
+            self._total_bytes += meta['size']
+            self._evict(keep=token)
+        return token
+    
+    def get(self, token):
+        """返回(文件路径, 元数据)，令牌无效或文件已过期时返回None"""
+        if not self.TOKEN_PATTERN.match(token or ''):
+            return None
+        
+        with self.lock:
+            self._ensure_loaded()
+            meta = self._artifacts.get(token)
+            if meta is None:
+                return None
+            now = time.time()
+            if self._expired(meta, now):
+                self._discard(token)
+                return None
+            meta['accessed_at'] = now
+            self._artifacts.move_to_end(token)
+            path = self._data_path(token, meta)
+        
+        # 元数据文件的修改时间记录最近下载时间，重启后仍按此顺序淘汰
+        try:
+            os.utime(self._meta_path(token), (now, now))
+        except OSError:
+            pass
+        return path, meta
+    
+    def stats(self):
+        with self.lock:
+            self._ensure_loaded()
+            return {
+                'count': len(self._artifacts),
+                'total_bytes': self._total_bytes,
+                'max_bytes': app.config['ARTIFACT_MAX_BYTES'],
+                'ttl': app.config['ARTIFACT_TTL']
+            }
+
+artifact_store = ArtifactStore()
+
+def send_artifact(token):
+    """发送生成文件，支持断点续传（Range）和条件请求（ETag/Last-Modified）"""
+    artifact = artifact_store.get(token)
+    if not artifact:
+        return jsonify({'error': '文件不存在或已过期'}), 404
+    
+    path, meta = artifact
+    return send_file(path, as_attachment=True, download_name=meta['download_name'], conditional=True)
+
+class StreamingFile:
+    """边生成边下载的文件对象：后台线程调用write(本对象)写入数据，响应按块读取发送
+    
+    zipfile可以写入不可定位的流，写入的数据经有界队列直接发给客户端，不写入
+    生成文件目录，也不在内存中保留完整文件。客户端断开后写入端随之中止。
+    """
+    
+    CHUNK_SIZE = 64 * 1024
+    MAX_PENDING_CHUNKS = 16  # 客户端接收较慢时，最多缓存的数据块数量
+    
+    def __init__(self, write):
+        self._queue = queue.Queue(maxsize=self.MAX_PENDING_CHUNKS)
+        self._buffer = bytearray()
+        self._cancelled = threading.Event()
+        self._finished = False
+        self._endpoint = metrics.current_endpoint()  # 后台线程写出的数据记在发起下载的接口下
+        self._thread = threading.Thread(target=self._produce, args=(write,), name='bom-stream', daemon=True)
+        self._thread.start()
+    
+    def _put(self, item):
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        raise ConnectionAbortedError('客户端已断开连接')
+    
+    def _produce(self, write):
+        with metrics.scope(self._endpoint):
+            self._produce_all(write)
+    
+    def _produce_all(self, write):
+        try:
+            write(self)
+            if self._buffer:
+                self._put(bytes(self._buffer))
+            self._put(None)
+        except Exception as e:
+            if self._cancelled.is_set():
+                return
+            traceback.print_exc()
+            try:
+                self._put(e)
+            except ConnectionAbortedError:
+                pass
+    
+    # 写入端（后台线程）
+    def write(self, data):
+        self._buffer += data
+        metrics.inc('bom_bytes_written_total', len(data))
+        if len(self._buffer) >= self.CHUNK_SIZE:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    # 读取端（响应）
+    def read(self, size=-1):
+        if self._finished:
+            return b''
+        item = self._queue.get()
+        if item is None:
+            self._finished = True
+            return b''
+        if isinstance(item, Exception):
+            # 响应头已发出，只能中断连接，避免客户端收到不完整的文件
+            self._finished = True
+            raise item
+        return item
+    
+    def close(self):
+        self._cancelled.set()
+
+def send_streaming_file(write, download_name):
+    """一次请求内生成并下载文件，数据边生成边发送"""
+    return send_file(StreamingFile(write), as_attachment=True, download_name=download_name,
+                     conditional=False, etag=False)
+
 # 数据模型
 class Recipe(db.Model):
+    __table_args__ = (
+        db.Index('ix_recipe_active_name', 'is_active', 'recipe_name'),
+        db.Index('ix_recipe_active_category_name', 'is_active', 'product_category', 'recipe_name'),
+        db.Index('ix_recipe_active_created', 'is_active', 'created_at'),
+        db.Index('ix_recipe_active_updated', 'is_active', 'updated_at'),
+        db.Index('ix_recipe_updated', 'updated_at'),  # 增量导出：按更新时间查找变化的配方（含已删除）
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     recipe_name = db.Column(db.String(100), nullable=False, unique=True)  # 配方名称唯一性约束
     description = db.Column(db.Text)
     product_category = db.Column(db.String(100))  # 产品类别，可为空
     is_active = db.Column(db.Boolean, default=True)
+    content_hash = db.Column(db.String(64))  # 配方内容哈希，用于判断重新导入时内容是否变化
     created_at = db.Column(db.DateTime, default=get_shanghai_time)
     updated_at = db.Column(db.DateTime, default=get_shanghai_time, onupdate=get_shanghai_time)
 
-class RecipeItem(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    recipe_id = db.Column(db.Integer, db.ForeignKey('recipe.id'), nullable=False)
-    material_code = db.Column(db.String(50), nullable=False)
-    material_name = db.Column(db.String(200), nullable=False)
-    quantity = db.Column(db.Float, nullable=False)
-    unit = db.Column(db.String(20), nullable=False)
-    line_number = db.Column(db.String(10), nullable=False)  # 改为字符串格式
-    project_category = db.Column(db.String(10), default='L')
+class RecipeItem(db.Model):
+    __table_args__ = (
+        db.Index('ix_recipe_item_recipe_line', 'recipe_id', 'line_number'),
+        db.Index('ix_recipe_item_material', 'material_code', 'recipe_id'),  # 反查物料被哪些配方使用
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipe.id'), nullable=False)
+    material_code = db.Column(db.String(50), nullable=False)
+    material_name = db.Column(db.String(200), nullable=False)
+    quantity = db.Column(db.Float, nullable=False)
+    unit = db.Column(db.String(20), nullable=False)
+    line_number = db.Column(db.String(10), nullable=False)  # 改为字符串格式
+    project_category = db.Column(db.String(10), default='L')
+
+class BOMRequest(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    parent_material_code = db.Column(db.String(50), nullable=False)
+    parent_material_name = db.Column(db.String(200), nullable=False)
+    basic_quantity = db.Column(db.Float, nullable=False)
+    basic_unit = db.Column(db.String(20), nullable=False)
+    recipe_ids = db.Column(db.Text, nullable=False)  # 存储多个配方ID，用逗号分隔
+    created_at = db.Column(db.DateTime, default=get_shanghai_time)
+
+class BOMRequestRecipe(db.Model):
+    """BOM生成记录与所用配方的对应关系，按配方反查使用过它的父物料"""
+    __table_args__ = (
+        db.Index('ix_bom_request_recipe_recipe', 'recipe_id', 'bom_request_id'),
+    )
+    
+    bom_request_id = db.Column(db.Integer, db.ForeignKey('bom_request.id'), primary_key=True)
+    recipe_id = db.Column(db.Integer, primary_key=True)
+
+class BOMJob(db.Model):
+    """批量BOM异步任务，记录保存在数据库中，进程重启后未完成的任务重新排队"""
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued/running/finished/failed
+    payload = db.Column(db.Text, nullable=False)  # 提交的bom_data（JSON）
+    total_rows = db.Column(db.Integer, nullable=False, default=0)
+    processed_rows = db.Column(db.Integer, nullable=False, default=0)
+    bom_count = db.Column(db.Integer)
+    message = db.Column(db.Text)
+    errors = db.Column(db.Text)  # 数据校验错误列表（JSON）
+    artifact_token = db.Column(db.String(32))  # 生成文件的下载令牌
+    created_at = db.Column(db.DateTime, default=get_shanghai_time)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+# BOM表格式定义（单个生成与批量生成共用）
+BOM_HEADERS = ['字段名称', '工厂', 'BOM可选文本', '父项物料号', '物料名称', '生效日期', 
+               'BOM用途', '可选BOM', 'BOM状态', '基本数量', '基本单位', '行项目号', 
+               '项目类别', '子项物料号', '子项物料描述', '子项数量', '子项单位']
+BOM_DATA_START_ROW = 8  # 第2-7行为空白，数据从第8行开始
+BOM_SCALED_UNITS = ('KG', 'M')  # 子项数量乘以基本数量的单位，其他单位（如EA）保持原数量
+
+def iter_bom_rows(parent, recipes):
+    """生成一个父物料的BOM数据行（17列），recipes需已按配方名称排序"""
+    basic_quantity = parent['basic_quantity']
+    current_recipe = None
+    bom_counter = 0
+    
+    for recipe in recipes:
+        if not recipe.items:
+            continue
+        
+        # 如果是新配方，更新计数器
+        if current_recipe != recipe.recipe_name:
+            current_recipe = recipe.recipe_name
+            bom_counter += 1
+        
+        for item in recipe.items:
+            # 子项数量计算：只有KG和M单位才乘以基本数量，EA单位保持原数量
+            if item.unit in BOM_SCALED_UNITS:
+                calculated_quantity = item.quantity * basic_quantity
+            else:
+                calculated_quantity = item.quantity
+            
+            yield [
+                '',                                # 字段名称
+                'P060',                            # 工厂
+                recipe.recipe_name,                # BOM可选文本
+                parent['parent_material_code'],    # 父项物料号
+                parent['parent_material_name'],    # 物料名称
+                '',                                # 生效日期
+                '1',                               # BOM用途
+                f"{bom_counter:02d}",              # 可选BOM
+                '01',                              # BOM状态
+                basic_quantity,                    # 基本数量
+                parent['basic_unit'],              # 基本单位
+                item.line_number,                  # 行项目号
+                item.project_category,             # 项目类别
+                item.material_code,                # 子项物料号
+                item.material_name,                # 子项物料描述
+                calculated_quantity,               # 子项数量
+                item.unit,                         # 子项单位
+            ]
+
+class BOMSheetWriter:
+    """BOM表渲染器：基于openpyxl只写模式整行追加，内存占用不随行数增长"""
+    
+    def __init__(self, title, column_widths):
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.worksheet = self.workbook.create_sheet(title)
+        self.row_count = 0
+        
+        # 只写模式下列宽必须在写入数据前设置
+        for i, width in enumerate(column_widths, 1):
+            self.worksheet.column_dimensions[openpyxl.utils.get_column_letter(i)].width = width
+        
+        # 表头
+        header_font = Font(bold=True)
+        header_alignment = Alignment(horizontal='center', vertical='center')
+        header_cells = []
+        for header in BOM_HEADERS:
+            cell = WriteOnlyCell(self.worksheet, value=header)
+            cell.font = header_font
+            cell.alignment = header_alignment
+            header_cells.append(cell)
+        self.worksheet.append(header_cells)
+        
+        # 第2-7行为空白
+        for _ in range(2, BOM_DATA_START_ROW):
+            self.worksheet.append([])
+    
+    def append_parent(self, parent, recipes):
+        """追加一个父物料的全部BOM行"""
+        append = self.worksheet.append
+        for row in iter_bom_rows(parent, recipes):
+            append(row)
+            self.row_count += 1
+    
+    def save(self, filename):
+        save_workbook(self.workbook, filename)
+        metrics.inc('bom_rows_rendered_total', self.row_count)
+
+def save_workbook(workbook, target):
+    """保存openpyxl工作簿，记录保存耗时"""
+    with metrics.timer('bom_excel_save_duration_seconds'):
+        workbook.save(target)
+
+# 流式输出：openpyxl只写模式会先把整张工作表写入临时文件，保存时才开始压缩输出。
+# 流式下载时工作簿框架（表头、列宽、样式等）仍由BOMSheetWriter生成，数据行按
+# openpyxl相同的格式直接序列化写入压缩流，生成一个父物料就输出一个父物料的数据。
+BOM_SHEET_PART = 'xl/worksheets/sheet1.xml'
+BOM_COLUMN_LETTERS = [openpyxl.utils.get_column_letter(i) for i in range(1, len(BOM_HEADERS) + 1)]
+
+def _cell_xml(ref, value):
+    """按openpyxl的类型规则序列化单元格（与只写模式保存的XML一致）"""
+    if isinstance(value, bool):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        text = '' if math.isnan(value) or math.isinf(value) else '%.16g' % value
+        return f'<c r="{ref}" t="n"><v>{text}</v></c>'
+    
+    value = str(value)[:32767]
+    if ILLEGAL_CHARACTERS_RE.search(value):
+        raise IllegalCharacterError(f"{value} cannot be used in worksheets.")
+    if len(value) > 1 and value.startswith('='):
+        return f'<c r="{ref}"><f>{escape(value[1:])}</f><v /></c>'
+    if value in ERROR_CODES:
+        return f'<c r="{ref}" t="e"><v>{value}</v></c>'
+    if not value:
+        return f'<c r="{ref}" t="inlineStr" />'
+    stripped = value.strip()
+    space = ' xml:space="preserve"' if stripped and stripped != value else ''
+    return f'<c r="{ref}" t="inlineStr"><is><t{space}>{escape(value)}</t></is></c>'
+
+def bom_row_xml(row_number, values):
+    cells = ''.join(_cell_xml(f'{letter}{row_number}', value)
+                    for letter, value in zip(BOM_COLUMN_LETTERS, values) if value is not None)
+    return f'<row r="{row_number}">{cells}</row>'
+
+def stream_bom_workbook(target, title, column_widths, parents):
+    """把BOM工作簿流式写入target，parents为(父物料, 已排序配方)序列，返回数据行数"""
+    skeleton = io.BytesIO()
+    BOMSheetWriter(title, column_widths).save(skeleton)
+    
+    row_number = BOM_DATA_START_ROW
+    with zipfile.ZipFile(skeleton) as source, \
+            zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+        for info in source.infolist():
+            if info.filename != BOM_SHEET_PART:
+                archive.writestr(info.filename, source.read(info))
+                continue
+            
+            head, tail = source.read(info).split(b'</sheetData>')
+            with archive.open(BOM_SHEET_PART, 'w') as sheet:
+                sheet.write(head)
+                for parent, recipes in parents:
+                    rows = []
+                    for values in iter_bom_rows(parent, recipes):
+                        rows.append(bom_row_xml(row_number, values))
+                        row_number += 1
+                    sheet.write(''.join(rows).encode('utf-8'))
+                sheet.write(b'</sheetData>' + tail)
+    metrics.inc('bom_rows_rendered_total', row_number - BOM_DATA_START_ROW)
+    return row_number - BOM_DATA_START_ROW
+
+# 文本格式输出：下游SAP上传接受CSV/TSV，按行直接序列化，不经过openpyxl
+BOM_OUTPUT_FORMATS = ('xlsx', 'csv', 'tsv')
+BOM_TEXT_DELIMITERS = {'csv': ',', 'tsv': '\t'}
+BOM_TEXT_CHUNK_SIZE = 64 * 1024
+
+def _text_value(value):
+    """数值与Excel单元格中保存的值一致（16位有效数字）"""
+    if value is None:
+        return ''
+    if isinstance(value, float) or (isinstance(value, int) and not isinstance(value, bool)):
+        return '%.16g' % value
+    return value
+
+def write_bom_text(target, parents, output_format):
+    """写出CSV/TSV格式的BOM（表头+数据行，17列及取值与Excel版本一致），返回数据行数
+    
+    target为文件路径或可写的二进制文件对象，parents为(父物料, 已排序配方)序列。
+    """
+    if isinstance(target, str):
+        with open(target, 'wb') as f:
+            return write_bom_text(f, parents, output_format)
+    
+    encoding = app.config['BOM_TEXT_ENCODING']
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=BOM_TEXT_DELIMITERS[output_format], lineterminator='\r\n')
+    writer.writerow(BOM_HEADERS)
+    
+    row_count = 0
+    for parent, recipes in parents:
+        for values in iter_bom_rows(parent, recipes):
+            writer.writerow([_text_value(value) for value in values])
+            row_count += 1
+        if buffer.tell() >= BOM_TEXT_CHUNK_SIZE:
+            target.write(buffer.getvalue().encode(encoding))
+            buffer.seek(0)
+            buffer.truncate()
+    target.write(buffer.getvalue().encode(encoding))
+    metrics.inc('bom_rows_rendered_total', row_count)
+    return row_count
+
+# 已编译配方：配方项按行号排序后以元组形式保存，供BOM生成直接使用
+RecipeLine = namedtuple('RecipeLine', ['line_number', 'material_code', 'material_name',
+                                       'quantity', 'unit', 'project_category'])
+
+class CompiledRecipe:
+    __slots__ = ('id', 'recipe_name', 'description', 'product_category', 'is_active', 'items')
+    
+    def __init__(self, id, recipe_name, description, product_category, is_active, items):
+        self.id = id
+        self.recipe_name = recipe_name
+        self.description = description
+        self.product_category = product_category
+        self.is_active = is_active
+        self.items = items
+
+# 配方批量加载：按集合一次性查询配方及配方项，避免逐行逐配方查询数据库
+SQL_IN_CHUNK_SIZE = 500  # SQLite单条语句的参数个数有限，IN查询按批执行
+
+def _chunked(values, size=SQL_IN_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def _to_recipe_id(value):
+    """将请求中的配方ID转换为整数，无效值返回None"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def compile_recipes(recipes):
+    """批量加载配方项并编译配方，返回 {配方ID: CompiledRecipe}"""
+    recipe_map = {recipe.id: recipe for recipe in recipes}
+    items_by_recipe = {recipe_id: [] for recipe_id in recipe_map}
+    columns = (RecipeItem.recipe_id, RecipeItem.line_number, RecipeItem.material_code,
+               RecipeItem.material_name, RecipeItem.quantity, RecipeItem.unit, RecipeItem.project_category)
+    for chunk in _chunked(recipe_map):
+        rows = db.session.query(*columns).filter(
+            RecipeItem.recipe_id.in_(chunk)
+        ).order_by(RecipeItem.recipe_id, RecipeItem.line_number).all()
+        for row in rows:
+            items_by_recipe[row[0]].append(RecipeLine(*row[1:]))
+    
+    return {
+        recipe_id: CompiledRecipe(recipe.id, recipe.recipe_name, recipe.description,
+                                  recipe.product_category, bool(recipe.is_active),
+                                  tuple(items_by_recipe[recipe_id]))
+        for recipe_id, recipe in recipe_map.items()
+    }
+
+def load_compiled_recipes_by_ids(recipe_ids):
+    """从数据库批量加载配方，返回 {配方ID: CompiledRecipe}"""
+    recipes = []
+    for chunk in _chunked(set(recipe_ids)):
+        recipes.extend(Recipe.query.filter(Recipe.id.in_(chunk)).all())
+    return compile_recipes(recipes)
+
+def load_compiled_recipes_by_names(recipe_names):
+    """从数据库批量加载配方，返回 {配方ID: CompiledRecipe}"""
+    recipes = []
+    for chunk in _chunked(set(recipe_names)):
+        recipes.extend(Recipe.query.filter(Recipe.recipe_name.in_(chunk)).all())
+    return compile_recipes(recipes)
+
+class RecipeCache:
+    """已编译配方的进程内LRU缓存，按配方ID和名称索引，配方写入时精确失效
+    
+    每次失效都会递增版本号；从数据库加载期间若版本号发生变化，加载结果不写入缓存，
+    避免并发写入时把旧数据放回缓存。
+    """
+    
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()  # 配方ID -> CompiledRecipe，按最近使用排序
+        self._ids_by_name = {}
+        self._lock = threading.Lock()
+    
+    def get_by_ids(self, recipe_ids):
+        """按配方ID获取，返回 {配方ID: CompiledRecipe}，不存在的配方不在结果中"""
+        wanted = {rid for rid in map(_to_recipe_id, recipe_ids) if rid is not None}
+        found = {}
+        with self._lock:
+            for recipe_id in wanted:
+                recipe = self._entries.get(recipe_id)
+                if recipe is not None:
+                    self._entries.move_to_end(recipe_id)
+                    found[recipe_id] = recipe
+            self.hits += len(found)
+            self.misses += len(wanted) - len(found)
+            version = self.version
+        
+        missing = wanted - found.keys()
+        if missing:
+            loaded = load_compiled_recipes_by_ids(missing)
+            self._store(loaded.values(), version)
+            found.update(loaded)
+        return found
+    
+    def get_by_names(self, recipe_names):
+        """按配方名称获取，返回 {配方名称: CompiledRecipe}，不存在的配方不在结果中"""
+        wanted = set(recipe_names)
+        found = {}
+        with self._lock:
+            for recipe_name in wanted:
+                recipe = self._entries.get(self._ids_by_name.get(recipe_name))
+                if recipe is not None:
+                    self._entries.move_to_end(recipe.id)
+                    found[recipe_name] = recipe
+            self.hits += len(found)
+            self.misses += len(wanted) - len(found)
+            version = self.version
+        
+        missing = wanted - found.keys()
+        if missing:
+            loaded = load_compiled_recipes_by_names(missing)
+            self._store(loaded.values(), version)
+            found.update((recipe.recipe_name, recipe) for recipe in loaded.values())
+        return found
+    
+    def _store(self, recipes, version):
+        with self._lock:
+            if version != self.version:
+                return  # 加载期间有配方被修改，放弃写入
+            for recipe in recipes:
+                self._entries[recipe.id] = recipe
+                self._entries.move_to_end(recipe.id)
+                self._ids_by_name[recipe.recipe_name] = recipe.id
+            while len(self._entries) > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._ids_by_name.pop(evicted.recipe_name, None)
+                self.evictions += 1
+    
+    def invalidate(self, recipe_ids=(), recipe_names=()):
+        """配方写入后调用，移除对应的缓存项"""
+        with self._lock:
+            self.version += 1
+            self.invalidations += 1
+            ids = {rid for rid in map(_to_recipe_id, recipe_ids) if rid is not None}
+            ids.update(self._ids_by_name[name] for name in recipe_names if name in self._ids_by_name)
+            for recipe_id in ids:
+                recipe = self._entries.pop(recipe_id, None)
+                if recipe is not None:
+                    self._ids_by_name.pop(recipe.recipe_name, None)
+    
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            self._ids_by_name.clear()
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'version': self.version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+recipe_cache = RecipeCache(app.config['RECIPE_CACHE_SIZE'])
+
+class CatalogVersion:
+    """配方目录版本号：每次配方写入后递增，只读配方接口以它生成ETag
+    
+    初始值取进程启动时的毫秒时间戳，递增时也不小于当前时间戳，进程重启后
+    版本号仍大于重启前发出的版本号，客户端缓存的旧ETag不会被误判为有效。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = int(time.time() * 1000)
+    
+    def bump(self):
+        with self._lock:
+            self.value = max(self.value + 1, int(time.time() * 1000))
+            return self.value
+    
+    def etag(self, variant=''):
+        """当前版本号对应的强ETag，variant区分同一版本下的不同请求（路径和查询参数）"""
+        digest = hashlib.sha1(variant.encode('utf-8')).hexdigest()[:12]
+        return f'{self.value}-{digest}'
+
+catalog_version = CatalogVersion()
+
+def notify_recipes_changed(recipe_ids=(), recipe_names=()):
+    """配方写入并提交后调用，使依赖配方数据的缓存和客户端缓存的ETag失效"""
+    recipe_cache.invalidate(recipe_ids, recipe_names)
+    catalog_version.bump()
+
+def catalog_conditional(f):
+    """只读配方接口装饰器：返回由目录版本号生成的ETag，请求的If-None-Match
+    与当前ETag一致时直接返回304，不查询数据库"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # 先取ETag再查询：查询期间有写入时，客户端拿到的是旧版本号，下次请求会重新获取
+        etag = catalog_version.etag(request.full_path)
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'  # 浏览器每次都带If-None-Match向服务器确认
+        return response
+    return decorated_function
+
+def compute_recipe_hash(description, product_category, items):
+    """计算配方内容哈希：表头字段加上配方项集合（与配方项顺序无关）"""
+    lines = sorted(
+        (str(item['line_number']), str(item['material_code']), str(item['material_name']),
+         repr(float(item['quantity'])), str(item['unit']), str(item['project_category']))
+        for item in items
+    )
+    payload = json.dumps([str(description or ''), str(product_category or ''), lines], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def load_recipe_hashes(recipes):
+    """按数据库中的配方项计算内容哈希，recipes为带id、description、product_category的对象，
+    返回 {配方ID: 哈希}"""
+    recipes = {recipe.id: recipe for recipe in recipes}
+    items_by_recipe = {recipe_id: [] for recipe_id in recipes}
+    columns = (RecipeItem.recipe_id, RecipeItem.line_number, RecipeItem.material_code,
+               RecipeItem.material_name, RecipeItem.quantity, RecipeItem.unit, RecipeItem.project_category)
+    for chunk in _chunked(list(recipes)):
+        for row in db.session.query(*columns).filter(RecipeItem.recipe_id.in_(chunk)).all():
+            items_by_recipe[row.recipe_id].append(row._mapping)
+    return {recipe_id: compute_recipe_hash(recipe.description, recipe.product_category, items_by_recipe[recipe_id])
+            for recipe_id, recipe in recipes.items()}
+
+def store_recipe_hashes(hashes, updated_at=None):
+    """以一条executemany的UPDATE写入内容哈希。不指定updated_at时保持原更新时间，
+    不经过ORM，因此不会触发updated_at的onupdate"""
+    if not hashes:
+        return
+    table = Recipe.__table__
+    db.session.execute(
+        table.update().where(table.c.id == db.bindparam('recipe_id')).values(
+            content_hash=db.bindparam('hash'),
+            updated_at=table.c.updated_at if updated_at is None else updated_at),
+        [{'recipe_id': recipe_id, 'hash': content_hash} for recipe_id, content_hash in hashes.items()])
+
+def ensure_recipe_hashes(recipes):
+    """为尚未保存内容哈希的配方（升级前的数据）按数据库中的配方项补算哈希。
+    补算不改变配方内容，更新时间保持不变，增量导出不会把这些配方当作有变化"""
+    missing = [recipe for recipe in recipes if not recipe.content_hash]
+    hashes = load_recipe_hashes(missing)
+    store_recipe_hashes(hashes)
+    for recipe in missing:
+        set_committed_value(recipe, 'content_hash', hashes[recipe.id])
+
+def normalize_recipe_items(items):
+    """按写入数据库的格式整理接口提交的配方项"""
+    return [{
+        'material_code': str(item['material_code']).strip(),
+        'material_name': str(item['material_name']).strip(),
+        'quantity': float(item['quantity']),
+        'unit': str(item.get('unit', 'KG')).strip(),  # 默认KG
+        'line_number': str(item.get('line_number', '')).strip(),
+        'project_category': str(item.get('project_category', 'L')).strip()
+    } for item in items]
+
+# 配方全文搜索索引：FTS5虚拟表recipe_search，每个活跃配方一行（rowid为配方ID），
+# 包含配方名称、描述、产品类别及全部配方项的物料编码和物料名称。trigram分词器支持
+# 中文和物料编码的任意子串匹配。写接口在提交前调用update_recipe_search_index更新索引行。
+RECIPE_SEARCH_TABLE = 'recipe_search'
+RECIPE_SEARCH_TOKENIZER = 'trigram'
+RECIPE_SEARCH_MIN_TERM_LENGTH = 3  # trigram分词器只能匹配至少3个字符的搜索词
+RECIPE_SEARCH_DOCUMENTS = (
+    'SELECT recipe.id, recipe.recipe_name, coalesce(recipe.description, \'\'), '
+    'coalesce(recipe.product_category, \'\'), '
+    'coalesce((SELECT group_concat(material_code, \' \') FROM recipe_item WHERE recipe_item.recipe_id = recipe.id), \'\'), '
+    'coalesce((SELECT group_concat(material_name, \' \') FROM recipe_item WHERE recipe_item.recipe_id = recipe.id), \'\') '
+    'FROM recipe WHERE recipe.is_active = 1'
+)
+RECIPE_SEARCH_INSERT = (
+    f'INSERT INTO {RECIPE_SEARCH_TABLE} '
+    '(rowid, recipe_name, description, product_category, material_codes, material_names) '
+)
+
+def recipe_search_available():
+    """当前数据库是否已建立全文搜索索引（SQLite未编译FTS5时不可用）"""
+    return db.session.execute(
+        db.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': RECIPE_SEARCH_TABLE}
+    ).first() is not None
+
+def rebuild_recipe_search_index():
+    """按数据库中的全部活跃配方重建搜索索引"""
+    db.session.flush()
+    db.session.execute(db.text(f'DELETE FROM {RECIPE_SEARCH_TABLE}'))
+    db.session.execute(db.text(RECIPE_SEARCH_INSERT + RECIPE_SEARCH_DOCUMENTS))
+
+def update_recipe_search_index(recipe_ids):
+    """在写事务内重写指定配方的索引行（已停用的配方移出索引），需在提交前调用"""
+    recipe_ids = [rid for rid in map(_to_recipe_id, recipe_ids) if rid is not None]
+    if not recipe_ids or not recipe_search_available():
+        return
+    db.session.flush()  # 先写入会话中尚未提交的配方和配方项
+    for chunk in _chunked(recipe_ids):
+        params = {'ids': chunk}
+        db.session.execute(db.text(f'DELETE FROM {RECIPE_SEARCH_TABLE} WHERE rowid IN :ids').bindparams(
+            db.bindparam('ids', expanding=True)), params)
+        db.session.execute(db.text(RECIPE_SEARCH_INSERT + RECIPE_SEARCH_DOCUMENTS + ' AND recipe.id IN :ids').bindparams(
+            db.bindparam('ids', expanding=True)), params)
+
+# 数据库迁移：db.create_all只会创建缺失的表，已存在的表需要通过迁移补充列和索引。
+# 迁移按版本号顺序执行，已执行的版本记录在schema_migrations表中；新建数据库时
+# create_all已按模型定义建好列和索引，因此每个迁移都需要可重复执行。
+# 迁移返回False表示当前环境无法执行（如SQLite缺少所需扩展），不记录版本，下次启动时重试。
+def _table_columns(table):
+    return {row[1] for row in db.session.execute(db.text(f'PRAGMA table_info({table})'))}
+
+def _migrate_recipe_content_hash():
+    if 'content_hash' not in _table_columns('recipe'):
+        db.session.execute(db.text('ALTER TABLE recipe ADD COLUMN content_hash VARCHAR(64)'))
+
+def _migrate_query_indexes():
+    db.session.execute(db.text(
+        'CREATE INDEX IF NOT EXISTS ix_recipe_item_recipe_line ON recipe_item (recipe_id, line_number)'))
+    db.session.execute(db.text(
+        'CREATE INDEX IF NOT EXISTS ix_recipe_active_name ON recipe (is_active, recipe_name)'))
+    # 类别+名称索引同时覆盖类别统计和按类别分页
+    db.session.execute(db.text(
+        'CREATE INDEX IF NOT EXISTS ix_recipe_active_category_name ON recipe (is_active, product_category, recipe_name)'))
+
+def _migrate_bom_job_artifact_token():
+    if 'artifact_token' not in _table_columns('bom_job'):
+        db.session.execute(db.text('ALTER TABLE bom_job ADD COLUMN artifact_token VARCHAR(32)'))
+
+def _migrate_recipe_page_indexes():
+    db.session.execute(db.text(
+        'CREATE INDEX IF NOT EXISTS ix_recipe_active_created ON recipe (is_active, created_at)'))
+    db.session.execute(db.text(
+        'CREATE INDEX IF NOT EXISTS ix_recipe_active_updated ON recipe (is_active, updated_at)'))
+
+def _migrate_recipe_search_index():
+    try:
+        db.session.execute(db.text(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {RECIPE_SEARCH_TABLE} USING fts5('
+            'recipe_name, description, product_category, material_codes, material_names, '
+            f"tokenize = '{RECIPE_SEARCH_TOKENIZER}')"))
+    except OperationalError as e:
+        # SQLite版本过旧或未编译FTS5，搜索接口退回LIKE查询；不记录为已执行，升级SQLite后启动时重试
+        db.session.rollback()
+        print(f"⚠️  无法创建配方全文搜索索引（{e.orig}），搜索使用LIKE查询")
+        return False
+    rebuild_recipe_search_index()
+
+def _migrate_where_used_index():
+    db.session.execute(db.text(
+        'CREATE INDEX IF NOT EXISTS ix_recipe_item_material ON recipe_item (material_code, recipe_id)'))
+    # 按已有BOM生成记录中逗号分隔的配方ID补齐对应关系（表由create_all创建）
+    last_id = 0
+    while True:
+        rows = db.session.execute(db.text(
+            'SELECT id, recipe_ids FROM bom_request WHERE id > :last_id ORDER BY id LIMIT 1000'
+        ), {'last_id': last_id}).all()
+        if not rows:
+            break
+        links = [{'bom_request_id': request_id, 'recipe_id': recipe_id}
+                 for request_id, recipe_ids in rows for recipe_id in parse_recipe_id_list(recipe_ids)]
+        if links:
+            db.session.execute(db.text(
+                'INSERT OR IGNORE INTO bom_request_recipe (bom_request_id, recipe_id) '
+                'VALUES (:bom_request_id, :recipe_id)'), links)
+        last_id = rows[-1][0]
+
+def _migrate_recipe_updated_index():
+    db.session.execute(db.text('CREATE INDEX IF NOT EXISTS ix_recipe_updated ON recipe (updated_at)'))
+
+MIGRATIONS = [
+    (1, '配方内容哈希列', _migrate_recipe_content_hash),
+    (2, '配方及配方项查询索引', _migrate_query_indexes),
+    (3, '批量BOM任务生成文件令牌列', _migrate_bom_job_artifact_token),
+    (4, '配方分页及排序索引', _migrate_recipe_page_indexes),
+    (5, '配方全文搜索索引', _migrate_recipe_search_index),
+    (6, '物料反查索引及BOM生成记录配方对应表', _migrate_where_used_index),
+    (7, '配方增量导出索引', _migrate_recipe_updated_index),
+]
+
+def run_migrations():
+    """执行尚未应用的数据库迁移，返回本次执行的版本号列表"""
+    db.session.execute(db.text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version INTEGER PRIMARY KEY, description VARCHAR(200), applied_at DATETIME)'))
+    applied = {row[0] for row in db.session.execute(db.text('SELECT version FROM schema_migrations'))}
+    
+    executed = []
+    for version, description, upgrade in MIGRATIONS:
+        if version in applied:
+            continue
+        if upgrade() is False:
+            continue
+        db.session.execute(
+            db.text('INSERT INTO schema_migrations (version, description, applied_at) '
+                    'VALUES (:version, :description, :applied_at)'),
+            {'version': version, 'description': description,
+             'applied_at': get_shanghai_time().strftime('%Y-%m-%d %H:%M:%S')}
+        )
+        db.session.commit()
+        executed.append(version)
+    db.session.commit()
+    return executed
+
+def select_parent_recipes(recipe_ids, recipes_by_id):
+    """按所选配方ID取出已编译配方，并按配方名称排序（可选BOM编号顺序）"""
+    selected = [recipes_by_id[rid] for rid in map(_to_recipe_id, recipe_ids) if rid in recipes_by_id]
+    selected.sort(key=lambda recipe: recipe.recipe_name)
+    return selected
+
+# 多层BOM展开：项目类别为N（虚拟件）且物料编码与某个活跃配方名称相同的配方项引用该子配方。
+# 展开时该行被子配方的配方项替换，子配方项数量乘以引用行的数量，展开后的配方项按0010、0020...
+# 重新编号。同一次请求中每个配方只展开一次，被大量父物料共用的子配方不会重复展开。
+PHANTOM_PROJECT_CATEGORY = 'N'
+
+class RecipeExploder:
+    """在一次生成请求内展开子配方引用，记忆各配方的展开结果"""
+
+    def __init__(self):
+        self._recipes = {}  # 配方名称 -> 活跃的CompiledRecipe
+        self._missing = set()  # 已确认不是活跃配方的名称
+        self._lines = {}  # 配方ID -> 展开后的配方项（未重新编号）
+        self._exploded = {}  # 配方ID -> 展开并重新编号后的CompiledRecipe
+
+    def _reference(self, item):
+        if item.project_category != PHANTOM_PROJECT_CATEGORY:
+            return None
+        return self._recipes.get(item.material_code)
+
+    def load(self, recipes):
+        """逐层批量加载引用到的子配方，并检查循环引用（存在时抛出ValueError）"""
+        pending = [recipe for recipe in recipes if recipe.is_active]
+        self._recipes.update((recipe.recipe_name, recipe) for recipe in pending)
+        while pending:
+            names = {item.material_code for recipe in pending for item in recipe.items
+                     if item.project_category == PHANTOM_PROJECT_CATEGORY}
+            names -= self._recipes.keys() | self._missing
+            loaded = [recipe for recipe in recipe_cache.get_by_names(names).values() if recipe.is_active] if names else []
+            self._recipes.update((recipe.recipe_name, recipe) for recipe in loaded)
+            self._missing |= names - self._recipes.keys()
+            pending = loaded
+
+        # 深度优先遍历，遇到仍在当前路径上的配方即为循环引用
+        finished = set()
+        for recipe in recipes:
+            if recipe.id in finished:
+                continue
+            path = []
+            on_path = set()
+            stack = [(recipe, iter(recipe.items))]
+            path.append(recipe.recipe_name)
+            on_path.add(recipe.id)
+            while stack:
+                current, items = stack[-1]
+                for item in items:
+                    child = self._reference(item)
+                    if child is None or child.id in finished:
+                        continue
+                    if child.id in on_path:
+                        cycle = path[path.index(child.recipe_name):] + [child.recipe_name]
+                        raise ValueError(f"配方存在循环引用：{' → '.join(cycle)}")
+                    stack.append((child, iter(child.items)))
+                    path.append(child.recipe_name)
+                    on_path.add(child.id)
+                    break
+                else:
+                    stack.pop()
+                    path.pop()
+                    on_path.discard(current.id)
+                    finished.add(current.id)
+
+    def _expand(self, recipe):
+        lines = self._lines.get(recipe.id)
+        if lines is None:
+            lines = []
+            for item in recipe.items:
+                child = self._reference(item)
+                if child is None:
+                    lines.append(item)
+                else:
+                    lines.extend(line._replace(quantity=line.quantity * item.quantity) for line in self._expand(child))
+            self._lines[recipe.id] = lines
+        return lines
+
+    def explode(self, recipe):
+        """返回展开后的配方；不含子配方引用的配方原样返回（保留原行号）"""
+        exploded = self._exploded.get(recipe.id)
+        if exploded is None:
+            if any(self._reference(item) for item in recipe.items):
+                items = tuple(line._replace(line_number=f'{index * 10:04d}')
+                              for index, line in enumerate(self._expand(recipe), 1))
+                exploded = CompiledRecipe(recipe.id, recipe.recipe_name, recipe.description,
+                                          recipe.product_category, recipe.is_active, items)
+            else:
+                exploded = recipe
+            self._exploded[recipe.id] = exploded
+        return exploded
+
+def explode_recipes(recipes_by_id):
+    """展开配方中的子配方引用，返回 {配方ID: 展开后的CompiledRecipe}，存在循环引用时抛出ValueError"""
+    exploder = RecipeExploder()
+    exploder.load(recipes_by_id.values())
+    return {recipe_id: exploder.explode(recipe) for recipe_id, recipe in recipes_by_id.items()}
+
+# 配方列表分页：按排序列+ID做键集分页（游标为上一页最后一条记录的排序值和ID），
+# 每页查询只读取一页数据，不随页码增大而变慢
+RECIPE_PAGE_SIZE = 20
+RECIPE_PAGE_MAX_SIZE = 200
+RECIPE_SORT_COLUMNS = {'name': Recipe.recipe_name, 'created': Recipe.created_at, 'updated': Recipe.updated_at}
+RECIPE_PAGE_PARAMS = {'limit', 'cursor', 'offset', 'q', 'category', 'sort', 'ids_only'}
+UNCATEGORIZED = '未分类'
+
+def recipe_summary(recipe):
+    return {
+        'id': recipe.id,
+        'name': recipe.recipe_name,
+        'description': recipe.description,
+        'product_category': recipe.product_category or '',  # 添加产品类别
+        'created_at': recipe.created_at.strftime('%Y-%m-%d %H:%M:%S') if recipe.created_at else '',
+        'updated_at': recipe.updated_at.strftime('%Y-%m-%d %H:%M:%S') if recipe.updated_at else ''
+    }
+
+def recipe_category_filters(category=''):
+    """指定产品类别的筛选条件（"未分类"为类别为空），不限是否活跃"""
+    if category == UNCATEGORIZED:
+        return [db.or_(Recipe.product_category.is_(None), Recipe.product_category == '')]
+    if category:
+        return [Recipe.product_category == category]
+    return []
+
+def recipe_filters(search='', category=''):
+    """活跃配方的筛选条件：名称或描述包含搜索词、指定产品类别（"未分类"为类别为空）"""
+    filters = [Recipe.is_active == True]
+    if search:
+        pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        filters.append(db.or_(Recipe.recipe_name.like(pattern, escape='\\'),
+                              Recipe.description.like(pattern, escape='\\')))
+    return filters + recipe_category_filters(category)
+
+def recipe_category_counts(search=''):
+    """按产品类别统计活跃配方数量，类别为空的计入"未分类"（始终排在最后）"""
+    rows = db.session.query(Recipe.product_category, db.func.count()).filter(
+        *recipe_filters(search)
+    ).group_by(Recipe.product_category).all()
+    
+    counts = {}
+    uncategorized = 0
+    for category, count in rows:
+        if category:
+            counts[category] = count
+        else:
+            uncategorized += count
+    
+    facets = [{'category': category, 'count': counts[category]} for category in sorted(counts)]
+    facets.append({'category': UNCATEGORIZED, 'count': uncategorized})
+    return facets
+
+def encode_recipe_cursor(value, recipe_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, recipe_id], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_recipe_cursor(cursor, sort_field):
+    """解析分页游标，格式错误时抛出ValueError"""
+    try:
+        value, recipe_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if sort_field != 'name':
+            value = datetime.fromisoformat(value)
+        return value, int(recipe_id)
+    except (ValueError, TypeError):
+        raise ValueError('无效的分页游标')
+
+def query_recipe_page(args):
+    """按查询参数返回一页配方，参数错误时抛出ValueError"""
+    search = args.get('q', '').strip()
+    category = args.get('category', '').strip()
+    sort = args.get('sort', 'name_asc')
+    sort_field, _, direction = sort.partition('_')
+    if sort_field not in RECIPE_SORT_COLUMNS or direction not in ('asc', 'desc'):
+        raise ValueError(f'不支持的排序方式：{sort}')
+    
+    column = RECIPE_SORT_COLUMNS[sort_field]
+    descending = direction == 'desc'
+    order_by = [column.desc(), Recipe.id.desc()] if descending else [column.asc(), Recipe.id.asc()]
+    query = db.session.query(Recipe).filter(*recipe_filters(search, category))
+    
+    # 全选筛选结果：只返回全部匹配的配方ID
+    if args.get('ids_only'):
+        ids = [row[0] for row in query.with_entities(Recipe.id).order_by(*order_by)]
+        return {'ids': ids, 'total': len(ids)}
+    
+    try:
+        limit = min(max(int(args.get('limit', RECIPE_PAGE_SIZE)), 1), RECIPE_PAGE_MAX_SIZE)
+        offset = max(int(args.get('offset', 0)), 0)
+    except ValueError:
+        raise ValueError('limit和offset必须是整数')
+    
+    cursor = args.get('cursor')
+    if cursor:
+        value, recipe_id = decode_recipe_cursor(cursor, sort_field)
+        key = db.tuple_(column, Recipe.id)
+        query = query.filter(key < (value, recipe_id) if descending else key > (value, recipe_id))
+    
+    query = query.order_by(*order_by)
+    if offset and not cursor:
+        # 跳转到指定页时使用offset，翻页时应使用游标
+        query = query.offset(offset)
+    
+    recipes = query.limit(limit + 1).all()
+    has_more = len(recipes) > limit
+    recipes = recipes[:limit]
+    
+    result = {
+        'recipes': [recipe_summary(recipe) for recipe in recipes],
+        'has_more': has_more,
+        'next_cursor': encode_recipe_cursor(getattr(recipes[-1], column.key), recipes[-1].id) if has_more else None
+    }
+    
+    # 首页附带总数和各类别数量（类别数量只受搜索词影响，不受类别筛选影响）
+    if not cursor:
+        facets = recipe_category_counts(search)
+        if category:
+            result['total'] = next((f['count'] for f in facets if f['category'] == category), 0)
+        else:
+            result['total'] = sum(f['count'] for f in facets)
+        result['facets'] = facets
+    return result
+
+def _fts_phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+def _search_recipe_ids(terms, limit, offset):
+    """返回 (当前页配方ID列表, 匹配总数, 使用的查询方式)，多个搜索词须同时匹配"""
+    if all(len(term) >= RECIPE_SEARCH_MIN_TERM_LENGTH for term in terms) and recipe_search_available():
+        params = {'match': ' '.join(map(_fts_phrase, terms)), 'limit': limit, 'offset': offset}
+        total = db.session.execute(db.text(
+            f'SELECT count(*) FROM {RECIPE_SEARCH_TABLE} WHERE {RECIPE_SEARCH_TABLE} MATCH :match'
+        ), params).scalar()
+        # 名称和物料编码命中的配方排在前面
+        ids = [row[0] for row in db.session.execute(db.text(
+            f'SELECT rowid FROM {RECIPE_SEARCH_TABLE} WHERE {RECIPE_SEARCH_TABLE} MATCH :match '
+            f'ORDER BY bm25({RECIPE_SEARCH_TABLE}, 10.0, 2.0, 2.0, 5.0, 1.0), rowid LIMIT :limit OFFSET :offset'
+        ), params)]
+        return ids, total, 'fts5'
+
+    # 搜索词过短或没有全文索引时逐条匹配
+    filters = [Recipe.is_active == True]
+    for term in terms:
+        pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        filters.append(db.or_(
+            Recipe.recipe_name.like(pattern, escape='\\'),
+            Recipe.description.like(pattern, escape='\\'),
+            Recipe.product_category.like(pattern, escape='\\'),
+            db.session.query(RecipeItem.id).filter(
+                RecipeItem.recipe_id == Recipe.id,
+                db.or_(RecipeItem.material_code.like(pattern, escape='\\'),
+                       RecipeItem.material_name.like(pattern, escape='\\'))
+            ).exists()
+        ))
+    query = db.session.query(Recipe.id).filter(*filters)
+    total = query.count()
+    ids = [row[0] for row in query.order_by(Recipe.recipe_name, Recipe.id).offset(offset).limit(limit)]
+    return ids, total, 'like'
+
+def search_recipes(args):
+    """全文搜索配方：匹配名称、描述、产品类别及配方项的物料编码和名称，参数错误时抛出ValueError"""
+    terms = args.get('q', '').split()
+    if not terms:
+        raise ValueError('请输入搜索内容')
+    try:
+        limit = min(max(int(args.get('limit', RECIPE_PAGE_SIZE)), 1), RECIPE_PAGE_MAX_SIZE)
+        offset = max(int(args.get('offset', 0)), 0)
+    except ValueError:
+        raise ValueError('limit和offset必须是整数')
+
+    ids, total, engine = _search_recipe_ids(terms, limit, offset)
+    recipes = {recipe.id: recipe for recipe in Recipe.query.filter(Recipe.id.in_(ids))} if ids else {}
+
+    # 列出各配方中物料编码或名称包含搜索词的配方项
+    matched_items = {recipe_id: [] for recipe_id in ids}
+    lowered = [term.lower() for term in terms]
+    if ids:
+        items = RecipeItem.query.filter(RecipeItem.recipe_id.in_(ids)).order_by(
+            RecipeItem.recipe_id, RecipeItem.line_number)
+        for item in items:
+            text = f'{item.material_code}\n{item.material_name}'.lower()
+            if any(term in text for term in lowered):
+                matched_items[item.recipe_id].append({
+                    'line_number': item.line_number,
+                    'material_code': item.material_code,
+                    'material_name': item.material_name,
+                    'quantity': item.quantity,
+                    'unit': item.unit
+                })
+
+    return {
+        'query': ' '.join(terms),
+        'engine': engine,
+        'total': total,
+        'has_more': offset + len(ids) < total,
+        'recipes': [dict(recipe_summary(recipes[rid]), matched_items=matched_items[rid])
+                    for rid in ids if rid in recipes]
+    }
+
+WHERE_USED_MAX_LINES = 1000  # 单次反查最多返回的配方项数
+
+def _prefix_upper_bound(prefix):
+    """前缀的范围查询上界（最后一个字符加1），比LIKE更能保证走索引"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def where_used(material_code, prefix=False):
+    """反查物料被哪些活跃配方使用：返回配方项的行号和数量，以及用这些配方生成过BOM的父物料"""
+    if prefix:
+        condition = db.and_(RecipeItem.material_code >= material_code,
+                            RecipeItem.material_code < _prefix_upper_bound(material_code))
+    else:
+        condition = RecipeItem.material_code == material_code
+    # 按物料索引取配方项，在限制条数之前用相关子查询按主键过滤掉停用配方的项，停用配方再多也不会占满条数
+    # （联表时SQLite可能改从配方表的is_active索引开始扫描）；再按ID取配方名称和类别
+    is_active = db.exists().where(Recipe.id == RecipeItem.recipe_id, Recipe.is_active == True)
+    rows = db.session.query(
+        RecipeItem.recipe_id, RecipeItem.line_number, RecipeItem.material_code,
+        RecipeItem.material_name, RecipeItem.quantity, RecipeItem.unit
+    ).filter(condition, is_active).order_by(RecipeItem.material_code, RecipeItem.recipe_id).limit(
+        WHERE_USED_MAX_LINES + 1
+    ).all()
+    truncated = len(rows) > WHERE_USED_MAX_LINES
+    rows = sorted(rows[:WHERE_USED_MAX_LINES], key=lambda row: (row.recipe_id, row.line_number))
+
+    active = {}
+    for chunk in _chunked(list({row.recipe_id for row in rows})):
+        for recipe in db.session.query(Recipe.id, Recipe.recipe_name, Recipe.product_category).filter(
+                Recipe.id.in_(chunk)):
+            active[recipe.id] = recipe
 
-class BOMRequest(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    parent_material_code = db.Column(db.String(50), nullable=False)
-    parent_material_name = db.Column(db.String(200), nullable=False)
-    basic_quantity = db.Column(db.Float, nullable=False)
-    basic_unit = db.Column(db.String(20), nullable=False)
-    recipe_ids = db.Column(db.Text, nullable=False)  # 存储多个配方ID，用逗号分隔
-    created_at = db.Column(db.DateTime, default=get_shanghai_time)
+    recipes = {}
+    for row in rows:
+        recipe = recipes.setdefault(row.recipe_id, {
+            'id': row.recipe_id,
+            'name': active[row.recipe_id].recipe_name,
+            'product_category': active[row.recipe_id].product_category or '',
+            'lines': [],
+            'parents': []
+        })
+        recipe['lines'].append({
+            'line_number': row.line_number,
+            'material_code': row.material_code,
+            'material_name': row.material_name,
+            'quantity': row.quantity,
+            'unit': row.unit
+        })
+
+    # 历史BOM生成记录中使用过这些配方的父物料（同一父物料多次生成时合并，保留最近一次的名称）
+    parent_codes = set()
+    for chunk in _chunked(list(recipes)):
+        parent_rows = db.session.query(
+            BOMRequestRecipe.recipe_id, BOMRequest.parent_material_code, BOMRequest.parent_material_name,
+            db.func.count(), db.func.max(BOMRequest.created_at)
+        ).join(BOMRequest, BOMRequest.id == BOMRequestRecipe.bom_request_id).filter(
+            BOMRequestRecipe.recipe_id.in_(chunk)
+        ).group_by(BOMRequestRecipe.recipe_id, BOMRequest.parent_material_code).all()
+        for recipe_id, code, name, count, last_requested in parent_rows:
+            recipes[recipe_id]['parents'].append({
+                'parent_material_code': code,
+                'parent_material_name': name,
+                'request_count': count,
+                'last_requested_at': last_requested.strftime('%Y-%m-%d %H:%M:%S') if last_requested else ''
+            })
+            parent_codes.add(code)
+    for recipe in recipes.values():
+        recipe['parents'].sort(key=lambda parent: parent['last_requested_at'], reverse=True)
+
+    return {
+        'material_code': material_code,
+        'prefix': prefix,
+        'recipe_count': len(recipes),
+        'line_count': len(rows),
+        'parent_count': len(parent_codes),
+        'truncated': truncated,
+        'recipes': sorted(recipes.values(), key=lambda recipe: recipe['name'])
+    }
+
+SUBSTITUTION_PREVIEW_RECIPES = 100  # 预览时最多列出的配方数
+
+def substitute_material(data):
+    """在全部活跃配方中批量替换物料：物料编码为from_code的配方项改为新的编码/名称，
+    数量乘以factor。dry_run（默认）只返回预览；否则以按配方ID分批的UPDATE语句在同一
+    事务中改写，只更新受影响配方的updated_at，并在同一事务中按新的配方项重算内容哈希。参数错误时抛出ValueError"""
+    from_code = str(data.get('from_code') or '').strip()
+    to_code = str(data.get('to_code') or '').strip() or None
+    to_name = str(data.get('to_name') or '').strip() or None
+    factor = data.get('factor')
+    if not from_code:
+        raise ValueError('请输入要替换的物料编码')
+    if factor is not None:
+        try:
+            factor = float(factor)
+        except (TypeError, ValueError):
+            raise ValueError('数量系数必须是有效的数字')
+        if not math.isfinite(factor) or factor <= 0:
+            raise ValueError('数量系数必须大于0')
+    if to_code is None and to_name is None and factor is None:
+        raise ValueError('请指定新的物料编码、物料名称或数量系数')
+    if to_code and len(to_code) > RecipeItem.material_code.type.length:
+        raise ValueError('物料编码过长')
+    if to_name and len(to_name) > RecipeItem.material_name.type.length:
+        raise ValueError('物料名称过长')
+
+    # 按物料索引找到配方项，再按主键过滤掉已停用的配方
+    rows = db.session.query(
+        RecipeItem.recipe_id, RecipeItem.line_number, RecipeItem.material_code,
+        RecipeItem.material_name, RecipeItem.quantity
+    ).filter(RecipeItem.material_code == from_code).order_by(RecipeItem.recipe_id).all()
+    recipes = {}
+    for chunk in _chunked(list({row.recipe_id for row in rows})):
+        for recipe in db.session.query(Recipe.id, Recipe.recipe_name, Recipe.description,
+                                       Recipe.product_category, Recipe.is_active).filter(Recipe.id.in_(chunk)):
+            if recipe.is_active:
+                recipes[recipe.id] = recipe
+    rows = [row for row in rows if row.recipe_id in recipes]
+    recipe_ids = sorted(recipes)
+
+    # 已含有新物料编码的配方，替换后同一物料会出现在两个配方项中
+    conflicts = set()
+    if to_code and to_code != from_code:
+        for chunk in _chunked(recipe_ids):
+            conflicts.update(row[0] for row in db.session.query(RecipeItem.recipe_id).filter(
+                RecipeItem.material_code == to_code, RecipeItem.recipe_id.in_(chunk)))
+
+    result = {
+        'success': True,
+        'dry_run': data.get('dry_run', True) is not False,
+        'recipe_count': len(recipe_ids),
+        'line_count': len(rows),
+        'conflict_recipe_ids': sorted(conflicts)
+    }
+
+    if result['dry_run']:
+        preview = {}
+        for row in rows:
+            if row.recipe_id not in preview:
+                if len(preview) >= SUBSTITUTION_PREVIEW_RECIPES:
+                    continue
+                preview[row.recipe_id] = {'id': row.recipe_id, 'name': recipes[row.recipe_id].recipe_name,
+                                          'lines': []}
+            preview[row.recipe_id]['lines'].append({
+                'line_number': row.line_number,
+                'material_code': row.material_code,
+                'material_name': row.material_name,
+                'quantity': row.quantity,
+                'new_material_code': to_code or row.material_code,
+                'new_material_name': to_name or row.material_name,
+                'new_quantity': row.quantity * factor if factor is not None else row.quantity
+            })
+        result['recipes'] = list(preview.values())
+        return result
+
+    values = {}
+    if to_code:
+        values['material_code'] = to_code
+    if to_name:
+        values['material_name'] = to_name
+    if factor is not None:
+        values['quantity'] = RecipeItem.quantity * factor
+    for chunk in _chunked(recipe_ids):
+        db.session.execute(
+            db.update(RecipeItem).where(RecipeItem.material_code == from_code, RecipeItem.recipe_id.in_(chunk))
+            .values(**values).execution_options(synchronize_session=False))
+    store_recipe_hashes(load_recipe_hashes(recipes.values()), updated_at=get_shanghai_time())
+    update_recipe_search_index(recipe_ids)
+    db.session.commit()
+    if recipe_ids:
+        notify_recipes_changed(recipe_ids)
+    return result
 
 @app.route('/')
 def index():
@@ -95,17 +2026,61 @@ def admin_logout():
 def admin():
     return render_template('admin.html')
 
+@app.route('/admin/slow_requests')
+@login_required
+def admin_slow_requests():
+    """慢请求记录列表"""
+    return render_template('slow_requests.html', dumps=slow_requests.summaries(),
+                           threshold=slow_requests.threshold)
+
+@app.route('/api/admin/slow_requests/<dump_id>')
+@login_required
+def download_slow_request(dump_id):
+    """下载慢请求记录（JSON）"""
+    path = slow_requests.path(dump_id)
+    if not path:
+        return jsonify({'error': '记录不存在'}), 404
+    return send_file(path, as_attachment=True, download_name=f'slow_request_{dump_id}.json',
+                     mimetype='application/json')
+
 @app.route('/api/recipes')
+@catalog_conditional
 def get_recipes():
-    recipes = Recipe.query.filter_by(is_active=True).all()
-    return jsonify([{
-        'id': r.id,
-        'name': r.recipe_name,
-        'description': r.description,
-        'product_category': r.product_category or '',  # 添加产品类别
-        'created_at': r.created_at.strftime('%Y-%m-%d %H:%M:%S') if r.created_at else '',
-        'updated_at': r.updated_at.strftime('%Y-%m-%d %H:%M:%S') if r.updated_at else ''
-    } for r in recipes])
+    # 不带分页参数时保持原有行为，返回全部活跃配方
+    if not RECIPE_PAGE_PARAMS & set(request.args):
+        recipes = Recipe.query.filter_by(is_active=True).all()
+        return jsonify([recipe_summary(r) for r in recipes])
+    
+    try:
+        return jsonify(query_recipe_page(request.args))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+@app.route('/api/recipe/search')
+@catalog_conditional
+def search_recipe_index():
+    try:
+        return jsonify(search_recipes(request.args))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+@app.route('/api/recipe/where_used')
+def get_where_used():
+    """物料反查：?material_code=编码，带prefix=1时按编码前缀匹配"""
+    material_code = request.args.get('material_code', '').strip()
+    if not material_code:
+        return jsonify({'success': False, 'message': '请输入物料编码'}), 400
+    return jsonify(where_used(material_code, prefix=bool(request.args.get('prefix'))))
+
+@app.route('/api/recipe/substitute_material', methods=['POST'])
+@login_required
+@db_writer.serialized
+def substitute_recipe_material():
+    """批量替换物料，默认只预览，请求中带"dry_run": false时执行替换"""
+    try:
+        return jsonify(substitute_material(request.json or {}))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
 
 @app.route('/api/session/status')
 def check_session_status():
@@ -116,26 +2091,28 @@ def check_session_status():
         'login_time': session.get('login_time', '')
     })
 
+@app.route('/api/cache/stats')
+@login_required
+def get_cache_stats():
+    """查看配方缓存命中情况"""
+    return jsonify(dict(recipe_cache.stats(), catalog_version=catalog_version.value))
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus文本格式的性能指标，供Prometheus抓取"""
+    if not metrics.enabled:
+        return jsonify({'error': '性能指标未启用'}), 404
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/recipe/categories')
+@catalog_conditional
 def get_recipe_categories():
-    """获取所有现有的产品类别"""
-    categories = db.session.query(Recipe.product_category).filter(
-        Recipe.is_active == True,
-        Recipe.product_category.isnot(None),
-        Recipe.product_category != ''
-    ).distinct().all()
-    
-    # 提取类别名称并排序
-    category_list = [cat[0] for cat in categories if cat[0]]
-    category_list.sort()
-    
-    # 添加"未分类"选项
-    category_list.append("未分类")
-    
-    return jsonify(category_list)
+    """获取所有现有的产品类别（已排序，最后为"未分类"）"""
+    return jsonify([facet['category'] for facet in recipe_category_counts()])
 
 @app.route('/api/recipe/<int:recipe_id>')
 @login_required
+@catalog_conditional
 def get_recipe_items(recipe_id):
     items = RecipeItem.query.filter_by(recipe_id=recipe_id).order_by(RecipeItem.line_number).all()
     return jsonify([{
@@ -150,12 +2127,14 @@ def get_recipe_items(recipe_id):
 
 @app.route('/api/recipe/<int:recipe_id>', methods=['PUT'])
 @login_required
+@db_writer.serialized
 def update_recipe(recipe_id):
     data = request.json
     recipe = Recipe.query.get(recipe_id)
     if not recipe:
         return jsonify({'success': False, 'message': '配方不存在'}), 404
     
+    old_name = recipe.recipe_name
     recipe.recipe_name = data['name']
     recipe.description = data['description']
     recipe.product_category = data.get('product_category', '')  # 更新产品类别
@@ -176,23 +2155,42 @@ def update_recipe(recipe_id):
             project_category=item['project_category']
         )
         db.session.add(recipe_item)
+    recipe.content_hash = compute_recipe_hash(recipe.description, recipe.product_category, data['items'])
+    update_recipe_search_index([recipe.id])
     
     db.session.commit()
+    notify_recipes_changed([recipe.id], [old_name, recipe.recipe_name])
     return jsonify({'success': True, 'message': '配方更新成功'})
 
 @app.route('/api/recipe/<int:recipe_id>', methods=['DELETE'])
 @login_required
+@db_writer.serialized
 def delete_recipe(recipe_id):
     recipe = Recipe.query.get(recipe_id)
     if not recipe:
         return jsonify({'success': False, 'message': '配方不存在'}), 404
     
-    # 软删除：设置is_active为False
+    # 软删除：设置is_active为False，更新时间作为增量导出中的删除时间
     recipe.is_active = False
+    recipe.updated_at = get_shanghai_time()
+    update_recipe_search_index([recipe_id])
     db.session.commit()
+    notify_recipes_changed([recipe_id])
     
     return jsonify({'success': True, 'message': '配方删除成功'})
 
+def parse_recipe_id_list(recipe_ids):
+    """解析BOMRequest.recipe_ids中逗号分隔的配方ID，去重并忽略无效值"""
+    parsed = (_to_recipe_id(value) for value in str(recipe_ids or '').split(','))
+    return list(dict.fromkeys(rid for rid in parsed if rid is not None))
+
+def record_bom_request(fields):
+    bom_request = BOMRequest(**fields)
+    db.session.add(bom_request)
+    db.session.flush()  # 获取bom_request.id
+    for recipe_id in parse_recipe_id_list(bom_request.recipe_ids):
+        db.session.add(BOMRequestRecipe(bom_request_id=bom_request.id, recipe_id=recipe_id))
+
 @app.route('/api/generate_bom', methods=['POST'])
 def generate_bom():
     data = request.json
@@ -204,117 +2202,68 @@ def generate_bom():
     if not data['recipe_ids']:
         return jsonify({'success': False, 'message': '请选择至少一个配方'}), 400
     
-    # 创建BOM请求记录
-    bom_request = BOMRequest(
-        parent_material_code=data['parent_material_code'],
-        parent_material_name=data['parent_material_name'],
-        basic_quantity=data['basic_quantity'],
-        basic_unit=data['basic_unit'],
-        recipe_ids=','.join(map(str, data['recipe_ids']))  # 将配方ID数组转换为逗号分隔的字符串
-    )
-    db.session.add(bom_request)
-    db.session.commit()
-    
-    # 获取所有选中的配方信息
-    all_items = []
-    for recipe_id in data['recipe_ids']:
-        recipe = Recipe.query.get(recipe_id)
-        if recipe:
-            items = RecipeItem.query.filter_by(recipe_id=recipe_id).order_by(RecipeItem.line_number).all()
-            # 为每个配方项添加配方信息
-            for item in items:
-                all_items.append({
-                    'recipe_name': recipe.recipe_name,
-                    'recipe_description': recipe.description,
-                    'line_number': item.line_number,
-                    'material_code': item.material_code,
-                    'material_name': item.material_name,
-                    'quantity': item.quantity,
-                    'unit': item.unit,
-                    'project_category': item.project_category
-                })
-    
-    # 生成Excel文件
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "BOM表"
-    
-    # 设置列宽
-    column_widths = [15, 10, 20, 20, 30, 15, 10, 10, 10, 15, 15, 15, 20, 30, 15, 15]
-    for i, width in enumerate(column_widths, 1):
-        ws.column_dimensions[openpyxl.utils.get_column_letter(i)].width = width
+    output_format = data.get('format', 'xlsx')
+    if output_format not in BOM_OUTPUT_FORMATS:
+        return jsonify({'success': False, 'message': f'不支持的输出格式：{output_format}'}), 400
     
-    # 表头
-    headers = ['字段名称', '工厂', 'BOM可选文本', '父项物料号', '物料名称', '生效日期', 
-               'BOM用途', '可选BOM', 'BOM状态', '基本数量', '基本单位', '行项目号', 
-               '项目类别', '子项物料号', '子项物料描述', '子项数量', '子项单位']
+    # 获取所有选中的配方信息（按配方名称排序）
+    recipes = select_parent_recipes(data['recipe_ids'], recipe_cache.get_by_ids(data['recipe_ids']))
     
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal='center', vertical='center')
+    # 多层展开：把虚拟件行引用的子配方逐层展开
+    if data.get('explode'):
+        try:
+            exploded = explode_recipes({recipe.id: recipe for recipe in recipes})
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        recipes = [exploded[recipe.id] for recipe in recipes]
     
-    # 按配方名称排序
-    all_items.sort(key=lambda x: x['recipe_name'])
+    # 创建BOM请求记录（交给后台写入线程，生成BOM不必等待数据库写锁）
+    db_writer.submit(record_bom_request, {
+        'parent_material_code': data['parent_material_code'],
+        'parent_material_name': data['parent_material_name'],
+        'basic_quantity': data['basic_quantity'],
+        'basic_unit': data['basic_unit'],
+        'recipe_ids': ','.join(map(str, data['recipe_ids']))  # 将配方ID数组转换为逗号分隔的字符串
+    })
     
-    # 数据行 - 从第8行开始填写数据（第2-7行为空白）
-    row = 8
-    current_recipe = None
-    bom_counter = 0
+    column_widths = [15, 10, 20, 20, 30, 15, 10, 10, 10, 15, 15, 15, 20, 30, 15, 15]
+    download_name = f'BOM表.{output_format}'
     
-    for item in all_items:
-        # 如果是新配方，更新计数器
-        if current_recipe != item['recipe_name']:
-            current_recipe = item['recipe_name']
-            bom_counter += 1
-        
-        # 每行都填写完整的数据
-        ws.cell(row=row, column=1, value='')  # 字段名称
-        ws.cell(row=row, column=2, value='P060')  # 工厂
-        ws.cell(row=row, column=3, value=item['recipe_name'])  # BOM可选文本
-        ws.cell(row=row, column=4, value=data['parent_material_code'])  # 父项物料号
-        ws.cell(row=row, column=5, value=data['parent_material_name'])  # 物料名称
-        ws.cell(row=row, column=6, value='')  # 生效日期
-        ws.cell(row=row, column=7, value='1')  # BOM用途
-        ws.cell(row=row, column=8, value=f"{bom_counter:02d}")  # 可选BOM
-        ws.cell(row=row, column=9, value='01')  # BOM状态
-        ws.cell(row=row, column=10, value=data['basic_quantity'])  # 基本数量
-        ws.cell(row=row, column=11, value=data['basic_unit'])  # 基本单位
-        ws.cell(row=row, column=12, value=item['line_number'])  # 行项目号
-        ws.cell(row=row, column=13, value=item['project_category'])  # 项目类别
-        ws.cell(row=row, column=14, value=item['material_code'])  # 子项物料号
-        ws.cell(row=row, column=15, value=item['material_name'])  # 子项物料描述
-        # 子项数量计算：只有KG和M单位才乘以基本数量，EA单位保持原数量
-        if item['unit'] in ['KG', 'M']:
-            calculated_quantity = item['quantity'] * data['basic_quantity']
+    # 流式模式：直接在响应中返回文件内容，无需再请求下载
+    if data.get('stream'):
+        if output_format == 'xlsx':
+            write = lambda target: stream_bom_workbook(target, "BOM表", column_widths, [(data, recipes)])
         else:
-            calculated_quantity = item['quantity']
-        ws.cell(row=row, column=16, value=calculated_quantity)  # 子项数量
-        ws.cell(row=row, column=17, value=item['unit'])  # 子项单位
-        row += 1
+            write = lambda target: write_bom_text(target, [(data, recipes)], output_format)
+        return send_streaming_file(write, download_name)
+    
+    if output_format == 'xlsx':
+        # 生成Excel文件
+        writer = BOMSheetWriter("BOM表", column_widths)
+        writer.append_parent(data, recipes)
+        write = writer.save
+    else:
+        write = lambda path: write_bom_text(path, [(data, recipes)], output_format)
     
     # 保存文件
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-    wb.save(temp_file.name)
-    temp_file.close()
+    token = artifact_store.create('.' + output_format, download_name, write)
     
     return jsonify({
         'success': True,
         'message': 'BOM表生成成功',
-        'file_path': temp_file.name
+        'download_url': url_for('download_artifact', token=token)
     })
 
-@app.route('/api/download_bom/<path:file_path>')
-def download_bom(file_path):
-    try:
-        return send_file(file_path, as_attachment=True, download_name='BOM表.xlsx')
-    except Exception as e:
-        return jsonify({'error': str(e)}), 400
+@app.route('/api/download/<token>')
+def download_artifact(token):
+    """按令牌下载生成的文件"""
+    return send_artifact(token)
 
 
 
 @app.route('/api/recipe', methods=['POST'])
 @login_required
+@db_writer.serialized
 def create_recipe():
     try:
         data = request.json
@@ -322,28 +2271,38 @@ def create_recipe():
         # 检查配方名称是否已存在，如果存在则进行覆盖处理
         existing_recipe = Recipe.query.filter_by(recipe_name=data['name']).first()
         if existing_recipe:
+            items = normalize_recipe_items(data['items'])
+            description = data.get('description', '')
+            product_category = data.get('product_category', '')
+            content_hash = compute_recipe_hash(description, product_category, items)
+            
+            # 内容与已有配方完全一致时不重写
+            ensure_recipe_hashes([existing_recipe])
+            if existing_recipe.content_hash == content_hash:
+                db.session.commit()
+                return jsonify({
+                    'success': True,
+                    'id': existing_recipe.id,
+                    'unchanged': True,
+                    'message': f'配方 "{data["name"]}" 已存在，内容未变化'
+                })
+            
             # 删除旧的配方项
             RecipeItem.query.filter_by(recipe_id=existing_recipe.id).delete()
             
             # 更新配方基本信息
-            existing_recipe.description = data.get('description', '')
-            existing_recipe.product_category = data.get('product_category', '')
+            existing_recipe.description = description
+            existing_recipe.product_category = product_category
+            existing_recipe.content_hash = content_hash
             existing_recipe.updated_at = get_shanghai_time()
             
             # 添加新的配方项
-            for item in data['items']:
-                recipe_item = RecipeItem(
-                    recipe_id=existing_recipe.id,
-                    material_code=str(item['material_code']).strip(),
-                    material_name=str(item['material_name']).strip(),
-                    quantity=float(item['quantity']),
-                    unit=str(item.get('unit', 'KG')).strip(),
-                    line_number=str(item.get('line_number', '')).strip(),
-                    project_category=str(item.get('project_category', 'L')).strip()
-                )
-                db.session.add(recipe_item)
+            for item in items:
+                db.session.add(RecipeItem(recipe_id=existing_recipe.id, **item))
+            update_recipe_search_index([existing_recipe.id])
             
             db.session.commit()
+            notify_recipes_changed([existing_recipe.id], [data['name']])
             return jsonify({
                 'success': True, 
                 'id': existing_recipe.id, 
@@ -370,28 +2329,23 @@ def create_recipe():
                 return jsonify({'success': False, 'message': f'第{i+1}个配方项：数量必须是有效的数字'}), 400
         
         # 创建配方
+        items = normalize_recipe_items(data['items'])
         recipe = Recipe(
             recipe_name=data['name'],
             description=data.get('description', ''),
-            product_category=data.get('product_category', '')
+            product_category=data.get('product_category', ''),
+            content_hash=compute_recipe_hash(data.get('description', ''), data.get('product_category', ''), items)
         )
         db.session.add(recipe)
         db.session.flush()  # 获取recipe.id
         
         # 添加配方项
-        for item in data['items']:
-            recipe_item = RecipeItem(
-                recipe_id=recipe.id,
-                material_code=str(item['material_code']).strip(),
-                material_name=str(item['material_name']).strip(),
-                quantity=float(item['quantity']),
-                unit=str(item.get('unit', 'KG')).strip(),  # 默认KG
-                line_number=str(item.get('line_number', '')).strip(),
-                project_category=str(item.get('project_category', 'L')).strip()
-            )
-            db.session.add(recipe_item)
+        for item in items:
+            db.session.add(RecipeItem(recipe_id=recipe.id, **item))
+        update_recipe_search_index([recipe.id])
         
         db.session.commit()
+        notify_recipes_changed([recipe.id], [recipe.recipe_name])
         return jsonify({'success': True, 'id': recipe.id, 'message': '配方创建成功'})
         
     except Exception as e:
@@ -431,11 +2385,70 @@ def download_recipe_template():
             ws.cell(row=row_idx, column=col_idx, value=value)
     
     # 保存文件
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-    wb.save(temp_file.name)
-    temp_file.close()
+    return send_artifact(artifact_store.create('.xlsx', '配方导入模板.xlsx', lambda path: save_workbook(wb, path)))
+
+def write_imported_recipes(recipe_groups):
+    """写入导入的配方：内容哈希未变化的配方跳过；有变化的配方批量删除旧配方项，
+    配方项以executemany方式批量插入。返回 (新建, 覆盖, 未变化, 写入的配方项数)"""
+    created_recipes = []
+    updated_recipes = []
+    unchanged_recipes = []
+    
+    recipes_by_name = {}
+    for chunk in _chunked(recipe_groups):
+        for recipe in Recipe.query.filter(Recipe.recipe_name.in_(chunk)).all():
+            recipes_by_name[recipe.recipe_name] = recipe
+    ensure_recipe_hashes(recipes_by_name.values())
+    
+    changed_names = []
+    for recipe_name, recipe_data in recipe_groups.items():
+        content_hash = compute_recipe_hash(recipe_data['description'], recipe_data['product_category'],
+                                           recipe_data['items'])
+        existing_recipe = recipes_by_name.get(recipe_name)
+        if existing_recipe:
+            if existing_recipe.content_hash == content_hash:
+                unchanged_recipes.append(recipe_name)
+                continue
+            # 配方名称已存在且内容有变化，进行覆盖处理
+            existing_recipe.description = recipe_data['description']
+            existing_recipe.product_category = recipe_data['product_category']
+            existing_recipe.content_hash = content_hash
+            existing_recipe.updated_at = get_shanghai_time()
+            updated_recipes.append(recipe_name)
+        else:
+            # 创建新配方
+            recipe = Recipe(
+                recipe_name=recipe_name,
+                description=recipe_data['description'],
+                product_category=recipe_data['product_category'],
+                content_hash=content_hash
+            )
+            db.session.add(recipe)
+            recipes_by_name[recipe_name] = recipe
+            created_recipes.append(recipe_name)
+        changed_names.append(recipe_name)
+    
+    # 删除被覆盖配方的旧配方项
+    for chunk in _chunked([recipes_by_name[name].id for name in updated_recipes]):
+        RecipeItem.query.filter(RecipeItem.recipe_id.in_(chunk)).delete(synchronize_session=False)
+    db.session.flush()  # 获取新配方的ID
+    
+    item_rows = []
+    for recipe_name in changed_names:
+        recipe_id = recipes_by_name[recipe_name].id
+        for item_data in recipe_groups[recipe_name]['items']:
+            item_rows.append(dict(item_data, recipe_id=recipe_id))
+    if item_rows:
+        db.session.execute(RecipeItem.__table__.insert(), item_rows)
+    total_items = len(item_rows)
+    changed_recipe_ids = [recipes_by_name[name].id for name in changed_names]
+    update_recipe_search_index(changed_recipe_ids)
+    
+    db.session.commit()
+    if changed_names:
+        notify_recipes_changed(changed_recipe_ids, changed_names)
     
-    return send_file(temp_file.name, as_attachment=True, download_name='配方导入模板.xlsx')
+    return created_recipes, updated_recipes, unchanged_recipes, total_items
 
 @app.route('/api/recipe/import', methods=['POST'])
 @login_required
@@ -449,108 +2462,51 @@ def import_recipe():
         return jsonify({'success': False, 'message': '没有选择文件'}), 400
     
     try:
-        # 读取Excel文件
-        wb = openpyxl.load_workbook(file)
-        ws = wb.active
+        timings = {}
         
-        # 从Excel文件中读取配方信息，而不是从表单
+        # 解析并校验：只读模式逐行流式读取单元格值，读一行校验一行并按配方名称分组，
+        # 不在内存中保留工作表的全部行
         # 模板格式：A-I列分别为：配方名称、配方描述、行号、物料编码、物料名称、数量、单位、类别、产品类别
-        
-        # 读取配方项并分组
-        recipe_groups = {}  # 按配方名称分组
-        
-        for row in range(2, ws.max_row + 1):  # 从第2行开始（跳过表头）
-            recipe_name = ws.cell(row=row, column=1).value
-            recipe_description = ws.cell(row=row, column=2).value
-            line_number = ws.cell(row=row, column=3).value
-            material_code = ws.cell(row=row, column=4).value
-            material_name = ws.cell(row=row, column=5).value
-            quantity = ws.cell(row=row, column=6).value
-            unit = ws.cell(row=row, column=7).value
-            project_category = ws.cell(row=row, column=8).value or 'L'
-            product_category = ws.cell(row=row, column=9).value or ''
-            
-            # 检查必填字段
-            if not all([recipe_name, line_number, material_code, material_name, quantity, unit]):
-                continue  # 跳过不完整的行
-            
-            # 按配方名称分组
-            if recipe_name not in recipe_groups:
-                recipe_groups[recipe_name] = {
-                    'description': recipe_description or '',
-                    'product_category': product_category or '',
-                    'items': []
-                }
-            
-            recipe_groups[recipe_name]['items'].append({
-                'line_number': str(line_number),
-                'material_code': str(material_code),
-                'material_name': str(material_name),
-                'quantity': float(quantity),
-                'unit': str(unit),
-                'project_category': str(project_category)
-            })
-        
-        # 创建配方和配方项
-        total_items = 0
-        created_recipes = []
-        updated_recipes = []
-        
-        for recipe_name, recipe_data in recipe_groups.items():
-            # 检查配方名称是否已存在
-            existing_recipe = Recipe.query.filter_by(recipe_name=recipe_name).first()
-            
-            if existing_recipe:
-                # 配方名称已存在，进行覆盖处理
-                existing_recipe.description = recipe_data['description']
-                existing_recipe.product_category = recipe_data['product_category']
-                existing_recipe.updated_at = get_shanghai_time()
-                
-                # 删除旧的配方项
-                RecipeItem.query.filter_by(recipe_id=existing_recipe.id).delete()
-                
-                # 添加新的配方项
-                for item_data in recipe_data['items']:
-                    recipe_item = RecipeItem(
-                        recipe_id=existing_recipe.id,
-                        material_code=item_data['material_code'],
-                        material_name=item_data['material_name'],
-                        quantity=item_data['quantity'],
-                        unit=item_data['unit'],
-                        line_number=item_data['line_number'],
-                        project_category=item_data['project_category']
-                    )
-                    db.session.add(recipe_item)
-                    total_items += 1
+        started = time.perf_counter()
+        recipe_groups = {}
+        wb = openpyxl.load_workbook(file, read_only=True)
+        try:
+            for row in wb.active.iter_rows(min_row=2, max_col=9, values_only=True):  # 从第2行开始（跳过表头）
+                row = tuple(row) + (None,) * (9 - len(row))
+                (recipe_name, recipe_description, line_number, material_code, material_name,
+                 quantity, unit, project_category, product_category) = row
+                project_category = project_category or 'L'
+                product_category = product_category or ''
                 
-                updated_recipes.append(recipe_name)
-            else:
-                # 创建新配方
-                recipe = Recipe(
-                    recipe_name=recipe_name,
-                    description=recipe_data['description'],
-                    product_category=recipe_data['product_category']
-                )
-                db.session.add(recipe)
-                db.session.flush()  # 获取recipe.id
+                # 检查必填字段
+                if not all([recipe_name, line_number, material_code, material_name, quantity, unit]):
+                    continue  # 跳过不完整的行
                 
-                # 创建配方项
-                for item_data in recipe_data['items']:
-                    recipe_item = RecipeItem(
-                        recipe_id=recipe.id,
-                        material_code=item_data['material_code'],
-                        material_name=item_data['material_name'],
-                        quantity=item_data['quantity'],
-                        unit=item_data['unit'],
-                        line_number=item_data['line_number'],
-                        project_category=item_data['project_category']
-                    )
-                    db.session.add(recipe_item)
-                    total_items += 1
+                # 按配方名称分组
+                if recipe_name not in recipe_groups:
+                    recipe_groups[recipe_name] = {
+                        'description': recipe_description or '',
+                        'product_category': product_category or '',
+                        'items': []
+                    }
                 
-                created_recipes.append(recipe_name)
+                recipe_groups[recipe_name]['items'].append({
+                    'line_number': str(line_number),
+                    'material_code': str(material_code),
+                    'material_name': str(material_name),
+                    'quantity': float(quantity),
+                    'unit': str(unit),
+                    'project_category': str(project_category)
+                })
+        finally:
+            wb.close()
+        timings['parse_ms'] = round((time.perf_counter() - started) * 1000, 1)
         
-        db.session.commit()
+        # 写入：在数据库写锁内执行，解析和校验阶段不占用写锁
+        started = time.perf_counter()
+        with db_writer.lock:
+            created_recipes, updated_recipes, unchanged_recipes, total_items = write_imported_recipes(recipe_groups)
+        timings['write_ms'] = round((time.perf_counter() - started) * 1000, 1)
         
         # 构建返回消息
         message_parts = []
@@ -558,16 +2514,23 @@ def import_recipe():
             message_parts.append(f'新建 {len(created_recipes)} 个配方')
         if updated_recipes:
             message_parts.append(f'覆盖 {len(updated_recipes)} 个配方')
+        if unchanged_recipes:
+            message_parts.append(f'{len(unchanged_recipes)} 个配方内容未变化')
         
-        message = f'配方导入成功，{", ".join(message_parts)}，共 {total_items} 个配方项'
+        message = f'配方导入成功，{", ".join(message_parts)}，共写入 {total_items} 个配方项'
         
         return jsonify({
             'success': True, 
             'message': message,
-            'recipe_count': len(created_recipes) + len(updated_recipes),
+            'recipe_count': len(created_recipes) + len(updated_recipes) + len(unchanged_recipes),
             'item_count': total_items,
+            'created_count': len(created_recipes),
+            'updated_count': len(updated_recipes),
+            'unchanged_count': len(unchanged_recipes),
             'created_recipes': created_recipes,
-            'updated_recipes': updated_recipes
+            'updated_recipes': updated_recipes,
+            'unchanged_recipes': unchanged_recipes,
+            'timings': timings
         })
         
     except Exception as e:
@@ -617,67 +2580,129 @@ def export_recipe(recipe_id):
         ws.cell(row=row_idx, column=4, value=item.quantity)
         ws.cell(row=row_idx, column=5, value=item.unit)
         ws.cell(row=row_idx, column=6, value=item.project_category)
+    metrics.inc('bom_rows_rendered_total', len(items))
     
     # 保存文件
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-    wb.save(temp_file.name)
-    temp_file.close()
+    return send_artifact(artifact_store.create('.xlsx', f'{recipe.recipe_name}.xlsx', lambda path: save_workbook(wb, path)))
+
+# 全部配方导出：一条按配方名称、行号排序的联接查询分批读取（yield_per），逐行写入只写工作簿，
+# 内存占用不随配方数量增长。表格格式：A-I列，第1行为表头，第2-7行为空白，数据从第8行开始
+RECIPE_EXPORT_HEADERS = ['配方名称', '配方描述', '行号', '物料编码', '物料名称', '数量', '单位', '类别', '产品类别']
+RECIPE_EXPORT_COLUMN_WIDTHS = [20, 40, 20, 15, 20, 30, 15, 15, 20]
+RECIPE_EXPORT_BATCH_SIZE = 2000  # 每批从数据库读取的配方项数
+
+# 增量导出：带since时只导出更新时间晚于since的配方，期间被删除（停用）的配方作为墓碑列在
+# "已删除配方"工作表中。变化的配方和墓碑由同一条按更新时间排序的查询读出（ix_recipe_updated），
+# 来自同一快照；导出中最大的更新时间作为水位线在响应头X-Export-Watermark中返回（带+08:00时区，
+# 其他时区的客户端解析后换算成本地时间再传回也指向同一时刻），下次作为since传入。
+# 配方写入串行提交，水位线之后提交的修改其更新时间一定晚于水位线，不会遗漏
+RECIPE_TOMBSTONE_HEADERS = ['配方名称', '产品类别', '删除时间']
+RECIPE_TOMBSTONE_COLUMN_WIDTHS = [20, 20, 20]
+
+def parse_export_since(value):
+    """解析增量导出的起始时间（ISO格式，带时区时换算为上海时间，不带时区时按上海时间），
+    格式错误时抛出ValueError"""
+    # 查询参数中未编码的"+08:00"会被解码成" 08:00"
+    value = re.sub(r'(T\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?) (\d{2}:\d{2})$', r'\1+\2', value)
+    try:
+        since = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'无效的起始时间：{value}')
+    if since.tzinfo is not None:
+        since = since.astimezone(pytz.timezone('Asia/Shanghai'))
+    return since.replace(tzinfo=None)
+
+def append_export_header(ws, headers, widths):
+    """设置列宽并写入加粗居中的表头（只写模式下列宽必须在写入数据前设置）"""
+    for i, width in enumerate(widths, 1):
+        ws.column_dimensions[openpyxl.utils.get_column_letter(i)].width = width
+    
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+def write_recipe_export(filename, since=None, category=''):
+    """写入配方导出文件：since为None时导出全部活跃配方的配方项，否则只导出更新时间晚于since的配方，
+    并列出期间删除的配方；category指定时只导出该产品类别。返回 (数据行数, 删除的配方数, 水位线)"""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("所有配方")
+    append_export_header(ws, RECIPE_EXPORT_HEADERS, RECIPE_EXPORT_COLUMN_WIDTHS)
+    for _ in range(2, 8):
+        ws.append([])
+    
+    columns = (Recipe.recipe_name, Recipe.description, RecipeItem.line_number, RecipeItem.material_code,
+               RecipeItem.material_name, RecipeItem.quantity, RecipeItem.unit, RecipeItem.project_category,
+               Recipe.product_category, Recipe.is_active, Recipe.updated_at)
+    if since is None:
+        query = (
+            db.select(*columns)
+            .join(RecipeItem, RecipeItem.recipe_id == Recipe.id)
+            .where(Recipe.is_active == True, *recipe_category_filters(category))
+            # 配方名称相同时再按配方ID排序，顺序可由两个索引直接给出，不需要临时排序
+            .order_by(Recipe.recipe_name, Recipe.id, RecipeItem.line_number)
+        )
+    else:
+        # 已删除的配方不联接配方项，只读出一行作为墓碑
+        query = (
+            db.select(*columns)
+            .outerjoin(RecipeItem, db.and_(RecipeItem.recipe_id == Recipe.id, Recipe.is_active == True))
+            .where(Recipe.updated_at > since, *recipe_category_filters(category))
+            .order_by(Recipe.updated_at, Recipe.id, RecipeItem.line_number)
+        )
+    rows = db.session.execute(query.execution_options(yield_per=RECIPE_EXPORT_BATCH_SIZE))
+    
+    row_count = 0
+    tombstones = []
+    watermark = since
+    for (recipe_name, description, line_number, material_code, material_name,
+         quantity, unit, project_category, product_category, is_active, updated_at) in rows:
+        if watermark is None or updated_at > watermark:
+            watermark = updated_at
+        if not is_active:
+            tombstones.append([recipe_name, product_category or '', updated_at])
+        elif line_number is not None:  # 没有配方项的配方不输出
+            ws.append([recipe_name, description or '', line_number, material_code, material_name,
+                       quantity, unit, project_category, product_category or ''])
+            row_count += 1
     
-    return send_file(temp_file.name, as_attachment=True, download_name=f'{recipe.recipe_name}.xlsx')
+    if since is not None:
+        tombstone_ws = wb.create_sheet("已删除配方")
+        append_export_header(tombstone_ws, RECIPE_TOMBSTONE_HEADERS, RECIPE_TOMBSTONE_COLUMN_WIDTHS)
+        for tombstone in tombstones:
+            tombstone_ws.append(tombstone)
+    
+    save_workbook(wb, filename)
+    metrics.inc('bom_rows_rendered_total', row_count + len(tombstones))
+    return row_count, len(tombstones), watermark
 
 @app.route('/api/recipe/export_all')
 @login_required
 def export_all_recipes():
-    """批量导出所有配方到单个表格"""
+    """批量导出所有配方到单个表格；带since时增量导出，带category时只导出该产品类别"""
     try:
-        # 获取所有活跃的配方
-        recipes = Recipe.query.filter_by(is_active=True).order_by(Recipe.recipe_name).all()
+        since = request.args.get('since', '').strip()
+        since = parse_export_since(since) if since else None
+        category = request.args.get('category', '').strip()
         
-        if not recipes:
+        if since is None and db.session.query(Recipe.id).filter(
+                Recipe.is_active == True, *recipe_category_filters(category)).first() is None:
             return jsonify({'error': '没有找到可导出的配方'}), 404
         
-        # 创建工作簿
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "所有配方"
-        
-        # 设置列宽
-        column_widths = [20, 40, 20, 15, 20, 30, 15, 15, 20]
-        for i, width in enumerate(column_widths, 1):
-            ws.column_dimensions[openpyxl.utils.get_column_letter(i)].width = width
+        result = {}
         
-        # 表头 A-I列：配方名称、配方描述、行号、物料编码、物料名称、数量、单位、类别、产品类别
-        headers = ['配方名称', '配方描述', '行号', '物料编码', '物料名称', '数量', '单位', '类别', '产品类别']
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center', vertical='center')
+        def write(filename):
+            _, _, result['watermark'] = write_recipe_export(filename, since, category)
         
-        # 数据行 - 从第8行开始填写数据（第2-7行为空白）
-        row = 8
-        for recipe in recipes:
-            # 获取配方项
-            items = RecipeItem.query.filter_by(recipe_id=recipe.id).order_by(RecipeItem.line_number).all()
-            
-            # 为每个配方项创建一行数据
-            for item in items:
-                ws.cell(row=row, column=1, value=recipe.recipe_name)  # A列：配方名称
-                ws.cell(row=row, column=2, value=recipe.description or '')  # B列：配方描述
-                ws.cell(row=row, column=3, value=item.line_number)  # C列：行号
-                ws.cell(row=row, column=4, value=item.material_code)  # D列：物料编码
-                ws.cell(row=row, column=5, value=item.material_name)  # E列：物料名称
-                ws.cell(row=row, column=6, value=item.quantity)  # F列：数量
-                ws.cell(row=row, column=7, value=item.unit)  # G列：单位
-                ws.cell(row=row, column=8, value=item.project_category)  # H列：类别
-                ws.cell(row=row, column=9, value=recipe.product_category or '')  # I列：产品类别
-                row += 1
-        
-        # 保存文件
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-        wb.save(temp_file.name)
-        temp_file.close()
-        
-        return send_file(temp_file.name, as_attachment=True, download_name='所有配方.xlsx')
+        download_name = '所有配方.xlsx' if since is None else '配方增量.xlsx'
+        response = send_artifact(artifact_store.create('.xlsx', download_name, write))
+        if result['watermark'] is not None:
+            response.headers['X-Export-Watermark'] = \
+                pytz.timezone('Asia/Shanghai').localize(result['watermark']).isoformat()
+        return response
         
     except Exception as e:
         return jsonify({'error': str(e)}), 400
@@ -686,25 +2711,351 @@ def export_all_recipes():
 
 
 
-@app.route('/api/download_batch_bom/<path:file_path>')
-def download_batch_bom(file_path):
-    """下载批量生成的BOM文件"""
+class BatchBOMError(Exception):
+    """批量BOM数据校验失败"""
+    
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.message = message
+        self.errors = errors or []
+
+def prepare_batch_bom(bom_data, explode=False):
+    """校验批量BOM表格数据并批量解析配方，返回 (bom_items, recipes_by_id)；
+    explode为真时展开子配方引用，各父物料共用同一份展开结果"""
+    # 汇总本批次用到的所有配方名称，一次性批量解析
+    recipe_names = set()
+    for item in bom_data:
+        if isinstance(item.get('recipe_names'), list):
+            recipe_names.update(name.strip() for name in item['recipe_names'] if isinstance(name, str))
+    recipes_by_name = {name: recipe for name, recipe in recipe_cache.get_by_names(recipe_names).items()
+                       if recipe.is_active}
+    
+    bom_items = []
+    errors = []
+    
+    for item in bom_data:
+        # 检查必填字段
+        if not all([item.get('parent_material_code'), item.get('parent_material_name'), 
+                   item.get('basic_quantity'), item.get('basic_unit'), item.get('recipe_names')]):
+            errors.append(f"第{item.get('line_number', '?')}行：必填字段不完整")
+            continue
+        
+        # 验证数量
+        try:
+            basic_quantity = float(item['basic_quantity'])
+            if basic_quantity <= 0:
+                errors.append(f"第{item.get('line_number', '?')}行：基本数量必须大于0")
+                continue
+        except:
+            errors.append(f"第{item.get('line_number', '?')}行：基本数量必须是数字")
+            continue
+        
+        # 查找配方ID
+        recipe_ids = []
+        for recipe_name in item['recipe_names']:
+            # 确保配方名称被正确清理（去除前后空格）
+            recipe_name = recipe_name.strip()
+            if not recipe_name:  # 跳过空的配方名称
+                continue
+                
+            recipe = recipes_by_name.get(recipe_name)
+            if recipe:
+                recipe_ids.append(recipe.id)
+            else:
+                errors.append(f"第{item.get('line_number', '?')}行：配方'{recipe_name}'不存在")
+                break
+        
+        if len(recipe_ids) != len(item['recipe_names']):
+            continue
+        
+        # 添加到BOM项目列表
+        bom_items.append({
+            'parent_material_code': str(item['parent_material_code']),
+            'parent_material_name': str(item['parent_material_name']),
+            'basic_quantity': basic_quantity,
+            'basic_unit': str(item['basic_unit']),
+            'recipe_ids': recipe_ids,
+            'remark': item.get('notes', '')
+        })
+    
+    if errors:
+        raise BatchBOMError(f'生成失败，发现 {len(errors)} 个错误', errors)
+    
+    if not bom_items:
+        raise BatchBOMError('未找到有效的BOM数据')
+    
+    # 本批次所有配方已在解析阶段加载，各父物料共用
+    recipes_by_id = {recipe.id: recipe for recipe in recipes_by_name.values()}
+    if explode:
+        try:
+            recipes_by_id = explode_recipes(recipes_by_id)
+        except ValueError as e:
+            raise BatchBOMError(str(e))
+    return bom_items, recipes_by_id
+
+BATCH_BOM_COLUMN_WIDTHS = [15, 10, 20, 20, 30, 15, 10, 10, 10, 15, 15, 15, 20, 30, 15, 15, 15]  # A-Q列
+
+def iter_batch_parents(bom_items, recipes_by_id, progress=None):
+    """依次产出(父物料, 已排序配方)，progress(已处理父物料数)用于汇报进度"""
+    for processed, bom_item in enumerate(bom_items, 1):
+        # 每个父物料的可选BOM重新从01开始计数
+        yield bom_item, select_parent_recipes(bom_item['recipe_ids'], recipes_by_id)
+        if progress:
+            progress(processed)
+
+def fill_batch_bom_sheet(bom_items, recipes_by_id, progress=None):
+    """把一组父物料的BOM写入新的批量BOM表，返回BOMSheetWriter"""
+    writer = BOMSheetWriter("批量BOM表", BATCH_BOM_COLUMN_WIDTHS)
+    
+    for bom_item, recipes in iter_batch_parents(bom_items, recipes_by_id, progress):
+        writer.append_parent(bom_item, recipes)
+    return writer
+
+def write_batch_bom_sheet(bom_items, recipes_by_id, filename, progress=None):
+    """把一组父物料的BOM写入批量BOM表文件，返回写入的数据行数"""
+    writer = fill_batch_bom_sheet(bom_items, recipes_by_id, progress)
+    writer.save(filename)
+    return writer.row_count
+
+def write_batch_bom_shard(bom_items, recipes_by_id, filename):
+    """在子进程中生成一个分片文件，返回写入的数据行数
+    
+    子进程中的指标不会回传，这里不记录指标，行数由父进程按返回值汇总。
+    """
+    writer = fill_batch_bom_sheet(bom_items, recipes_by_id)
+    writer.workbook.save(filename)
+    return writer.row_count
+
+def render_batch_bom(bom_items, recipes_by_id, progress=None, output_format='xlsx'):
+    """生成批量BOM文件并返回下载令牌，progress(已处理父物料数)用于汇报进度"""
+    if output_format == 'xlsx':
+        write = lambda path: write_batch_bom_sheet(bom_items, recipes_by_id, path, progress)
+    else:
+        write = lambda path: write_bom_text(path, iter_batch_parents(bom_items, recipes_by_id, progress), output_format)
+    return artifact_store.create('.' + output_format, f'批量BOM表.{output_format}', write)
+
+# 物料需求汇总：结果等于对批量BOM表全部数据行的子项数量按(物料编码, 单位)用math.fsum求和，
+# 但不逐行展开。先按配方统计各基本数量被多少个父物料使用，同一配方项在同一基本数量下的
+# 每行数量x相同，count行之和用Dekker乘法拆成x*count的舍入值和舍入误差两项交给fsum，
+# 结果与逐行求和逐位一致。
+_DEKKER_SPLITTER = 134217729.0  # 2**27 + 1
+
+def rollup_bom(bom_items, recipes_by_id):
+    """按(物料编码, 单位)汇总整批BOM的子项数量，返回按物料编码排序的汇总行列表"""
+    # (配方ID, 基本数量) -> 父物料数（同一父物料重复选择同一配方时计多次）
+    usage = {}
+    for bom_item in bom_items:
+        basic_quantity = bom_item['basic_quantity']
+        for recipe_id in bom_item['recipe_ids']:
+            if recipe_id in recipes_by_id:
+                key = (recipe_id, basic_quantity)
+                usage[key] = usage.get(key, 0) + 1
+    counts_by_recipe = {}
+    for (recipe_id, basic_quantity), count in usage.items():
+        counts_by_recipe.setdefault(recipe_id, []).append((basic_quantity, float(count)))
+
+    terms = {}
+    line_counts = {}
+    names = {}
+    for recipe_id in sorted(counts_by_recipe, key=lambda rid: recipes_by_id[rid].recipe_name):
+        counts = counts_by_recipe[recipe_id]
+        parent_count = sum(count for _, count in counts)
+        for item in recipes_by_id[recipe_id].items:
+            key = (item.material_code, item.unit)
+            if key not in terms:
+                terms[key] = []
+                names[key] = item.material_name
+                line_counts[key] = 0
+            line_counts[key] += int(parent_count)
+            append = terms[key].append
+            if item.unit in BOM_SCALED_UNITS:
+                pairs = [(item.quantity * basic_quantity, count) for basic_quantity, count in counts]
+            else:
+                pairs = [(item.quantity, parent_count)]
+            for value, count in pairs:
+                if count == 1.0:
+                    append(value)
+                    continue
+                # count远小于2**26，与拆分后的高低两部分相乘都没有舍入误差
+                product = value * count
+                scaled = _DEKKER_SPLITTER * value
+                value_high = scaled - (scaled - value)
+                append(product)
+                append((value_high * count - product) + (value - value_high) * count)
+
+    return [{
+        'material_code': code,
+        'material_name': names[(code, unit)],
+        'unit': unit,
+        'quantity': math.fsum(terms[(code, unit)]),
+        'line_count': line_counts[(code, unit)]
+    } for code, unit in sorted(terms)]
+
+# 多进程分片生成：Excel序列化是纯Python的CPU密集型操作，按父物料切分后在多个进程中并行生成。
+# 服务进程是多线程的（采样线程、后台写入线程、任务队列等），fork出的子进程可能继承其他
+# 线程正持有的锁而永久阻塞，子进程一律用spawn方式启动。
+_bom_process_pool = None
+_bom_process_pool_lock = threading.Lock()
+
+def get_bom_process_pool():
+    global _bom_process_pool
+    with _bom_process_pool_lock:
+        if _bom_process_pool is None:
+            _bom_process_pool = ProcessPoolExecutor(max_workers=app.config['BOM_PROCESS_WORKERS'],
+                                                    mp_context=multiprocessing.get_context('spawn'))
+        return _bom_process_pool
+
+def reset_bom_process_pool():
+    """进程池异常（如子进程被杀）后丢弃，下次使用时重新创建"""
+    global _bom_process_pool
+    with _bom_process_pool_lock:
+        if _bom_process_pool is not None:
+            _bom_process_pool.shutdown(wait=False, cancel_futures=True)
+            _bom_process_pool = None
+
+def split_bom_shards(bom_items, shard_count, min_parents):
+    """按父物料边界切分批次，保证同一父物料的BOM行不会跨分片（可选BOM编号不变）"""
+    shard_size = max(min_parents, math.ceil(len(bom_items) / shard_count))
+    return [bom_items[start:start + shard_size] for start in range(0, len(bom_items), shard_size)]
+
+def render_batch_bom_parallel(bom_items, recipes_by_id, progress=None):
+    """多进程分片生成批量BOM，每个分片一个工作簿，打包为zip文件并返回下载令牌"""
+    shards = split_bom_shards(bom_items, app.config['BOM_PROCESS_WORKERS'], app.config['BOM_SHARD_MIN_PARENTS'])
+    work_dir = tempfile.mkdtemp(prefix='bom_shards_')
+    
     try:
-        # 修复文件路径问题
-        if file_path.startswith('C:'):
-            # 处理Windows路径
-            file_path = file_path.replace('C:', 'C:\\')
-        elif file_path.startswith('C%3A'):
-            # 处理URL编码的路径
-            file_path = file_path.replace('C%3A', 'C:\\')
-        
-        # 确保文件存在
-        if not os.path.exists(file_path):
-            return jsonify({'error': '文件不存在'}), 404
+        pool = get_bom_process_pool()
+        futures = []
+        for index, shard in enumerate(shards, 1):
+            # 只把分片用到的配方传给子进程
+            used_ids = {recipe_id for bom_item in shard for recipe_id in bom_item['recipe_ids']}
+            shard_recipes = {recipe_id: recipes_by_id[recipe_id] for recipe_id in used_ids if recipe_id in recipes_by_id}
+            shard_path = os.path.join(work_dir, f'批量BOM表_{index:03d}.xlsx')
+            futures.append(pool.submit(write_batch_bom_shard, shard, shard_recipes, shard_path))
+        
+        processed = 0
+        try:
+            for future, shard in zip(futures, shards):
+                # 子进程中的指标不回传，行数由分片的返回值汇总
+                metrics.inc('bom_rows_rendered_total', future.result())
+                processed += len(shard)
+                if progress:
+                    progress(processed)
+        except BrokenProcessPool:
+            reset_bom_process_pool()
+            raise
+        
+        # xlsx本身已压缩，打包时不再压缩
+        def write_archive(path):
+            with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED) as archive:
+                for index in range(1, len(shards) + 1):
+                    name = f'批量BOM表_{index:03d}.xlsx'
+                    archive.write(os.path.join(work_dir, name), name)
+        
+        return artifact_store.create('.zip', '批量BOM表.zip', write_archive)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+class BOMJobQueue:
+    """批量BOM后台任务队列：固定数量的工作线程处理数据库中排队的任务"""
+    
+    PROGRESS_INTERVAL = 0.5  # 进度写入数据库的最小间隔（秒）
+    
+    def __init__(self, max_workers):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bom-job')
+        self.started_at = get_shanghai_time()
+        self._resume_lock = threading.Lock()
+        self._resumed = False
+        # 以WSGI方式部署时不会执行__main__，创建队列时即在工作线程中恢复未完成的任务；
+        # 多进程分片的子进程（spawn方式会重新导入本模块）不恢复
+        if multiprocessing.parent_process() is None:
+            self.executor.submit(self._resume_on_start)
+    
+    def submit(self, bom_data, parallel=False, output_format='xlsx', explode=False):
+        """登记任务并放入队列，立即返回任务记录"""
+        job = BOMJob(
+            id=uuid.uuid4().hex,
+            payload=json.dumps({'bom_data': bom_data, 'parallel': parallel, 'format': output_format,
+                                'explode': explode}, ensure_ascii=False),
+            total_rows=len(bom_data)
+        )
+        db.session.add(job)
+        db_writer.commit()
+        self.executor.submit(self._run, job.id)
+        return job
+    
+    def resume_pending(self):
+        """将队列创建前未完成的任务重新排队，每个进程只执行一次，返回任务数量"""
+        with self._resume_lock:
+            if self._resumed:
+                return 0
+            jobs = BOMJob.query.filter(BOMJob.status.in_(['queued', 'running']),
+                                       BOMJob.created_at < self.started_at).order_by(BOMJob.created_at).all()
+            for job in jobs:
+                job.status = 'queued'
+                job.processed_rows = 0
+            db_writer.commit()
+            job_ids = [job.id for job in jobs]
+            self._resumed = True
+        
+        for job_id in job_ids:
+            self.executor.submit(self._run, job_id)
+        return len(job_ids)
+    
+    def _resume_on_start(self):
+        with app.app_context():
+            try:
+                self.resume_pending()
+            except OperationalError:
+                # 数据库尚未建表或尚未迁移，启动脚本迁移后会再次调用resume_pending
+                db.session.rollback()
+    
+    def _run(self, job_id):
+        with app.app_context(), metrics.scope('bom_job'):
+            job = BOMJob.query.get(job_id)
+            if not job or job.status != 'queued':
+                return
             
-        return send_file(file_path, as_attachment=True, download_name='批量BOM表.xlsx')
-    except Exception as e:
-        return jsonify({'error': str(e)}), 400
+            job.status = 'running'
+            job.started_at = get_shanghai_time()
+            db_writer.commit()
+            
+            last_report = time.monotonic()
+            
+            def report_progress(processed):
+                nonlocal last_report
+                now = time.monotonic()
+                if now - last_report >= self.PROGRESS_INTERVAL:
+                    job.processed_rows = processed
+                    db_writer.commit()
+                    last_report = now
+            
+            try:
+                payload = json.loads(job.payload)
+                bom_items, recipes_by_id = prepare_batch_bom(payload['bom_data'], payload.get('explode', False))
+                if payload.get('parallel'):
+                    job.artifact_token = render_batch_bom_parallel(bom_items, recipes_by_id, report_progress)
+                else:
+                    job.artifact_token = render_batch_bom(bom_items, recipes_by_id, report_progress,
+                                                          payload.get('format', 'xlsx'))
+                job.bom_count = len(bom_items)
+                job.processed_rows = job.total_rows
+                job.status = 'finished'
+                job.message = f'成功生成 {len(bom_items)} 个BOM表！'
+            except BatchBOMError as e:
+                db.session.rollback()
+                job.status = 'failed'
+                job.message = e.message
+                job.errors = json.dumps(e.errors, ensure_ascii=False)
+            except Exception as e:
+                db.session.rollback()
+                job.status = 'failed'
+                job.message = f'批量生成失败：{str(e)}'
+            
+            job.finished_at = get_shanghai_time()
+            db_writer.commit()
+
+bom_job_queue = BOMJobQueue(app.config['BOM_JOB_WORKERS'])
 
 @app.route('/api/bom/batch_generate_table', methods=['POST'])
 def batch_generate_bom_from_table():
@@ -716,175 +3067,129 @@ def batch_generate_bom_from_table():
         if not bom_data:
             return jsonify({'success': False, 'message': '没有提供BOM数据'}), 400
         
-        bom_items = []
-        errors = []
+        if data.get('stream') and (data.get('async') or data.get('parallel')):
+            return jsonify({'success': False, 'message': '流式下载不能与异步或多进程模式同时使用'}), 400
         
-        for item in bom_data:
-            # 检查必填字段
-            if not all([item.get('parent_material_code'), item.get('parent_material_name'), 
-                       item.get('basic_quantity'), item.get('basic_unit'), item.get('recipe_names')]):
-                errors.append(f"第{item.get('line_number', '?')}行：必填字段不完整")
-                continue
-            
-            # 验证数量
-            try:
-                basic_quantity = float(item['basic_quantity'])
-                if basic_quantity <= 0:
-                    errors.append(f"第{item.get('line_number', '?')}行：基本数量必须大于0")
-                    continue
-            except:
-                errors.append(f"第{item.get('line_number', '?')}行：基本数量必须是数字")
-                continue
-            
-            # 查找配方ID
-            recipe_ids = []
-            for recipe_name in item['recipe_names']:
-                # 确保配方名称被正确清理（去除前后空格）
-                recipe_name = recipe_name.strip()
-                if not recipe_name:  # 跳过空的配方名称
-                    continue
-                    
-                recipe = Recipe.query.filter_by(recipe_name=recipe_name, is_active=True).first()
-                if recipe:
-                    recipe_ids.append(recipe.id)
-                else:
-                    errors.append(f"第{item.get('line_number', '?')}行：配方'{recipe_name}'不存在")
-                    break
-            
-            if len(recipe_ids) != len(item['recipe_names']):
-                continue
-            
-            # 添加到BOM项目列表
-            bom_items.append({
-                'parent_material_code': str(item['parent_material_code']),
-                'parent_material_name': str(item['parent_material_name']),
-                'basic_quantity': basic_quantity,
-                'basic_unit': str(item['basic_unit']),
-                'recipe_ids': recipe_ids,
-                'remark': item.get('notes', '')
-            })
+        output_format = data.get('format', 'xlsx')
+        if output_format not in BOM_OUTPUT_FORMATS:
+            return jsonify({'success': False, 'message': f'不支持的输出格式：{output_format}'}), 400
+        if data.get('parallel') and output_format != 'xlsx':
+            return jsonify({'success': False, 'message': '多进程分片模式只支持xlsx格式'}), 400
         
-        if errors:
+        # 异步模式：立即返回任务ID，由后台工作线程生成
+        if data.get('async'):
+            job = bom_job_queue.submit(bom_data, parallel=bool(data.get('parallel')), output_format=output_format,
+                                       explode=bool(data.get('explode')))
             return jsonify({
-                'success': False, 
-                'message': f'生成失败，发现 {len(errors)} 个错误',
-                'errors': errors
-            }), 400
-        
-        if not bom_items:
-            return jsonify({'success': False, 'message': '未找到有效的BOM数据'}), 400
+                'success': True,
+                'message': '批量BOM任务已提交',
+                'job_id': job.id,
+                'status_url': url_for('get_bom_job', job_id=job.id),
+                'download_url': url_for('download_bom_job', job_id=job.id)
+            }), 202
         
-        # 生成所有BOM的Excel文件
-        wb_result = openpyxl.Workbook()
-        ws_result = wb_result.active
-        ws_result.title = "批量BOM表"
+        bom_items, recipes_by_id = prepare_batch_bom(bom_data, bool(data.get('explode')))
         
-        # 确保只有一个工作表
-        while len(wb_result.sheetnames) > 1:
-            wb_result.remove(wb_result.sheetnames[-1])
-        
-        print(f"DEBUG: 创建工作簿，工作表数量: {len(wb_result.sheetnames)}")
-        print(f"DEBUG: 工作表名称: {wb_result.sheetnames}")
-        
-        # 设置列宽 (A-Q列)
-        column_widths = [15, 10, 20, 20, 30, 15, 10, 10, 10, 15, 15, 15, 20, 30, 15, 15, 15]
-        for i, width in enumerate(column_widths, 1):
-            ws_result.column_dimensions[openpyxl.utils.get_column_letter(i)].width = width
-        
-        # 表头 (A-Q列)
-        headers = ['字段名称', '工厂', 'BOM可选文本', '父项物料号', '物料名称', '生效日期', 
-                   'BOM用途', '可选BOM', 'BOM状态', '基本数量', '基本单位', '行项目号', 
-                   '项目类别', '子项物料号', '子项物料描述', '子项数量', '子项单位']
-        
-        for col, header in enumerate(headers, 1):
-            cell = ws_result.cell(row=1, column=col, value=header)
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-        
-        # 数据行 - 从第8行开始填写数据（第2-7行为空白）
-        row = 8
-        
-        for bom_item in bom_items:
-            # 为每个父物料重新开始计数
-            bom_counter = 0
-            
-            # 获取所有选中的配方信息
-            all_items = []
-            
-            for recipe_id in bom_item['recipe_ids']:
-                recipe = Recipe.query.get(recipe_id)
-                if recipe:
-                    items = RecipeItem.query.filter_by(recipe_id=recipe_id).order_by(RecipeItem.line_number).all()
-                    # 为每个配方项添加配方信息
-                    for item in items:
-                        all_items.append({
-                            'recipe_name': recipe.recipe_name,
-                            'recipe_description': recipe.description,
-                            'line_number': item.line_number,
-                            'material_code': item.material_code,
-                            'material_name': item.material_name,
-                            'quantity': item.quantity,
-                            'unit': item.unit,
-                            'project_category': item.project_category
-                        })
-            
-            # 按配方名称排序
-            all_items.sort(key=lambda x: x['recipe_name'])
-            
-            # 为每个BOM项生成数据行
-            current_recipe = None
-            
-            for item in all_items:
-                # 如果是新配方，更新计数器
-                if current_recipe != item['recipe_name']:
-                    current_recipe = item['recipe_name']
-                    bom_counter += 1
-                
-                # 每行都填写完整的数据
-                ws_result.cell(row=row, column=1, value='')  # 字段名称
-                ws_result.cell(row=row, column=2, value='P060')  # 工厂
-                ws_result.cell(row=row, column=3, value=item['recipe_name'])  # BOM可选文本
-                ws_result.cell(row=row, column=4, value=bom_item['parent_material_code'])  # 父项物料号
-                ws_result.cell(row=row, column=5, value=bom_item['parent_material_name'])  # 物料名称
-                ws_result.cell(row=row, column=6, value='')  # 生效日期
-                ws_result.cell(row=row, column=7, value='1')  # BOM用途
-                ws_result.cell(row=row, column=8, value=f"{bom_counter:02d}")  # 可选BOM
-                ws_result.cell(row=row, column=9, value='01')  # BOM状态
-                ws_result.cell(row=row, column=10, value=bom_item['basic_quantity'])  # 基本数量
-                ws_result.cell(row=row, column=11, value=bom_item['basic_unit'])  # 基本单位
-                ws_result.cell(row=row, column=12, value=item['line_number'])  # 行项目号
-                ws_result.cell(row=row, column=13, value=item['project_category'])  # 项目类别
-                ws_result.cell(row=row, column=14, value=item['material_code'])  # 子项物料号
-                ws_result.cell(row=row, column=15, value=item['material_name'])  # 子项物料描述
-                # 子项数量计算：只有KG和M单位才乘以基本数量，EA单位保持原数量
-                if item['unit'] in ['KG', 'M']:
-                    calculated_quantity = item['quantity'] * bom_item['basic_quantity']
-                else:
-                    calculated_quantity = item['quantity']
-                ws_result.cell(row=row, column=16, value=calculated_quantity)  # 子项数量
-                ws_result.cell(row=row, column=17, value=item['unit'])  # 子项单位
-                
-                row += 1
+        # 流式模式：直接在响应中返回批量BOM表内容
+        if data.get('stream'):
+            parents = iter_batch_parents(bom_items, recipes_by_id)
+            if output_format == 'xlsx':
+                write = lambda target: stream_bom_workbook(target, "批量BOM表", BATCH_BOM_COLUMN_WIDTHS, parents)
+            else:
+                write = lambda target: write_bom_text(target, parents, output_format)
+            return send_streaming_file(write, f'批量BOM表.{output_format}')
         
-        # 保存文件
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-        wb_result.save(temp_file.name)
-        temp_file.close()
+        # 多进程模式：按父物料分片并行生成，结果为各分片工作簿的zip包
+        if data.get('parallel'):
+            token = render_batch_bom_parallel(bom_items, recipes_by_id)
+        else:
+            token = render_batch_bom(bom_items, recipes_by_id, output_format=output_format)
         
         return jsonify({
             'success': True,
             'message': f'成功生成 {len(bom_items)} 个BOM表！',
-            'file_path': temp_file.name,
+            'download_url': url_for('download_artifact', token=token),
             'bom_count': len(bom_items)
         })
         
+    except BatchBOMError as e:
+        response = {'success': False, 'message': e.message}
+        if e.errors:
+            response['errors'] = e.errors
+        return jsonify(response), 400
     except Exception as e:
         return jsonify({'success': False, 'message': f'批量生成失败：{str(e)}'}), 400
 
+@app.route('/api/bom/rollup', methods=['POST'])
+def rollup_bom_from_table():
+    """物料需求汇总：请求格式与批量生成相同，返回整批BOM各物料的需求总量"""
+    data = request.json or {}
+    bom_data = data.get('bom_data', [])
+    if not bom_data:
+        return jsonify({'success': False, 'message': '没有提供BOM数据'}), 400
+
+    try:
+        bom_items, recipes_by_id = prepare_batch_bom(bom_data, bool(data.get('explode')))
+    except BatchBOMError as e:
+        response = {'success': False, 'message': e.message}
+        if e.errors:
+            response['errors'] = e.errors
+        return jsonify(response), 400
+
+    materials = rollup_bom(bom_items, recipes_by_id)
+    return jsonify({
+        'success': True,
+        'parent_count': len(bom_items),
+        'line_count': sum(material['line_count'] for material in materials),
+        'materials': materials
+    })
+
+@app.route('/api/bom/jobs/<job_id>')
+def get_bom_job(job_id):
+    """查询批量BOM任务状态和进度"""
+    job = BOMJob.query.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    
+    result = {
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'total_rows': job.total_rows,
+        'processed_rows': job.processed_rows,
+        'bom_count': job.bom_count,
+        'message': job.message or '',
+        'errors': json.loads(job.errors) if job.errors else [],
+        'created_at': job.created_at.strftime('%Y-%m-%d %H:%M:%S') if job.created_at else '',
+        'finished_at': job.finished_at.strftime('%Y-%m-%d %H:%M:%S') if job.finished_at else ''
+    }
+    if job.status == 'finished':
+        result['download_url'] = url_for('download_bom_job', job_id=job.id)
+    return jsonify(result)
+
+@app.route('/api/bom/jobs/<job_id>/download')
+def download_bom_job(job_id):
+    """下载已完成的批量BOM任务结果"""
+    job = BOMJob.query.get(job_id)
+    if not job:
+        return jsonify({'error': '任务不存在'}), 404
+    if job.status != 'finished':
+        return jsonify({'error': '任务尚未完成'}), 409
+    
+    return send_artifact(job.artifact_token)
+
 if __name__ == '__main__':
+    # 打包为exe后多进程分片生成需要
+    multiprocessing.freeze_support()
+    
     with app.app_context():
         db.create_all()
         
+        # 升级已有数据库的表结构和索引
+        migrated = run_migrations()
+        if migrated:
+            print(f"🛠️  已执行数据库迁移：{', '.join(map(str, migrated))}")
+        
         # 初始化一些示例数据
         if not Recipe.query.first():
             recipe = Recipe(recipe_name='标准配方1', description='标准产品配方')
@@ -899,8 +3204,14 @@ if __name__ == '__main__':
             ]
             for item in items:
                 db.session.add(item)
+            update_recipe_search_index([recipe.id])
             
             db.session.commit()
+        
+        # 恢复上次进程退出时未完成的批量BOM任务
+        resumed = bom_job_queue.resume_pending()
+        if resumed:
+            print(f"🔄 已恢复 {resumed} 个未完成的批量BOM任务")
     
     # 生产环境配置
     import os
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+多进程分片生成基准测试
+比较单进程生成批量BOM表与不同进程数的分片生成耗时，并校验分片拼接后与单进程结果一致
+
+用法：python benchmarks/bench_parallel_shards.py [--parents 2000] [--workers 1,2,4]
+"""
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+_WORK_DIR = tempfile.mkdtemp(prefix='bom_bench_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_WORK_DIR, 'bench.db')
+os.environ['ARTIFACT_DIR'] = os.path.join(_WORK_DIR, 'artifacts')
+os.environ['SLOW_REQUEST_DIR'] = os.path.join(_WORK_DIR, 'slow_requests')
+
+import openpyxl  # noqa: E402
+
+import app as app_module  # noqa: E402
+from catalog import CATALOG_SIZES, build_catalog, batch_bom_data  # noqa: E402
+
+
+def sheet_rows(path_or_file):
+    ws = openpyxl.load_workbook(path_or_file, read_only=True).active
+    return list(ws.iter_rows(min_row=app_module.BOM_DATA_START_ROW, values_only=True))
+
+
+def timed(function, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        token = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, token
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', default='medium', choices=list(CATALOG_SIZES))
+    parser.add_argument('--parents', type=int, default=2000)
+    parser.add_argument('--workers', default='1,2,4', help='逗号分隔的进程数')
+    parser.add_argument('--repeat', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    recipe_count, items_per_recipe = CATALOG_SIZES[args.size]
+    recipe_names = build_catalog(app_module, recipe_count, items_per_recipe, args.seed)
+    bom_data = batch_bom_data(recipe_names, args.parents, seed=args.seed)
+    print(f'CPU {os.cpu_count()}，父物料 {args.parents}')
+
+    with app_module.app.app_context():
+        bom_items, recipes_by_id = app_module.prepare_batch_bom(bom_data)
+        baseline, token = timed(lambda: app_module.render_batch_bom(bom_items, recipes_by_id), args.repeat)
+        expected = sheet_rows(app_module.artifact_store.get(token)[0])
+        print(f'单进程：{baseline:.2f} s，{len(expected)} 行')
+
+        app_module.app.config['BOM_SHARD_MIN_PARENTS'] = 1
+        for workers in (int(value) for value in args.workers.split(',')):
+            app_module.reset_bom_process_pool()
+            app_module.app.config['BOM_PROCESS_WORKERS'] = workers
+            # 预先启动进程池（spawn方式的子进程要重新导入应用），不计入耗时
+            pool = app_module.get_bom_process_pool()
+            for future in [pool.submit(app_module.split_bom_shards, [], 1, 1) for _ in range(workers)]:
+                future.result()
+            elapsed, token = timed(lambda: app_module.render_batch_bom_parallel(bom_items, recipes_by_id),
+                                   args.repeat)
+            with zipfile.ZipFile(app_module.artifact_store.get(token)[0]) as archive:
+                rows = [row for name in archive.namelist() for row in sheet_rows(io.BytesIO(archive.read(name)))]
+            print(f'{workers} 个进程：{elapsed:.2f} s  加速 {baseline / elapsed:.2f}x  '
+                  f'结果一致：{"是" if rows == expected else "否"}')
+            if rows != expected:
+                sys.exit(1)
+        app_module.reset_bom_process_pool()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+合成配方库生成器
+按随机种子批量写入配方和配方项，同一参数生成的数据完全相同，供基准测试使用
+"""
+
+import io
+import random
+from datetime import datetime, timedelta
+
+import openpyxl
+
+# 规模名称 -> (配方数, 每个配方的配方项数)
+CATALOG_SIZES = {
+    'small': (100, 10),
+    'medium': (2000, 25),
+    'large': (20000, 50),  # 100万个配方项
+}
+
+UNITS = ['KG', 'KG', 'KG', 'M', 'EA']
+CATEGORY_COUNT = 12
+INSERT_CHUNK_SIZE = 20000
+BASE_TIME = datetime(2025, 1, 1, 8, 0, 0)
+
+
+def recipe_name(index):
+    return f'BM{index:05d}'
+
+
+def _material(rng, material_count):
+    number = rng.randrange(material_count)
+    return f'RM{number:06d}', f'原材料{number}'
+
+
+def build_catalog(app_module, recipe_count, items_per_recipe, seed=1):
+    """清空数据库后写入合成配方库，返回配方名称列表"""
+    rng = random.Random(seed)
+    db = app_module.db
+    material_count = max(200, recipe_count * items_per_recipe // 20)
+
+    with app_module.app.app_context():
+        db.drop_all()
+        db.session.execute(db.text('DROP TABLE IF EXISTS schema_migrations'))
+        db.create_all()
+        app_module.run_migrations()
+
+        recipes = []
+        for i in range(1, recipe_count + 1):
+            created_at = BASE_TIME + timedelta(minutes=i)
+            recipes.append({
+                'id': i,
+                'recipe_name': recipe_name(i),
+                'description': f'合成配方{i}',
+                'product_category': f'类别{rng.randrange(CATEGORY_COUNT)}',
+                'is_active': True,
+                'created_at': created_at,
+                'updated_at': created_at + timedelta(days=rng.randrange(365)),
+            })
+        db.session.execute(db.insert(app_module.Recipe), recipes)
+
+        items = []
+        for i in range(1, recipe_count + 1):
+            for j in range(1, items_per_recipe + 1):
+                material_code, material_name = _material(rng, material_count)
+                items.append({
+                    'recipe_id': i,
+                    'material_code': material_code,
+                    'material_name': material_name,
+                    'quantity': round(rng.uniform(0.001, 100), rng.randint(0, 4)),
+                    'unit': rng.choice(UNITS),
+                    'line_number': f'{j * 10:04d}',
+                    'project_category': 'L',
+                })
+            if len(items) >= INSERT_CHUNK_SIZE:
+                db.session.execute(db.insert(app_module.RecipeItem), items)
+                items = []
+        if items:
+            db.session.execute(db.insert(app_module.RecipeItem), items)
+
+        app_module.rebuild_recipe_search_index()
+        db.session.commit()
+
+    app_module.recipe_cache.clear()
+    app_module.catalog_version.bump()
+    return [recipe_name(i) for i in range(1, recipe_count + 1)]
+
+
+def batch_bom_data(recipe_names, parent_count, recipes_per_parent=3, seed=1):
+    """生成批量BOM表格数据（/api/bom/batch_generate_table的bom_data）"""
+    rng = random.Random(seed)
+    basic_quantities = [100, 200, 500, 1000, 2.5, 1250]
+    return [{
+        'line_number': i,
+        'parent_material_code': f'FG{i:06d}',
+        'parent_material_name': f'成品{i}',
+        'basic_quantity': rng.choice(basic_quantities),
+        'basic_unit': 'KG',
+        'recipe_names': rng.sample(recipe_names, min(recipes_per_parent, len(recipe_names))),
+    } for i in range(1, parent_count + 1)]
+
+
+def import_workbook(prefix, recipe_count, items_per_recipe, seed=1):
+    """生成配方导入文件（导入模板格式），配方名称以prefix开头，返回文件内容"""
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(['配方名称', '配方描述', '行号', '物料编码', '物料名称', '数量', '单位', '类别', '产品类别'])
+    for i in range(1, recipe_count + 1):
+        name = f'{prefix}{i:05d}'
+        for j in range(1, items_per_recipe + 1):
+            material_code, material_name = _material(rng, 5000)
+            ws.append([name, f'导入配方{i}', f'{j * 10:04d}', material_code, material_name,
+                       round(rng.uniform(0.001, 100), 3), rng.choice(UNITS), 'L', f'类别{i % CATEGORY_COUNT}'])
+    content = io.BytesIO()
+    wb.save(content)
+    return content.getvalue()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+性能基准测试
+在进程内通过Flask测试客户端调用接口，对不同规模的合成配方库计时，与保存的基线比较，
+超出允许范围时以退出码1结束
+
+用法：
+    python benchmarks/run_benchmarks.py                          # 运行small、medium规模并与基线比较
+    python benchmarks/run_benchmarks.py --sizes large            # 2万个配方、100万个配方项（耗时较长）
+    python benchmarks/run_benchmarks.py --update-baseline        # 用本次结果更新基线
+
+基线与机器相关，更换运行环境后需先用--update-baseline重新记录。
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+_WORK_DIR = tempfile.mkdtemp(prefix='bom_bench_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_WORK_DIR, 'bench.db')
+os.environ['ARTIFACT_DIR'] = os.path.join(_WORK_DIR, 'artifacts')
+os.environ['SLOW_REQUEST_DIR'] = os.path.join(_WORK_DIR, 'slow_requests')
+
+import app as app_module  # noqa: E402
+from catalog import CATALOG_SIZES, build_catalog, batch_bom_data, import_workbook  # noqa: E402
+
+# 关闭慢请求记录：计时不包含调用栈采样的开销，耗时长的场景也不写出记录文件
+app_module.app.config['SLOW_REQUEST_THRESHOLD'] = 0
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+DEFAULT_SIZES = ['small', 'medium']
+DEFAULT_TOLERANCE = 0.3  # 比基线慢30%以上视为退化
+MIN_REGRESSION_SECONDS = 0.01  # 绝对差值小于10毫秒时不视为退化，避免短耗时场景的抖动误报
+
+# 规模名称 -> 各场景的工作量
+WORKLOADS = {
+    'small': {'bom_recipes': 3, 'batch_parents': 100, 'import_recipes': 20},
+    'medium': {'bom_recipes': 5, 'batch_parents': 300, 'import_recipes': 200},
+    'large': {'bom_recipes': 5, 'batch_parents': 5000, 'import_recipes': 1000},
+}
+
+
+def scenarios(client, size, recipe_names, repeat, seed):
+    """返回(场景名称, 发送一次请求的函数)列表，导入场景放在最后，不影响其他场景的配方库"""
+    workload = WORKLOADS[size]
+    _, items_per_recipe = CATALOG_SIZES[size]
+    step = max(1, len(recipe_names) // workload['bom_recipes'])
+    bom_request = {
+        'parent_material_code': 'FG000001', 'parent_material_name': '成品',
+        'basic_quantity': 1000, 'basic_unit': 'KG',
+        'recipe_ids': list(range(1, len(recipe_names) + 1, step))[:workload['bom_recipes']],
+    }
+    bom_data = batch_bom_data(recipe_names, workload['batch_parents'], seed=seed)
+    # 每次导入都新建配方，不走内容未变化的快速路径（含预热的一次）
+    import_files = iter([import_workbook(f'IMP{run}-', workload['import_recipes'], items_per_recipe, seed=seed + run)
+                         for run in range(repeat + 1)])
+
+    def import_recipes():
+        return client.post('/api/recipe/import', data={'file': (io.BytesIO(next(import_files)), 'bench.xlsx')},
+                           content_type='multipart/form-data')
+
+    return [
+        ('get_recipes', lambda: client.get('/api/recipes')),
+        ('get_recipes_page', lambda: client.get('/api/recipes', query_string={'limit': 50, 'q': 'BM01'})),
+        ('generate_bom', lambda: client.post('/api/generate_bom', json=bom_request)),
+        ('batch_generate_bom', lambda: client.post('/api/bom/batch_generate_table', json={'bom_data': bom_data})),
+        ('export_all_recipes', lambda: client.get('/api/recipe/export_all')),
+        ('import_recipe', import_recipes),
+    ]
+
+
+def time_scenario(send, repeat):
+    """预热一次后计时repeat次，返回耗时中位数（秒）"""
+    durations = []
+    for run in range(repeat + 1):
+        started = time.perf_counter()
+        response = send()
+        data = response.get_data()
+        elapsed = time.perf_counter() - started
+        response.close()
+        if response.status_code != 200:
+            raise RuntimeError(f'HTTP {response.status_code}: {data[:200]!r}')
+        if run:
+            durations.append(elapsed)
+    return statistics.median(durations)
+
+
+def run_size(size, repeat, seed):
+    recipe_count, items_per_recipe = CATALOG_SIZES[size]
+    started = time.perf_counter()
+    recipe_names = build_catalog(app_module, recipe_count, items_per_recipe, seed)
+    print(f'[{size}] 配方 {recipe_count}，配方项 {recipe_count * items_per_recipe}，'
+          f'生成配方库 {time.perf_counter() - started:.1f} s')
+
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['logged_in'] = True
+
+    results = {}
+    for name, send in scenarios(client, size, recipe_names, repeat, seed):
+        results[name] = round(time_scenario(send, repeat), 4)
+        print(f'  {name:<20}{results[name]:>9.4f} s')
+    app_module.db_writer.join()  # 等待后台写入BOM生成记录，再生成下一个规模的配方库
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """返回退化的场景列表[(规模, 场景, 本次, 基线)]"""
+    regressions = []
+    for size, timings in results.items():
+        for name, seconds in timings.items():
+            expected = baseline.get(size, {}).get(name)
+            if expected is None:
+                print(f'  [{size}] {name}：基线中没有记录')
+                continue
+            ratio = seconds / expected if expected else float('inf')
+            regressed = seconds > expected * (1 + tolerance) and seconds - expected > MIN_REGRESSION_SECONDS
+            print(f'  [{size}] {name:<20}{seconds:>9.4f} s  基线 {expected:.4f} s  {ratio:>5.2f}x'
+                  f'{"  退化" if regressed else ""}')
+            if regressed:
+                regressions.append((size, name, seconds, expected))
+    return regressions
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f).get('results', {})
+
+
+def save_baseline(path, results):
+    merged = load_baseline(path)
+    merged.update(results)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'environment': {'python': platform.python_version(), 'machine': platform.machine(),
+                            'cpu_count': os.cpu_count()},
+            'results': merged,
+        }, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BOM系统性能基准测试')
+    parser.add_argument('--sizes', default=','.join(DEFAULT_SIZES),
+                        help=f'逗号分隔的配方库规模，可选：{", ".join(CATALOG_SIZES)}')
+    parser.add_argument('--repeat', type=int, default=3, help='每个场景的计时次数（另有一次预热）')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='允许比基线慢的比例')
+    parser.add_argument('--update-baseline', action='store_true', help='用本次结果更新基线文件')
+    args = parser.parse_args()
+
+    sizes = [size.strip() for size in args.sizes.split(',') if size.strip()]
+    unknown = [size for size in sizes if size not in CATALOG_SIZES]
+    if unknown:
+        parser.error(f'未知的规模：{", ".join(unknown)}')
+
+    results = {size: run_size(size, args.repeat, args.seed) for size in sizes}
+
+    if args.update_baseline:
+        save_baseline(args.baseline, results)
+        print(f'基线已更新：{args.baseline}')
+        return 0
+
+    print('与基线比较：')
+    regressions = compare(results, load_baseline(args.baseline), args.tolerance)
+    if regressions:
+        print(f'{len(regressions)} 个场景比基线慢 {args.tolerance:.0%} 以上')
+        return 1
+    print('没有发现性能退化')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
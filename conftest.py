@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+pytest公共配置
+在导入app之前把数据库和生成文件目录指向临时目录，测试不会改动正式数据
+"""
+
+import os
+import tempfile
+
+import pytest
+
+_TEST_DB_DIR = tempfile.mkdtemp(prefix='bom_system_test_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_TEST_DB_DIR, 'bom_system_test.db')
+os.environ['ARTIFACT_DIR'] = os.path.join(_TEST_DB_DIR, 'artifacts')
+os.environ['SLOW_REQUEST_DIR'] = os.path.join(_TEST_DB_DIR, 'slow_requests')
+
+
+@pytest.fixture
+def app_module():
+    """重建空数据库并返回app模块"""
+    import app as app_module
+
+    app_module.app.config['TESTING'] = True
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+        app_module.db.session.execute(app_module.db.text('DROP TABLE IF EXISTS schema_migrations'))
+        app_module.db.create_all()
+        app_module.run_migrations()
+    app_module.recipe_cache.clear()
+    app_module.catalog_version.bump()
+    return app_module
+
+
+@pytest.fixture
+def client(app_module):
+    """已登录管理员的测试客户端"""
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['logged_in'] = True
+    return client
+
+
+def seed_recipes(app_module, recipe_count=20, items_per_recipe=5):
+    """写入测试配方，返回配方名称列表"""
+    names = []
+    with app_module.app.app_context():
+        for i in range(1, recipe_count + 1):
+            recipe = app_module.Recipe(recipe_name=f'配方{i:04d}', description=f'测试配方{i}',
+                                       product_category=f'类别{i % 3}')
+            app_module.db.session.add(recipe)
+            app_module.db.session.flush()
+            for j in range(1, items_per_recipe + 1):
+                app_module.db.session.add(app_module.RecipeItem(
+                    recipe_id=recipe.id,
+                    material_code=f'M{i:04d}{j:02d}',
+                    material_name=f'原材料{i}-{j}',
+                    quantity=0.5 * j,
+                    unit=['KG', 'M', 'EA'][j % 3],
+                    line_number=f'{j * 10:04d}',
+                    project_category='L'
+                ))
+            names.append(recipe.recipe_name)
+        app_module.db.session.commit()
+    return names
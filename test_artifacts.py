@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+生成文件存储测试
+检查下载令牌、断点续传/条件请求，以及过期和超出容量时的清理
+"""
+
+import os
+import time
+
+import pytest
+
+from conftest import seed_recipes
+
+
+@pytest.fixture
+def store(app_module, tmp_path):
+    """使用独立目录的生成文件存储"""
+    app_module.app.config['ARTIFACT_DIR'] = str(tmp_path / 'artifacts')
+    yield app_module.artifact_store
+    app_module.app.config['ARTIFACT_DIR'] = os.environ['ARTIFACT_DIR']
+    app_module.app.config['ARTIFACT_MAX_BYTES'] = 1024 * 1024 * 1024
+    app_module.app.config['ARTIFACT_TTL'] = 86400
+
+
+def write_bytes(size):
+    def write(path):
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+    return write
+
+
+def test_generate_bom_returns_token_url(client, app_module, store):
+    seed_recipes(app_module, recipe_count=3)
+    with app_module.app.app_context():
+        recipe_ids = [recipe.id for recipe in app_module.Recipe.query.all()]
+
+    data = client.post('/api/generate_bom', json={
+        'parent_material_code': 'P001', 'parent_material_name': '父物料',
+        'basic_quantity': 2, 'basic_unit': 'KG', 'recipe_ids': recipe_ids
+    }).get_json()
+    assert data['success']
+    assert 'file_path' not in data
+    assert data['download_url'].startswith('/api/download/')
+    assert store.directory not in data['download_url']
+
+    response = client.get(data['download_url'])
+    assert response.status_code == 200
+    assert response.data[:2] == b'PK'
+    assert 'BOM' in response.headers['Content-Disposition']
+
+
+def test_range_and_conditional_requests(client, store):
+    token = store.create('.xlsx', '测试.xlsx', write_bytes(1000))
+    url = f'/api/download/{token}'
+
+    full = client.get(url)
+    assert full.headers['ETag']
+
+    partial = client.get(url, headers={'Range': 'bytes=100-199'})
+    assert partial.status_code == 206
+    assert len(partial.data) == 100
+    assert partial.headers['Content-Range'] == 'bytes 100-199/1000'
+
+    cached = client.get(url, headers={'If-None-Match': full.headers['ETag']})
+    assert cached.status_code == 304
+
+
+def test_invalid_tokens_are_rejected(client, store):
+    assert client.get('/api/download/0123456789abcdef0123456789abcdef').status_code == 404
+    assert client.get('/api/download/..%2Fbom_system.db').status_code == 404
+    assert store.get('../../etc/passwd') is None
+
+
+def test_expired_artifacts_are_removed(app_module, store):
+    token = store.create('.xlsx', '过期.xlsx', write_bytes(10))
+    path, _ = store.get(token)
+
+    app_module.app.config['ARTIFACT_TTL'] = 0
+    time.sleep(0.01)
+    assert store.get(token) is None
+    assert not os.path.exists(path)
+
+
+def test_evicts_least_recently_used_over_budget(app_module, store):
+    app_module.app.config['ARTIFACT_MAX_BYTES'] = 250
+    first = store.create('.xlsx', '1.xlsx', write_bytes(100))
+    second = store.create('.xlsx', '2.xlsx', write_bytes(100))
+    assert store.get(first)  # first成为最近下载的文件
+
+    third = store.create('.xlsx', '3.xlsx', write_bytes(100))
+    assert store.get(second) is None
+    assert store.get(first) and store.get(third)
+    assert store.stats()['total_bytes'] == 200
+    assert sorted(os.listdir(store.directory)) == sorted(
+        [f'{first}.xlsx', f'{first}.json', f'{third}.xlsx', f'{third}.json'])
+
+
+def test_tokens_survive_restart(app_module, store):
+    token = store.create('.zip', '批量BOM表.zip', write_bytes(10))
+
+    restarted = app_module.ArtifactStore()
+    path, meta = restarted.get(token)
+    assert meta['download_name'] == '批量BOM表.zip'
+    assert os.path.getsize(path) == 10
+
+
+def test_failed_write_leaves_no_file(store):
+    def write(path):
+        with open(path, 'wb') as f:
+            f.write(b'partial')
+        raise RuntimeError('写入失败')
+
+    with pytest.raises(RuntimeError):
+        store.create('.xlsx', '失败.xlsx', write)
+    assert os.listdir(store.directory) == []
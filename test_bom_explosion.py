@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+多层BOM展开测试
+虚拟件行引用的子配方逐层展开并传递数量，展开后重新编号；子配方每次请求只展开一次；循环引用直接报错
+"""
+
+import csv
+import io
+
+import pytest
+
+
+def line(code, quantity, unit='KG', category='L', name=None):
+    return {'material_code': code, 'material_name': name or f'{code}名称', 'quantity': quantity,
+            'unit': unit, 'line_number': '', 'project_category': category}
+
+
+def create(client, name, *items):
+    items = [dict(item, line_number=item['line_number'] or f'{index * 10:04d}') for index, item in enumerate(items, 1)]
+    data = client.post('/api/recipe', json={'name': name, 'description': '', 'items': items}).get_json()
+    assert data['success'], data
+    return data['id']
+
+
+def csv_lines(content):
+    """返回每行的 (可选BOM文本, 行号, 项目类别, 子项物料号, 子项数量, 单位)"""
+    rows = list(csv.reader(io.StringIO(content.decode('utf-8'), newline='')))[1:]
+    return [(row[2], row[11], row[12], row[13], float(row[15]), row[16]) for row in rows]
+
+
+def generate(client, recipe_ids, **extra):
+    return client.post('/api/generate_bom', json=dict({
+        'parent_material_code': 'P001', 'parent_material_name': '父物料', 'basic_quantity': 2,
+        'basic_unit': 'KG', 'recipe_ids': recipe_ids, 'format': 'csv', 'stream': True
+    }, **extra))
+
+
+@pytest.fixture
+def assemblies(client):
+    create(client, 'SUB2', line('Z1', 1.5, 'M'), line('Z2', 4, 'EA'))
+    create(client, 'SUB', line('Y1', 0.5), line('SUB2', 3, 'EA', 'N'))
+    top = create(client, 'TOP', line('X1', 1), line('SUB', 2, 'EA', 'N'), line('X2', 5, 'EA'),
+                 line('SUB', 1, 'EA', 'L'))  # L行不是子配方引用
+    return top
+
+
+def test_explode_propagates_quantities_and_renumbers(client, assemblies):
+    assert csv_lines(generate(client, [assemblies]).data) == [
+        ('TOP', '0010', 'L', 'X1', 2.0, 'KG'),
+        ('TOP', '0020', 'N', 'SUB', 2.0, 'EA'),
+        ('TOP', '0030', 'L', 'X2', 5.0, 'EA'),
+        ('TOP', '0040', 'L', 'SUB', 1.0, 'EA'),
+    ]
+    # 子项数量 = 各层引用数量之积，KG和M再乘以基本数量
+    assert csv_lines(generate(client, [assemblies], explode=True).data) == [
+        ('TOP', '0010', 'L', 'X1', 2.0, 'KG'),
+        ('TOP', '0020', 'L', 'Y1', 2.0, 'KG'),
+        ('TOP', '0030', 'L', 'Z1', 18.0, 'M'),
+        ('TOP', '0040', 'L', 'Z2', 24.0, 'EA'),
+        ('TOP', '0050', 'L', 'X2', 5.0, 'EA'),
+        ('TOP', '0060', 'L', 'SUB', 1.0, 'EA'),
+    ]
+
+
+def test_recipes_without_references_keep_line_numbers(client, assemblies):
+    recipe_id = create(client, 'PLAIN', dict(line('A1', 1), line_number='0100'))
+    rows = csv_lines(generate(client, [recipe_id], explode=True).data)
+    assert [row[1] for row in rows] == ['0100']
+
+
+def test_inactive_sub_recipe_is_not_expanded(client, app_module, assemblies):
+    with app_module.app.app_context():
+        sub2 = app_module.Recipe.query.filter_by(recipe_name='SUB2').first().id
+    client.delete(f'/api/recipe/{sub2}')
+    rows = csv_lines(generate(client, [assemblies], explode=True).data)
+    assert [row[3] for row in rows] == ['X1', 'Y1', 'SUB2', 'X2', 'SUB']
+    assert rows[2][4] == 6.0
+
+
+def test_shared_sub_recipe_expanded_once_per_request(client, app_module, assemblies, monkeypatch):
+    create(client, 'TOP2', line('SUB', 1, 'EA', 'N'))
+    expanded = []
+    original = app_module.RecipeExploder._expand
+
+    def counting_expand(self, recipe):
+        if recipe.id not in self._lines:
+            expanded.append(recipe.recipe_name)
+        return original(self, recipe)
+
+    monkeypatch.setattr(app_module.RecipeExploder, '_expand', counting_expand)
+    bom_data = [{'parent_material_code': f'P{i:03d}', 'parent_material_name': '父物料', 'basic_quantity': 1,
+                 'basic_unit': 'KG', 'recipe_names': ['TOP', 'TOP2']} for i in range(200)]
+    response = client.post('/api/bom/batch_generate_table', json={
+        'bom_data': bom_data, 'explode': True, 'format': 'csv', 'stream': True})
+    assert len(csv_lines(response.data)) == 200 * (6 + 3)
+    assert sorted(expanded) == ['SUB', 'SUB2', 'TOP', 'TOP2']
+
+
+def test_cycles_are_rejected(client, assemblies):
+    create(client, 'LOOP1', line('LOOP2', 1, 'EA', 'N'))
+    create(client, 'LOOP2', line('Q1', 1), line('LOOP3', 1, 'EA', 'N'))
+    create(client, 'LOOP3', line('LOOP1', 1, 'EA', 'N'))
+    top = create(client, 'LOOPTOP', line('LOOP2', 1, 'EA', 'N'))
+
+    response = generate(client, [assemblies, top], explode=True)
+    assert response.status_code == 400
+    assert response.get_json()['message'] == '配方存在循环引用：LOOP2 → LOOP3 → LOOP1 → LOOP2'
+    assert generate(client, [top]).status_code == 200  # 不展开时不检查
+
+    response = client.post('/api/bom/batch_generate_table', json={'explode': True, 'bom_data': [{
+        'parent_material_code': 'P1', 'parent_material_name': '父物料', 'basic_quantity': 1,
+        'basic_unit': 'KG', 'recipe_names': ['LOOP1']}]})
+    assert response.status_code == 400
+    assert '循环引用' in response.get_json()['message']
+
+    self_loop = create(client, 'SELF', line('SELF', 1, 'EA', 'N'))
+    assert generate(client, [self_loop], explode=True).get_json()['message'] == '配方存在循环引用：SELF → SELF'
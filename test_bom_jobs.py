@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+批量BOM异步任务测试
+任务保存在数据库中并汇报进度；进程重启（新建任务队列）时未完成的任务自动重新排队，每个进程只恢复一次
+"""
+
+import json
+import time
+from datetime import timedelta
+
+from conftest import seed_recipes
+
+
+def bom_data(names, count=6):
+    return [{'line_number': i, 'parent_material_code': f'P{i}', 'parent_material_name': f'父物料{i}',
+             'basic_quantity': 2, 'basic_unit': 'KG', 'recipe_names': names[:2]} for i in range(1, count + 1)]
+
+
+def wait_for(client, job_id):
+    deadline = time.monotonic() + 10
+    status = client.get(f'/api/bom/jobs/{job_id}').get_json()
+    while status['status'] not in ('finished', 'failed') and time.monotonic() < deadline:
+        time.sleep(0.02)
+        status = client.get(f'/api/bom/jobs/{job_id}').get_json()
+    return status
+
+
+def test_job_is_persisted_and_reports_progress(client, app_module, monkeypatch):
+    names = seed_recipes(app_module, recipe_count=3, items_per_recipe=2)
+    monkeypatch.setattr(app_module.BOMJobQueue, 'PROGRESS_INTERVAL', 0)
+    render_batch_bom = app_module.render_batch_bom
+    reported = []
+
+    def recording_render(bom_items, recipes_by_id, progress=None, output_format='xlsx'):
+        def record(processed):
+            progress(processed)
+            # 进度已提交到数据库，其他连接可以读到
+            with app_module.db.engine.connect() as connection:
+                reported.append((processed, connection.execute(app_module.db.text(
+                    'SELECT processed_rows FROM bom_job WHERE status = :status'), {'status': 'running'}).scalar()))
+        return render_batch_bom(bom_items, recipes_by_id, record, output_format)
+
+    monkeypatch.setattr(app_module, 'render_batch_bom', recording_render)
+    job = client.post('/api/bom/batch_generate_table', json={'bom_data': bom_data(names), 'async': True})
+    assert job.status_code == 202
+    status = wait_for(client, job.get_json()['job_id'])
+
+    assert status['status'] == 'finished'
+    assert (status['total_rows'], status['processed_rows'], status['bom_count']) == (6, 6, 6)
+    assert reported == [(n, n) for n in range(1, 7)]
+    assert client.get(status['download_url']).status_code == 200
+
+    with app_module.app.app_context():
+        stored = app_module.db.session.get(app_module.BOMJob, status['job_id'])
+        assert json.loads(stored.payload)['bom_data'] == bom_data(names)
+        assert stored.artifact_token and stored.started_at and stored.finished_at
+
+
+def test_unfinished_jobs_resume_once_after_restart(client, app_module):
+    names = seed_recipes(app_module, recipe_count=3, items_per_recipe=2)
+    earlier = app_module.get_shanghai_time() - timedelta(minutes=5)
+    payload = json.dumps({'bom_data': bom_data(names), 'parallel': False, 'format': 'xlsx', 'explode': False})
+    with app_module.app.app_context():
+        for job_id, status, processed in (('a' * 32, 'queued', 0), ('b' * 32, 'running', 4),
+                                          ('c' * 32, 'finished', 6)):
+            app_module.db.session.add(app_module.BOMJob(id=job_id, status=status, payload=payload, total_rows=6,
+                                                        processed_rows=processed, created_at=earlier))
+        app_module.db.session.commit()
+
+    # 新建队列相当于进程重启：不经过__main__，创建时即恢复
+    job_queue = app_module.BOMJobQueue(1)
+    try:
+        for job_id in ('a' * 32, 'b' * 32):
+            status = wait_for(client, job_id)
+            assert (status['status'], status['processed_rows']) == ('finished', 6)
+        assert client.get(f'/api/bom/jobs/{"c" * 32}').get_json()['bom_count'] is None  # 已完成的任务不重新执行
+
+        with app_module.app.app_context():
+            app_module.db.session.get(app_module.BOMJob, 'a' * 32).status = 'queued'
+            app_module.db.session.commit()
+            assert job_queue.resume_pending() == 0
+    finally:
+        job_queue.executor.shutdown(wait=True)
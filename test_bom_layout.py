@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+BOM表格式测试
+单个和批量BOM表（先生成再下载、流式下载）保持原有格式：第1行为加粗居中的表头，
+第2-7行为空白，数据从第8行开始，列宽与原来一致
+"""
+
+import io
+
+import openpyxl
+import pytest
+
+from conftest import seed_recipes
+
+SINGLE_WIDTHS = [15, 10, 20, 20, 30, 15, 10, 10, 10, 15, 15, 15, 20, 30, 15, 15]  # A-P列，Q列为默认列宽
+BATCH_WIDTHS = SINGLE_WIDTHS + [15]  # A-Q列
+
+
+def assert_bom_layout(app_module, content, title, widths, parent_codes, row_count):
+    ws = openpyxl.load_workbook(io.BytesIO(content)).active
+    assert ws.title == title
+
+    header = list(ws[1])
+    assert [cell.value for cell in header] == app_module.BOM_HEADERS
+    assert all(cell.font.bold for cell in header)
+    assert all((cell.alignment.horizontal, cell.alignment.vertical) == ('center', 'center') for cell in header)
+
+    for row in ws.iter_rows(min_row=2, max_row=7):
+        assert all(cell.value is None for cell in row)
+
+    letters = [openpyxl.utils.get_column_letter(i) for i in range(1, 18)]
+    assert [letter in ws.column_dimensions for letter in letters] == [True] * len(widths) + [False] * (17 - len(widths))
+    assert [ws.column_dimensions[letter].width for letter in letters[:len(widths)]] == widths
+
+    rows = list(ws.iter_rows(min_row=8, values_only=True))
+    assert len(rows) == row_count
+    assert [row[3] for row in rows] == parent_codes
+    assert not any(cell.font.bold for row in ws.iter_rows(min_row=8) for cell in row)
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_single_bom_layout(client, app_module, stream):
+    seed_recipes(app_module, recipe_count=3, items_per_recipe=4)
+    payload = {'parent_material_code': 'P001', 'parent_material_name': '父物料', 'basic_quantity': 3,
+               'basic_unit': 'KG', 'recipe_ids': [1, 2]}
+    if stream:
+        content = client.post('/api/generate_bom', json=dict(payload, stream=True)).data
+    else:
+        content = client.get(client.post('/api/generate_bom', json=payload).get_json()['download_url']).data
+    assert_bom_layout(app_module, content, 'BOM表', SINGLE_WIDTHS, ['P001'] * 8, 8)
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_batch_bom_layout(client, app_module, stream):
+    names = seed_recipes(app_module, recipe_count=3, items_per_recipe=4)
+    bom_data = [{'line_number': i, 'parent_material_code': f'P{i:03d}', 'parent_material_name': f'父物料{i}',
+                 'basic_quantity': i, 'basic_unit': 'KG', 'recipe_names': names[:i]} for i in range(1, 4)]
+    response = client.post('/api/bom/batch_generate_table', json={'bom_data': bom_data, 'stream': stream})
+    content = response.data if stream else client.get(response.get_json()['download_url']).data
+    parent_codes = [f'P{i:03d}' for i in range(1, 4) for _ in range(i * 4)]
+    assert_bom_layout(app_module, content, '批量BOM表', BATCH_WIDTHS, parent_codes, 24)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+物料需求汇总测试
+汇总结果与对批量BOM表全部数据行逐行求和的结果逐位一致
+"""
+
+import csv
+import io
+import math
+import random
+
+from conftest import seed_recipes
+
+
+def batch_data(names, count, seed=7):
+    rng = random.Random(seed)
+    return [{
+        'parent_material_code': f'P{i:05d}',
+        'parent_material_name': f'父物料{i}',
+        'basic_quantity': rng.choice([0.1, 0.3, 1, 2.5, 7, rng.uniform(0.01, 100)]),
+        'basic_unit': 'KG',
+        'recipe_names': rng.sample(names, rng.randint(1, 3))
+    } for i in range(count)]
+
+
+def reference_rollup(app_module, bom_data):
+    """逐行生成BOM数据行后按(物料编码, 单位)求和"""
+    with app_module.app.app_context():
+        bom_items, recipes_by_id = app_module.prepare_batch_bom(bom_data)
+    rows = {}
+    for parent, recipes in app_module.iter_batch_parents(bom_items, recipes_by_id):
+        for row in app_module.iter_bom_rows(parent, recipes):
+            rows.setdefault((row[13], row[16]), []).append(row[15])
+    return {key: (math.fsum(values), len(values)) for key, values in rows.items()}
+
+
+def test_rollup_matches_row_by_row_sum(client, app_module):
+    names = seed_recipes(app_module, recipe_count=12, items_per_recipe=6)
+    with app_module.app.app_context():
+        rng = random.Random(3)
+        for item in app_module.RecipeItem.query.all():
+            item.quantity = rng.choice([0.1, 0.7, 1 / 3, rng.uniform(0.001, 50)])
+            item.material_code = f'M{rng.randint(1, 15):03d}'  # 不同配方共用物料
+        app_module.db.session.commit()
+    bom_data = batch_data(names, 500)
+
+    data = client.post('/api/bom/rollup', json={'bom_data': bom_data}).get_json()
+    expected = reference_rollup(app_module, bom_data)
+    assert {(m['material_code'], m['unit']): (m['quantity'], m['line_count']) for m in data['materials']} == expected
+    assert data['parent_count'] == 500
+    assert data['line_count'] == sum(count for _, count in expected.values())
+    assert [(m['material_code'], m['unit']) for m in data['materials']] == sorted(expected)
+
+
+def test_rollup_matches_batch_output(client, app_module):
+    names = seed_recipes(app_module, recipe_count=5, items_per_recipe=3)
+    bom_data = batch_data(names, 20)
+    materials = client.post('/api/bom/rollup', json={'bom_data': bom_data}).get_json()['materials']
+
+    content = client.post('/api/bom/batch_generate_table',
+                          json={'bom_data': bom_data, 'format': 'csv', 'stream': True}).data
+    totals = {}
+    for row in list(csv.reader(io.StringIO(content.decode('utf-8'), newline='')))[1:]:
+        totals[(row[13], row[16])] = totals.get((row[13], row[16]), 0) + float(row[15])
+    assert len(materials) == len(totals)
+    for material in materials:
+        assert math.isclose(material['quantity'], totals[(material['material_code'], material['unit'])])
+
+
+def test_rollup_validation(client, app_module):
+    seed_recipes(app_module, recipe_count=2)
+    assert client.post('/api/bom/rollup', json={'bom_data': []}).status_code == 400
+    response = client.post('/api/bom/rollup', json={'bom_data': [{
+        'parent_material_code': 'P1', 'parent_material_name': '父', 'basic_quantity': 1,
+        'basic_unit': 'KG', 'recipe_names': ['不存在']}]})
+    assert response.status_code == 400
+    assert response.get_json()['errors']
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+配方接口条件请求测试
+只读配方接口返回由目录版本号生成的ETag，缓存有效时返回304且不查询数据库，配方写入后ETag变化
+"""
+
+import time
+
+import pytest
+from sqlalchemy import event
+
+from conftest import seed_recipes
+
+READ_URLS = ['/api/recipes', '/api/recipes?limit=5', '/api/recipe/categories', '/api/recipe/1',
+             '/api/recipe/search?q=M0001']
+
+
+def count_queries(app_module, func):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app_module.app.app_context():
+        engine = app_module.db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        result = func()
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return result, len(statements)
+
+
+@pytest.mark.parametrize('url', READ_URLS)
+def test_not_modified_without_database_access(app_module, client, url):
+    seed_recipes(app_module, recipe_count=5)
+    first = client.get(url)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert not etag.startswith('W/')
+    assert first.headers['Cache-Control'] == 'no-cache'
+
+    cached, queries = count_queries(app_module, lambda: client.get(url, headers={'If-None-Match': etag}))
+    assert cached.status_code == 304
+    assert cached.data == b''
+    assert cached.headers['ETag'] == etag
+    assert queries == 0
+
+
+def test_writes_change_etags(app_module, client):
+    seed_recipes(app_module, recipe_count=5)
+    etags = {url: client.get(url).headers['ETag'] for url in READ_URLS}
+    assert len(set(etags.values())) == len(READ_URLS)  # 不同请求的ETag不同
+
+    response = client.post('/api/recipe', json={
+        'name': '新配方', 'description': '', 'product_category': '',
+        'items': [{'material_code': 'X1', 'material_name': '物料', 'quantity': 1,
+                   'unit': 'KG', 'line_number': '0010', 'project_category': 'L'}]
+    })
+    assert response.get_json()['success']
+
+    for url, etag in etags.items():
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+    assert any(r['name'] == '新配方' for r in client.get('/api/recipes').get_json())
+
+
+def test_version_is_monotonic_across_restarts(app_module):
+    """版本号不小于当前毫秒时间戳，重启后新进程的版本号大于重启前的版本号"""
+    started = int(time.time() * 1000)
+    version = app_module.catalog_version
+    before = version.bump()
+    assert before >= started
+    assert version.bump() > before
+
+
+def test_errors_are_not_tagged(client):
+    response = client.get('/api/recipes?limit=abc')
+    assert response.status_code == 400
+    assert 'ETag' not in response.headers
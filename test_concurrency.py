@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite并发压力测试
+50个客户端同时生成BOM、修改和导入配方，不应出现“database is locked”
+"""
+
+import io
+import threading
+
+import openpyxl
+
+from conftest import seed_recipes
+
+CLIENT_COUNT = 50
+REQUESTS_PER_CLIENT = 4
+
+
+def make_import_file(client_index):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(['配方名称', '配方描述', '行号', '物料编码', '物料名称', '数量', '单位', '类别', '产品类别'])
+    for recipe in range(20):
+        for line in range(1, 6):
+            ws.append([f'导入配方{client_index}-{recipe}', '并发导入', f'{line * 10:04d}',
+                       f'I{client_index}{recipe}{line}', '导入物料', line, 'KG', 'L', '导入'])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def test_concurrent_clients_never_hit_lock_errors(app_module):
+    app = app_module.app
+    names = seed_recipes(app_module, recipe_count=10, items_per_recipe=5)
+    failures = []
+    generate_calls = []
+    start = threading.Barrier(CLIENT_COUNT)
+
+    def run_client(index):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['logged_in'] = True
+        start.wait()
+        for n in range(REQUESTS_PER_CLIENT):
+            kind = index % 5
+            if kind in (0, 1):
+                response = client.post('/api/generate_bom', json={
+                    'parent_material_code': f'P{index}-{n}',
+                    'parent_material_name': '并发父件',
+                    'basic_quantity': 2,
+                    'basic_unit': 'KG',
+                    'recipe_ids': [1, 2, 3]
+                })
+                generate_calls.append(index)
+            elif kind == 2:
+                response = client.post('/api/bom/batch_generate_table', json={'bom_data': [{
+                    'line_number': 1,
+                    'parent_material_code': f'B{index}-{n}',
+                    'parent_material_name': '批量父件',
+                    'basic_quantity': 1,
+                    'basic_unit': 'EA',
+                    'recipe_names': names[:3]
+                }]})
+            elif kind == 3:
+                recipe_id = index % 10 + 1
+                response = client.put(f'/api/recipe/{recipe_id}', json={
+                    'name': names[recipe_id - 1],
+                    'description': f'并发修改{index}-{n}',
+                    'product_category': '并发',
+                    'items': [{'material_code': f'U{index}', 'material_name': '修改物料', 'quantity': n + 1,
+                               'unit': 'KG', 'line_number': '0010', 'project_category': 'L'}]
+                })
+            else:
+                response = client.post('/api/recipe/import', data={
+                    'file': (io.BytesIO(make_import_file(index)), 'recipes.xlsx')
+                }, content_type='multipart/form-data')
+
+            body = response.get_data(as_text=True)
+            if response.status_code != 200 or 'locked' in body:
+                failures.append((index, response.status_code, body[:200]))
+
+    threads = [threading.Thread(target=run_client, args=(i,)) for i in range(CLIENT_COUNT)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    app_module.db_writer.join()
+
+    assert failures == []
+    with app.app_context():
+        assert app_module.BOMRequest.query.count() == len(generate_calls)
+        journal_mode = app_module.db.session.execute(app_module.db.text('PRAGMA journal_mode')).scalar()
+        assert journal_mode.lower() == 'wal'
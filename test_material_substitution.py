@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+批量替换物料测试
+预览不修改数据；执行后只改写命中的配方项，只更新受影响配方的updated_at，缓存、搜索索引和内容哈希随之更新
+"""
+
+import pytest
+
+from conftest import seed_recipes
+
+
+def substitute(client, **data):
+    return client.post('/api/recipe/substitute_material', json=data)
+
+
+@pytest.fixture
+def catalog(app_module, client):
+    seed_recipes(app_module, recipe_count=6, items_per_recipe=3)
+    # 物料S001出现在配方1、3、5中，配方5已停用
+    with app_module.app.app_context():
+        for item in app_module.RecipeItem.query.filter(app_module.RecipeItem.line_number == '0020'):
+            if item.recipe_id % 2:
+                item.material_code = 'S001'
+        app_module.db.session.get(app_module.Recipe, 5).is_active = False
+        app_module.rebuild_recipe_search_index()
+        app_module.db.session.commit()
+    return {r['id']: r for r in client.get('/api/recipes').get_json()}
+
+
+def items(client, recipe_id):
+    return client.get(f'/api/recipe/{recipe_id}').get_json()
+
+
+def test_dry_run_does_not_write(client, catalog):
+    before = [items(client, rid) for rid in catalog]
+    data = substitute(client, from_code='S001', to_code='S002', factor=2).get_json()
+    assert data['dry_run'] and data['recipe_count'] == 2 and data['line_count'] == 2
+    assert data['recipes'][0]['lines'] == [{
+        'line_number': '0020', 'material_code': 'S001', 'material_name': '原材料1-2', 'quantity': 1.0,
+        'new_material_code': 'S002', 'new_material_name': '原材料1-2', 'new_quantity': 2.0
+    }]
+    assert [items(client, rid) for rid in catalog] == before
+    assert client.get('/api/recipes').get_json() == list(catalog.values())
+
+
+def test_apply_rewrites_only_matching_lines(client, app_module, catalog):
+    def updated_at():
+        with app_module.app.app_context():
+            return dict(app_module.db.session.query(app_module.Recipe.id, app_module.Recipe.updated_at).all())
+
+    # 先读取一次配方以填充缓存
+    with app_module.app.app_context():
+        app_module.recipe_cache.get_by_ids([1, 3])
+    before = updated_at()
+    data = substitute(client, from_code='S001', to_code='S002', to_name='替代料', factor=1.5,
+                      dry_run=False).get_json()
+    assert not data['dry_run'] and data['recipe_count'] == 2
+
+    for recipe_id in (1, 3):
+        lines = items(client, recipe_id)
+        assert [(i['material_code'], i['material_name'], i['quantity']) for i in lines][1] == ('S002', '替代料', 1.5)
+        assert lines[0]['material_code'] == f'M{recipe_id:04d}01'
+    assert [i['material_code'] for i in items(client, 5)][1] == 'S001'  # 已停用的配方不变
+
+    after = updated_at()
+    assert sorted(rid for rid in after if after[rid] != before[rid]) == [1, 3]
+
+    with app_module.app.app_context():
+        cached = app_module.recipe_cache.get_by_ids([1])[1]
+    assert cached.items[1].material_code == 'S002'
+    assert client.get('/api/recipe/where_used?material_code=S001').get_json()['recipes'] == []
+    search = client.get('/api/recipe/search?q=S002').get_json()
+    assert sorted(r['id'] for r in search['recipes']) == [1, 3]
+
+    # 内容哈希在替换时按新的配方项重算，之后的补算不会再改动配方
+    lines = items(client, 1)
+    with app_module.app.app_context():
+        recipe = app_module.db.session.get(app_module.Recipe, 1)
+        assert recipe.content_hash == app_module.compute_recipe_hash(recipe.description, recipe.product_category, lines)
+        app_module.ensure_recipe_hashes([recipe])
+        app_module.db.session.commit()
+    assert updated_at() == after
+
+
+def test_conflicts_and_validation(client, catalog):
+    data = substitute(client, from_code='S001', to_code='M000101').get_json()
+    assert data['conflict_recipe_ids'] == [1]
+
+    assert substitute(client, from_code='S001').status_code == 400
+    assert substitute(client, to_code='S002').status_code == 400
+    assert substitute(client, from_code='S001', factor=0).status_code == 400
+    assert substitute(client, from_code='S001', factor='abc').status_code == 400
+    assert substitute(client, from_code='S001', to_code='X' * 51).status_code == 400
+    assert substitute(client, from_code='NONE', to_code='S002', dry_run=False).get_json()['recipe_count'] == 0
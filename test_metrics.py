@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+性能指标测试
+按接口统计请求耗时、SQL次数和耗时、输出行数、写出字节数和Excel保存耗时，/metrics输出Prometheus文本格式
+"""
+
+import re
+
+import pytest
+
+from conftest import seed_recipes
+
+SAMPLE = re.compile(r'^([a-z_]+)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'([a-z_]+)="((?:[^"\\]|\\.)*)"')
+
+
+def scrape(client):
+    """读取/metrics，返回 {(指标名称, 标签): 值}"""
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    samples = {}
+    for line in response.get_data(as_text=True).splitlines():
+        if line.startswith('#'):
+            continue
+        name, labels, value = SAMPLE.match(line).groups()
+        samples[(name, frozenset(LABEL.findall(labels or '')))] = float(value)
+    return samples
+
+
+def value(samples, name, **labels):
+    return samples.get((name, frozenset(labels.items())), 0)
+
+
+@pytest.fixture
+def metrics(app_module):
+    app_module.metrics.reset()
+    return app_module.metrics
+
+
+def test_request_latency_and_sql_per_endpoint(client, app_module, metrics):
+    seed_recipes(app_module)
+    for _ in range(3):
+        assert client.get('/api/recipes').status_code == 200
+    assert client.get('/api/recipe/export/999').status_code == 404
+
+    samples = scrape(client)
+    labels = {'endpoint': 'get_recipes', 'method': 'GET', 'status': '200'}
+    assert value(samples, 'bom_http_request_duration_seconds_count', **labels) == 3
+    assert value(samples, 'bom_http_request_duration_seconds_bucket', le='+Inf', **labels) == 3
+    assert value(samples, 'bom_http_request_duration_seconds_sum', **labels) > 0
+    assert value(samples, 'bom_http_request_duration_seconds_count',
+                 endpoint='export_recipe', method='GET', status='404') == 1
+
+    # 直方图的桶为累计计数
+    buckets = sorted((float(dict(labels_)['le']), count) for (name, labels_), count in samples.items()
+                     if name == 'bom_http_request_duration_seconds_bucket' and labels.items() <= dict(labels_).items())
+    assert len(buckets) == len(app_module.MetricsRegistry.DURATION_BUCKETS) + 1
+    counts = [count for _, count in buckets]
+    assert counts == sorted(counts)
+
+    assert value(samples, 'bom_sql_queries_total', endpoint='get_recipes') >= 3
+    assert value(samples, 'bom_sql_query_duration_seconds_total', endpoint='get_recipes') > 0
+
+
+def test_batch_rows_bytes_and_save_time(client, app_module, metrics):
+    names = seed_recipes(app_module, recipe_count=5, items_per_recipe=4)
+    bom_data = [{'line_number': i, 'parent_material_code': f'P{i}', 'parent_material_name': f'父物料{i}',
+                 'basic_quantity': 2, 'basic_unit': 'KG', 'recipe_names': names[:2]} for i in range(1, 6)]
+    result = client.post('/api/bom/batch_generate_table', json={'bom_data': bom_data}).get_json()
+    assert result['success']
+    size = len(client.get(result['download_url']).data)
+
+    samples = scrape(client)
+    endpoint = 'batch_generate_bom_from_table'
+    assert value(samples, 'bom_rows_rendered_total', endpoint=endpoint) == 5 * 2 * 4
+    assert value(samples, 'bom_bytes_written_total', endpoint=endpoint) == size
+    assert value(samples, 'bom_excel_save_duration_seconds_count', endpoint=endpoint) == 1
+
+    # 流式下载在后台线程写出，仍记在发起请求的接口下
+    metrics.reset()
+    streamed = client.post('/api/bom/batch_generate_table', json={'bom_data': bom_data, 'format': 'csv',
+                                                                  'stream': True})
+    size = len(streamed.get_data())
+    samples = scrape(client)
+    assert value(samples, 'bom_rows_rendered_total', endpoint=endpoint) == 40
+    assert value(samples, 'bom_bytes_written_total', endpoint=endpoint) == size
+
+
+def test_label_escaping_and_disabled(client, app_module, metrics):
+    with metrics.scope('a"b\\c\nd'):
+        metrics.inc('bom_rows_rendered_total', 2)
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'bom_rows_rendered_total{endpoint="a\\"b\\\\c\\nd"} 2' in text
+    assert '# TYPE bom_http_request_duration_seconds histogram' in text
+
+    app_module.app.config['METRICS_ENABLED'] = False
+    try:
+        assert client.get('/metrics').status_code == 404
+    finally:
+        app_module.app.config['METRICS_ENABLED'] = True
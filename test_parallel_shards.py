@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+多进程分片生成测试
+zip包中各分片工作簿的数据行按顺序拼接后与单进程生成的批量BOM表完全一致（含可选BOM编号和行顺序）
+"""
+
+import io
+import zipfile
+
+import openpyxl
+
+from conftest import seed_recipes
+
+
+def sheet_rows(content):
+    ws = openpyxl.load_workbook(io.BytesIO(content), read_only=True).active
+    return list(ws.iter_rows(min_row=8, values_only=True))
+
+
+def test_shards_concatenate_to_sequential_output(client, app_module, monkeypatch):
+    names = seed_recipes(app_module, recipe_count=8, items_per_recipe=3)
+    # 各父物料选用不同数量的配方，可选BOM编号在分片边界两侧都要从01重新开始
+    bom_data = [{'line_number': i, 'parent_material_code': f'P{i:03d}', 'parent_material_name': f'父物料{i}',
+                 'basic_quantity': [1, 2.5, 1000][i % 3], 'basic_unit': 'KG',
+                 'recipe_names': names[i % 5:i % 5 + 1 + i % 3]} for i in range(1, 12)]
+    monkeypatch.setitem(app_module.app.config, 'BOM_PROCESS_WORKERS', 3)
+    monkeypatch.setitem(app_module.app.config, 'BOM_SHARD_MIN_PARENTS', 2)
+    monkeypatch.setattr(app_module, '_bom_process_pool', None)
+
+    sequential = client.post('/api/bom/batch_generate_table', json={'bom_data': bom_data}).get_json()
+    expected = sheet_rows(client.get(sequential['download_url']).data)
+
+    try:
+        parallel = client.post('/api/bom/batch_generate_table', json={'bom_data': bom_data, 'parallel': True}).get_json()
+        assert parallel['success'], parallel
+        archive = zipfile.ZipFile(io.BytesIO(client.get(parallel['download_url']).data))
+    finally:
+        app_module.reset_bom_process_pool()
+
+    names_in_archive = archive.namelist()
+    assert names_in_archive == sorted(names_in_archive) and len(names_in_archive) == 3
+    shard_rows = [sheet_rows(archive.read(name)) for name in names_in_archive]
+    assert all(shard_rows)
+    assert [row for rows in shard_rows for row in rows] == expected
+    # 每个分片的第一行都是某个父物料的第一个配方
+    assert all(rows[0][7] == '01' for rows in shard_rows)
+
+
+def test_pool_uses_spawn_and_shards_record_no_metrics(app_module, monkeypatch, tmp_path):
+    monkeypatch.setitem(app_module.app.config, 'BOM_PROCESS_WORKERS', 1)
+    monkeypatch.setattr(app_module, '_bom_process_pool', None)
+    try:
+        assert app_module.get_bom_process_pool()._mp_context.get_start_method() == 'spawn'
+    finally:
+        app_module.reset_bom_process_pool()
+
+    # 分片在子进程中生成，不能使用父进程fork时可能被其他线程持有的指标锁
+    def no_metrics(*args, **kwargs):
+        raise AssertionError('分片生成不应记录指标')
+
+    monkeypatch.setattr(app_module.metrics, 'inc', no_metrics)
+    monkeypatch.setattr(app_module.metrics, 'observe', no_metrics)
+    recipe = app_module.CompiledRecipe(1, '配方A', None, None, True, (
+        app_module.RecipeLine('0010', 'M01', '物料1', 2.0, 'KG', 'L'),
+        app_module.RecipeLine('0020', 'M02', '物料2', 3.0, 'EA', 'L')))
+    bom_items = [{'parent_material_code': f'P{i}', 'parent_material_name': f'父物料{i}',
+                  'basic_quantity': i, 'basic_unit': 'KG', 'recipe_ids': [1]} for i in range(1, 4)]
+    path = str(tmp_path / 'shard.xlsx')
+    assert app_module.write_batch_bom_shard(bom_items, {1: recipe}, path) == 6
+    assert [row[15] for row in sheet_rows((tmp_path / 'shard.xlsx').read_bytes())] == [2.0, 3.0, 4.0, 3.0, 6.0, 3.0]
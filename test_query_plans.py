@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+热点查询的执行计划测试
+通过EXPLAIN QUERY PLAN确认配方相关查询走索引，防止退化为全表扫描
+"""
+
+import re
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from conftest import seed_recipes
+
+FULL_SCAN = re.compile(r'^SCAN (recipe|recipe_item)\b(?!.*\bINDEX\b)')
+
+
+@contextmanager
+def captured_selects(app_module):
+    """记录请求期间执行的SELECT语句及参数"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    with app_module.app.app_context():
+        engine = app_module.db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def query_plans(app_module, statements):
+    """返回每条语句的执行计划明细列表"""
+    plans = []
+    with app_module.app.app_context():
+        connection = app_module.db.engine.raw_connection()
+        try:
+            for statement, parameters in statements:
+                rows = connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+                plans.append((statement, [row[-1] for row in rows]))
+        finally:
+            connection.close()
+    return plans
+
+
+def assert_no_full_scans(plans):
+    for statement, details in plans:
+        for detail in details:
+            assert not FULL_SCAN.match(detail), f'全表扫描：{detail}\n{statement}'
+
+
+def test_recipe_list_uses_active_index(app_module, client):
+    seed_recipes(app_module)
+    with captured_selects(app_module) as statements:
+        assert client.get('/api/recipes').status_code == 200
+    plans = query_plans(app_module, statements)
+    assert_no_full_scans(plans)
+    assert any(detail.startswith('SEARCH recipe USING INDEX ix_recipe_active_')
+               for _, details in plans for detail in details)
+
+
+def test_recipe_categories_use_covering_index(app_module, client):
+    seed_recipes(app_module)
+    with captured_selects(app_module) as statements:
+        assert client.get('/api/recipe/categories').status_code == 200
+    plans = query_plans(app_module, statements)
+    assert_no_full_scans(plans)
+    assert any('COVERING INDEX ix_recipe_active_category' in detail for _, details in plans for detail in details)
+
+
+@pytest.mark.parametrize('params', [
+    {'limit': 5},
+    {'limit': 5, 'sort': 'name_desc'},
+    {'limit': 5, 'category': '类别1'},
+    {'limit': 5, 'sort': 'updated_desc'},
+])
+def test_recipe_pages_use_keyset_indexes(app_module, client, params):
+    """分页查询（含游标翻页）按索引顺序读取，不需要临时排序"""
+    seed_recipes(app_module)
+    first = client.get('/api/recipes', query_string=params).get_json()
+    with captured_selects(app_module) as statements:
+        page = client.get('/api/recipes', query_string=dict(params, cursor=first['next_cursor']))
+        assert page.status_code == 200
+    plans = query_plans(app_module, statements)
+    assert_no_full_scans(plans)
+    details = [detail for _, details in plans for detail in details]
+    assert any(detail.startswith('SEARCH recipe USING INDEX ix_recipe_active_') for detail in details)
+    assert not any('TEMP B-TREE' in detail for detail in details)
+
+
+def test_recipe_items_ordered_by_index(app_module, client):
+    seed_recipes(app_module)
+    with captured_selects(app_module) as statements:
+        assert client.get('/api/recipe/3').status_code == 200
+    plans = query_plans(app_module, statements)
+    assert_no_full_scans(plans)
+    details = [detail for _, details in plans for detail in details]
+    assert any('ix_recipe_item_recipe_line' in detail for detail in details)
+    assert not any('TEMP B-TREE' in detail for detail in details)
+
+
+def test_export_all_reads_in_index_order(app_module, client):
+    """批量导出用一条关联查询按索引顺序读取全部配方项，不需要临时排序"""
+    seed_recipes(app_module)
+    with captured_selects(app_module) as statements:
+        assert client.get('/api/recipe/export_all').status_code == 200
+    plans = query_plans(app_module, statements)
+    assert_no_full_scans(plans)
+    assert sum('recipe_item' in statement for statement, _ in plans) == 1
+    details = [detail for _, details in plans for detail in details]
+    assert any('ix_recipe_item_recipe_line' in detail for detail in details)
+    assert not any('TEMP B-TREE' in detail for detail in details)
+
+
+@pytest.mark.parametrize('params', [{}, {'category': '类别1'}])
+def test_delta_export_uses_updated_index(app_module, client, params):
+    """增量导出按更新时间索引查找变化和删除的配方，不需要临时排序"""
+    seed_recipes(app_module)
+    with captured_selects(app_module) as statements:
+        response = client.get('/api/recipe/export_all', query_string=dict(params, since='2000-01-01'))
+        assert response.status_code == 200
+    plans = query_plans(app_module, statements)
+    assert_no_full_scans(plans)
+    details = [detail for _, details in plans for detail in details]
+    assert any(detail.startswith('SEARCH recipe USING INDEX ix_recipe_updated') for detail in details)
+    assert not any('TEMP B-TREE' in detail for detail in details)
+
+
+def test_batch_generation_queries_use_indexes(app_module, client):
+    names = seed_recipes(app_module)
+    bom_data = [{
+        'line_number': i,
+        'parent_material_code': f'P{i:04d}',
+        'parent_material_name': f'父件{i}',
+        'basic_quantity': 2,
+        'basic_unit': 'KG',
+        'recipe_names': names[i % 7:i % 7 + 3]
+    } for i in range(1, 30)]
+    with captured_selects(app_module) as statements:
+        response = client.post('/api/bom/batch_generate_table', json={'bom_data': bom_data})
+        assert response.status_code == 200
+    plans = query_plans(app_module, statements)
+    assert_no_full_scans(plans)
+    details = [detail for _, details in plans for detail in details]
+    assert any('ix_recipe_item_recipe_line' in detail for detail in details)
+
+
+@pytest.mark.parametrize('explode', [False, True])
+def test_batch_generation_query_count_is_constant(app_module, client, explode):
+    """批量生成一次性解析整批配方，SELECT语句数不随父物料数增长"""
+    names = seed_recipes(app_module)
+
+    def selects_for(parent_count):
+        bom_data = [{
+            'line_number': i,
+            'parent_material_code': f'P{i:04d}',
+            'parent_material_name': f'父件{i}',
+            'basic_quantity': 2,
+            'basic_unit': 'KG',
+            'recipe_names': names[i % 7:i % 7 + 3]
+        } for i in range(1, parent_count + 1)]
+        app_module.recipe_cache.clear()
+        with captured_selects(app_module) as statements:
+            response = client.post('/api/bom/batch_generate_table', json={'bom_data': bom_data, 'explode': explode})
+            assert response.status_code == 200
+            app_module.db_writer.join()
+        return len(statements)
+
+    assert selects_for(10) == selects_for(200) > 0
+
+
+def test_where_used_uses_material_index(app_module, client):
+    seed_recipes(app_module)
+    for params in ({'material_code': 'M000302'}, {'material_code': 'M001', 'prefix': 1}):
+        with captured_selects(app_module) as statements:
+            assert client.get('/api/recipe/where_used', query_string=params).status_code == 200
+        plans = query_plans(app_module, statements)
+        assert_no_full_scans(plans)
+        details = [detail for _, details in plans for detail in details]
+        assert any('ix_recipe_item_material' in detail for detail in details)
+
+
+def schema(db):
+    """各表的列（名称, 类型, 非空, 主键）和索引（名称 -> 列）"""
+    result = {}
+    tables = db.session.execute(db.text(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")).scalars().all()
+    for table in tables:
+        columns = {(row[1], row[2], row[3], row[5])
+                   for row in db.session.execute(db.text(f'PRAGMA table_info("{table}")'))}
+        indexes = {row[1]: tuple(info[2] for info in db.session.execute(db.text(f'PRAGMA index_info("{row[1]}")')))
+                   for row in db.session.execute(db.text(f'PRAGMA index_list("{table}")'))}
+        result[table] = (columns, indexes)
+    return result
+
+
+def test_migrations_upgrade_baseline_database(app_module):
+    """最初版本的数据库（只有配方、配方项和BOM生成记录表，无索引）按启动流程执行create_all和
+    全部迁移后，表、列和索引与新建数据库完全一致"""
+    db = app_module.db
+    with app_module.app.app_context():
+        expected = schema(db)
+        db.drop_all()
+        db.session.execute(db.text('DROP TABLE schema_migrations'))
+        db.session.execute(db.text(f'DROP TABLE {app_module.RECIPE_SEARCH_TABLE}'))
+        db.session.execute(db.text(
+            'CREATE TABLE recipe (id INTEGER NOT NULL, recipe_name VARCHAR(100) NOT NULL, description TEXT, '
+            'product_category VARCHAR(100), is_active BOOLEAN, created_at DATETIME, updated_at DATETIME, '
+            'PRIMARY KEY (id), UNIQUE (recipe_name))'))
+        db.session.execute(db.text(
+            'CREATE TABLE recipe_item (id INTEGER NOT NULL, recipe_id INTEGER NOT NULL, '
+            'material_code VARCHAR(50) NOT NULL, material_name VARCHAR(200) NOT NULL, quantity FLOAT NOT NULL, '
+            'unit VARCHAR(20) NOT NULL, line_number VARCHAR(10) NOT NULL, project_category VARCHAR(10), '
+            'PRIMARY KEY (id), FOREIGN KEY(recipe_id) REFERENCES recipe (id))'))
+        db.session.execute(db.text(
+            'CREATE TABLE bom_request (id INTEGER NOT NULL, parent_material_code VARCHAR(50) NOT NULL, '
+            'parent_material_name VARCHAR(200) NOT NULL, basic_quantity FLOAT NOT NULL, '
+            'basic_unit VARCHAR(20) NOT NULL, recipe_ids TEXT NOT NULL, created_at DATETIME, PRIMARY KEY (id))'))
+        db.session.execute(db.text(
+            "INSERT INTO recipe VALUES (1, '旧配方', '', '类别A', 1, '2024-01-01 08:00:00', '2024-01-01 08:00:00')"))
+        db.session.execute(db.text(
+            "INSERT INTO recipe_item VALUES (1, 1, 'M001', '原材料A', 2.5, 'KG', '0010', 'L')"))
+        db.session.execute(db.text(
+            "INSERT INTO bom_request VALUES (1, 'P001', '父物料', 1, 'KG', '1', '2024-01-02 08:00:00')"))
+        db.session.commit()
+
+        db.create_all()
+        assert app_module.run_migrations() == [version for version, _, _ in app_module.MIGRATIONS]
+        assert app_module.run_migrations() == []
+
+        assert schema(db) == expected
+        indexes = schema(db)['recipe'][1]
+        assert indexes['ix_recipe_active_category_name'] == ('is_active', 'product_category', 'recipe_name')
+        assert 'ix_recipe_active_category' not in indexes
+
+        # 已有数据：补齐配方与BOM生成记录的对应关系，建立搜索索引
+        assert db.session.execute(db.text('SELECT bom_request_id, recipe_id FROM bom_request_recipe')).all() == [(1, 1)]
+        assert db.session.execute(db.text(
+            f"SELECT rowid FROM {app_module.RECIPE_SEARCH_TABLE} WHERE {app_module.RECIPE_SEARCH_TABLE} MATCH 'M001'"
+        )).scalars().all() == [1]
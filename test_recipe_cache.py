@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+配方缓存测试
+LRU淘汰、配方写入后失效、加载期间发生写入时不写入旧数据，以及命中/未命中计数
+"""
+
+from sqlalchemy import event
+
+from conftest import seed_recipes
+
+
+def count_selects(app_module, function):
+    """执行function，返回(结果, 期间执行的SELECT语句数)"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = app_module.db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        result = function()
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return result, len(statements)
+
+
+def test_lru_eviction_and_counters(app_module):
+    seed_recipes(app_module, recipe_count=5, items_per_recipe=2)
+    cache = app_module.RecipeCache(3)
+    with app_module.app.app_context():
+        assert sorted(cache.get_by_ids([1, 2, 3])) == [1, 2, 3]
+        assert cache.get_by_ids(['1'])[1].recipe_name == '配方0001'  # 1变为最近使用
+        cache.get_by_ids([4])  # 超出容量，淘汰最久未使用的2
+        stats = cache.stats()
+        assert (stats['size'], stats['hits'], stats['misses'], stats['evictions']) == (3, 1, 4, 1)
+
+        # 缓存中为3、1、4（由旧到新）
+        recipe, selects = count_selects(app_module, lambda: cache.get_by_names(['配方0003']))
+        assert recipe['配方0003'].id == 3 and selects == 0
+        _, selects = count_selects(app_module, lambda: cache.get_by_ids([2]))  # 淘汰1
+        assert selects > 0
+        _, selects = count_selects(app_module, lambda: cache.get_by_ids([4, 3, 2]))
+        assert selects == 0
+        _, selects = count_selects(app_module, lambda: cache.get_by_names(['配方0001']))  # 淘汰4
+        assert selects > 0
+        assert cache.get_by_ids([99, 'x']) == {}
+        stats = cache.stats()
+        assert (stats['size'], stats['hits'], stats['misses'], stats['evictions']) == (3, 5, 7, 3)
+        assert stats['hit_rate'] == round(5 / 12, 4)
+
+def test_recipe_writes_invalidate_entries(client, app_module):
+    seed_recipes(app_module, recipe_count=3, items_per_recipe=2)
+    cache = app_module.recipe_cache
+    with app_module.app.app_context():
+        assert cache.get_by_ids([1])[1].items[0].material_code == 'M000101'
+        assert '配方0002' in cache.get_by_names(['配方0002'])
+    invalidations = cache.stats()['invalidations']
+
+    assert client.put('/api/recipe/1', json={
+        'name': '配方0001', 'description': '修改后', 'product_category': '',
+        'items': [{'material_code': 'NEW', 'material_name': '新物料', 'quantity': 1, 'unit': 'KG',
+                   'line_number': '0010', 'project_category': 'L'}],
+    }).get_json()['success']
+    assert client.put('/api/recipe/2', json={
+        'name': '改名配方', 'description': '', 'product_category': '',
+        'items': [{'material_code': 'M1', 'material_name': '物料', 'quantity': 1, 'unit': 'KG',
+                   'line_number': '0010', 'project_category': 'L'}],
+    }).get_json()['success']
+    assert client.delete('/api/recipe/3').get_json()['success']
+    assert cache.stats()['invalidations'] == invalidations + 3
+
+    with app_module.app.app_context():
+        assert [item.material_code for item in cache.get_by_ids([1])[1].items] == ['NEW']
+        assert cache.get_by_names(['配方0002']) == {}  # 旧名称不再命中
+        assert cache.get_by_names(['改名配方'])['改名配方'].id == 2
+        assert cache.get_by_ids([3])[3].is_active is False
+
+
+def test_stale_fill_is_not_cached(app_module, monkeypatch):
+    seed_recipes(app_module, recipe_count=2, items_per_recipe=2)
+    cache = app_module.RecipeCache(10)
+    load = app_module.load_compiled_recipes_by_ids
+
+    def load_during_write(recipe_ids):
+        loaded = load(recipe_ids)
+        cache.invalidate([1])  # 加载期间另一请求修改了配方并使缓存失效
+        return loaded
+
+    monkeypatch.setattr(app_module, 'load_compiled_recipes_by_ids', load_during_write)
+    with app_module.app.app_context():
+        assert sorted(cache.get_by_ids([1, 2])) == [1, 2]  # 本次请求仍返回加载结果
+        assert cache.stats()['size'] == 0  # 但不写入缓存
+
+        monkeypatch.setattr(app_module, 'load_compiled_recipes_by_ids', load)
+        cache.get_by_ids([1, 2])
+        assert cache.stats()['size'] == 2
+        cache.clear()
+        assert cache.stats()['size'] == 0
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+配方批量导出测试
+导出文件的表头、空行、列宽和数据行顺序与导入模板一致
+增量导出只包含更新时间晚于水位线的配方，并列出期间删除的配方
+"""
+
+import io
+from datetime import datetime, timedelta
+
+import openpyxl
+import pytest
+
+from conftest import seed_recipes
+
+
+def load_sheet(response):
+    assert response.status_code == 200
+    return openpyxl.load_workbook(io.BytesIO(response.data)).active
+
+
+def test_export_all_layout_and_rows(client, app_module):
+    seed_recipes(app_module, recipe_count=4, items_per_recipe=3)
+    with app_module.app.app_context():
+        # 停用的配方不导出；描述和产品类别为空时输出空单元格
+        app_module.db.session.get(app_module.Recipe, 2).is_active = False
+        recipe = app_module.db.session.get(app_module.Recipe, 3)
+        recipe.description = None
+        recipe.product_category = None
+        app_module.db.session.commit()
+
+    ws = load_sheet(client.get('/api/recipe/export_all'))
+    assert ws.title == '所有配方'
+    header = [cell.value for cell in ws[1]]
+    assert header == app_module.RECIPE_EXPORT_HEADERS
+    assert all(cell.font.bold and cell.alignment.horizontal == 'center' for cell in ws[1])
+    assert [ws.column_dimensions[letter].width for letter in 'ABCDEFGHI'] == app_module.RECIPE_EXPORT_COLUMN_WIDTHS
+    assert all(cell.value is None for row in ws.iter_rows(min_row=2, max_row=7) for cell in row)
+
+    rows = list(ws.iter_rows(min_row=8, values_only=True))
+    assert [(row[0], row[2]) for row in rows] == [
+        (f'配方{i:04d}', f'{j * 10:04d}') for i in (1, 3, 4) for j in range(1, 4)]
+    assert rows[0] == ('配方0001', '测试配方1', '0010', 'M000101', '原材料1-1', 0.5, 'M', 'L', '类别1')
+    assert rows[3][1] is None and rows[3][8] is None
+
+
+def test_export_all_without_recipes(client, app_module):
+    response = client.get('/api/recipe/export_all')
+    assert response.status_code == 404
+    assert response.get_json()['error'] == '没有找到可导出的配方'
+
+
+def export_delta(client, since, **params):
+    """增量导出，返回 (变化的配方项行, 墓碑行, 水位线)"""
+    response = client.get('/api/recipe/export_all', query_string=dict(params, since=since))
+    assert response.status_code == 200
+    wb = openpyxl.load_workbook(io.BytesIO(response.data))
+    assert wb.sheetnames == ['所有配方', '已删除配方']
+    rows = list(wb['所有配方'].iter_rows(min_row=8, values_only=True))
+    tombstones = list(wb['已删除配方'].iter_rows(min_row=2, values_only=True))
+    return rows, tombstones, response.headers['X-Export-Watermark']
+
+
+def test_delta_export_changes_and_tombstones(client, app_module):
+    seed_recipes(app_module, recipe_count=6, items_per_recipe=3)
+    watermark = client.get('/api/recipe/export_all').headers['X-Export-Watermark']
+
+    # 没有变化时只有表头，水位线不变
+    assert export_delta(client, watermark) == ([], [], watermark)
+
+    assert client.put('/api/recipe/2', json={
+        'name': '配方0002', 'description': '修改后', 'product_category': '类别2',
+        'items': [{'material_code': 'M9', 'material_name': '新物料', 'quantity': 3, 'unit': 'KG',
+                   'line_number': '0010', 'project_category': 'L'}],
+    }).get_json()['success']
+    assert client.delete('/api/recipe/4').get_json()['success']
+
+    rows, tombstones, next_watermark = export_delta(client, watermark)
+    assert rows == [('配方0002', '修改后', '0010', 'M9', '新物料', 3, 'KG', 'L', '类别2')]
+    assert [(name, category) for name, category, _ in tombstones] == [('配方0004', '类别1')]
+    assert next_watermark > watermark
+    assert export_delta(client, next_watermark) == ([], [], next_watermark)
+
+    # 从水位线之前的时间开始：两次变化都包含在内，按更新时间排序
+    rows, tombstones, _ = export_delta(client, '2000-01-01')
+    assert [row[0] for row in rows] == [f'配方{i:04d}' for i in (1, 3, 5, 6) for _ in range(3)] + ['配方0002']
+    assert [row[0] for row in tombstones] == ['配方0004']
+
+
+def test_export_filtered_by_category(client, app_module):
+    seed_recipes(app_module, recipe_count=6, items_per_recipe=2)
+    assert client.delete('/api/recipe/3').get_json()['success']  # 类别0
+    assert client.delete('/api/recipe/4').get_json()['success']  # 类别1
+
+    ws = load_sheet(client.get('/api/recipe/export_all', query_string={'category': '类别1'}))
+    assert {row[0] for row in ws.iter_rows(min_row=8, values_only=True)} == {'配方0001'}
+
+    rows, tombstones, _ = export_delta(client, '2000-01-01T00:00:00+08:00', category='类别0')
+    assert {row[0] for row in rows} == {'配方0006'}
+    assert [row[0] for row in tombstones] == ['配方0003']
+
+    response = client.get('/api/recipe/export_all', query_string={'category': '不存在'})
+    assert response.status_code == 404
+
+
+def test_parse_export_since(app_module):
+    parse = app_module.parse_export_since
+    assert parse('2025-03-01 08:00:00') == app_module.datetime(2025, 3, 1, 8)
+    assert parse('2025-03-01T00:00:00.5+00:00') == app_module.datetime(2025, 3, 1, 8, 0, 0, 500000)
+    assert parse('2025-03-01T08:00:00 08:00') == app_module.datetime(2025, 3, 1, 8)  # 未编码的"+"
+    assert parse('2025-02-28T19:00:00-05:00') == app_module.datetime(2025, 3, 1, 8)
+    with pytest.raises(ValueError):
+        parse('昨天')
+
+
+def test_watermark_round_trips_across_timezones(client, app_module):
+    """水位线带时区，客户端换算成其他时区后传回时窗口不变"""
+    seed_recipes(app_module, recipe_count=3, items_per_recipe=2)
+    watermark = client.get('/api/recipe/export_all').headers['X-Export-Watermark']
+    parsed = datetime.fromisoformat(watermark)
+    assert parsed.utcoffset() == timedelta(hours=8)
+
+    as_utc = parsed.astimezone(app_module.pytz.utc).isoformat()
+    as_new_york = parsed.astimezone(app_module.pytz.timezone('America/New_York')).isoformat()
+    for since in (watermark, as_utc, as_new_york):
+        assert export_delta(client, since) == ([], [], watermark)
+
+    assert client.delete('/api/recipe/2').get_json()['success']
+    for since in (watermark, as_utc, as_new_york):
+        rows, tombstones, next_watermark = export_delta(client, since)
+        assert rows == [] and [row[0] for row in tombstones] == ['配方0002']
+        assert datetime.fromisoformat(next_watermark) > parsed
+
+
+def test_invalid_since(client, app_module):
+    response = client.get('/api/recipe/export_all', query_string={'since': 'yesterday'})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == '无效的起始时间：yesterday'
+
+
+def test_unchanged_reimport_is_not_a_delta(client, app_module):
+    """重新导入导出文件（内容未变化）不产生增量，包括尚未保存内容哈希的旧数据"""
+    seed_recipes(app_module, recipe_count=4, items_per_recipe=2)
+    with app_module.app.app_context():
+        app_module.db.session.execute(app_module.db.text('UPDATE recipe SET content_hash = NULL'))
+        app_module.db.session.commit()
+    exported = client.get('/api/recipe/export_all')
+    watermark = exported.headers['X-Export-Watermark']
+
+    result = client.post('/api/recipe/import', data={'file': (io.BytesIO(exported.data), '所有配方.xlsx')}).get_json()
+    assert result['success'] and result['unchanged_count'] == 4
+    assert export_delta(client, watermark) == ([], [], watermark)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+配方内容哈希测试
+重新提交或导入内容未变化的配方时不重写配方、不改变更新时间；升级前没有哈希的配方补算哈希后同样保持不变
+"""
+
+import io
+
+import openpyxl
+
+ITEMS = [
+    {'material_code': 'M001', 'material_name': '原材料1', 'quantity': 2, 'unit': 'KG',
+     'line_number': '0010', 'project_category': 'L'},
+    {'material_code': 'M002', 'material_name': '原材料2', 'quantity': 0.5, 'unit': 'M',
+     'line_number': '0020', 'project_category': 'L'},
+]
+
+
+def import_file(recipes):
+    """生成导入文件，recipes为 {配方名称: (描述, 配方项列表)}"""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(['配方名称', '配方描述', '行号', '物料编码', '物料名称', '数量', '单位', '类别', '产品类别'])
+    for name, (description, items) in recipes.items():
+        for item in items:
+            ws.append([name, description, item['line_number'], item['material_code'], item['material_name'],
+                       item['quantity'], item['unit'], item['project_category'], '类别A'])
+    content = io.BytesIO()
+    wb.save(content)
+    return {'file': (io.BytesIO(content.getvalue()), 'recipes.xlsx')}
+
+
+def recipe_state(app_module):
+    """返回 {配方名称: (更新时间, 内容哈希)}"""
+    with app_module.app.app_context():
+        Recipe = app_module.Recipe
+        return {name: (updated_at, content_hash) for name, updated_at, content_hash in app_module.db.session.query(
+            Recipe.recipe_name, Recipe.updated_at, Recipe.content_hash)}
+
+
+def clear_hashes(app_module):
+    """模拟升级前的数据：内容哈希为空（不改变更新时间）"""
+    with app_module.app.app_context():
+        app_module.db.session.execute(app_module.db.text('UPDATE recipe SET content_hash = NULL'))
+        app_module.db.session.commit()
+
+
+def test_hash_ignores_item_order_and_number_format(app_module):
+    compute = app_module.compute_recipe_hash
+    items = app_module.normalize_recipe_items(ITEMS)
+    reordered = app_module.normalize_recipe_items([dict(ITEMS[1], quantity='0.50'), ITEMS[0]])
+    assert compute('描述', '类别A', items) == compute('描述', '类别A', reordered)
+    assert compute('描述', '类别A', items) != compute('描述', '类别B', items)
+    assert compute('描述', '类别A', items) != compute('描述', '类别A', items[:1])
+
+
+def test_unchanged_repost_keeps_updated_at(client, app_module):
+    payload = {'name': '配方A', 'description': '描述', 'product_category': '类别A', 'items': ITEMS}
+    assert client.post('/api/recipe', json=payload).get_json()['success']
+    clear_hashes(app_module)
+    before = recipe_state(app_module)['配方A']
+
+    result = client.post('/api/recipe', json=payload).get_json()
+    assert result['unchanged'] is True
+    updated_at, content_hash = recipe_state(app_module)['配方A']
+    assert updated_at == before[0]
+    assert content_hash is not None
+
+    result = client.post('/api/recipe', json=dict(payload, description='新描述')).get_json()
+    assert 'unchanged' not in result
+    assert recipe_state(app_module)['配方A'][0] > updated_at
+
+
+def test_reimport_counts_and_unchanged_recipes(client, app_module):
+    recipes = {'配方A': ('描述A', ITEMS), '配方B': ('描述B', ITEMS[:1]), '配方C': ('描述C', ITEMS)}
+    result = client.post('/api/recipe/import', data=import_file(recipes)).get_json()
+    assert (result['created_count'], result['updated_count'], result['unchanged_count']) == (3, 0, 0)
+    clear_hashes(app_module)
+    before = recipe_state(app_module)
+
+    result = client.post('/api/recipe/import', data=import_file(recipes)).get_json()
+    assert (result['created_count'], result['updated_count'], result['unchanged_count']) == (0, 0, 3)
+    after = recipe_state(app_module)
+    assert {name: updated_at for name, (updated_at, _) in after.items()} == \
+        {name: updated_at for name, (updated_at, _) in before.items()}
+    assert all(content_hash for _, content_hash in after.values())
+
+    recipes['配方B'] = ('描述B', ITEMS)
+    result = client.post('/api/recipe/import', data=import_file(recipes)).get_json()
+    assert (result['created_count'], result['updated_count'], result['unchanged_count']) == (0, 1, 2)
+    assert result['updated_recipes'] == ['配方B']
+    changed = recipe_state(app_module)
+    assert [name for name in changed if changed[name][0] != after[name][0]] == ['配方B']
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+配方导入测试
+逐行流式解析校验，不完整的行跳过；配方项以一条executemany语句批量写入，返回各阶段耗时
+"""
+
+import io
+
+import openpyxl
+from sqlalchemy import event
+
+HEADER = ['配方名称', '配方描述', '行号', '物料编码', '物料名称', '数量', '单位', '类别', '产品类别']
+
+
+def import_file(recipe_count, items_per_recipe, extra_rows=()):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(HEADER)
+    for i in range(1, recipe_count + 1):
+        for j in range(1, items_per_recipe + 1):
+            ws.append([f'导入配方{i:03d}', f'描述{i}', f'{j * 10:04d}', f'M{i:03d}{j:02d}', f'物料{j}',
+                       j * 0.5, 'KG', None if j == 1 else 'N', f'类别{i % 2}'])
+    for row in extra_rows:
+        ws.append(row)
+    content = io.BytesIO()
+    wb.save(content)
+    return {'file': (io.BytesIO(content.getvalue()), 'import.xlsx')}
+
+
+def import_with_item_inserts(client, app_module, data):
+    """导入并返回(响应数据, 写入recipe_item的INSERT语句数)"""
+    inserts = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('INSERT INTO RECIPE_ITEM'):
+            inserts.append(statement)
+
+    with app_module.app.app_context():
+        engine = app_module.db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        result = client.post('/api/recipe/import', data=data).get_json()
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return result, len(inserts)
+
+
+def test_import_bulk_inserts_items(client, app_module):
+    result, inserts = import_with_item_inserts(client, app_module, import_file(40, 5, extra_rows=[
+        [None] * 9,  # 空行
+        ['导入配方999', '', '0010', 'M1', '物料', None, 'KG', 'L', ''],  # 缺少数量
+    ]))
+    assert result['success'], result
+    assert (result['recipe_count'], result['created_count'], result['item_count']) == (40, 40, 200)
+    assert inserts == 1
+    assert set(result['timings']) == {'parse_ms', 'write_ms'}
+    assert all(value >= 0 for value in result['timings'].values())
+
+    items = client.get('/api/recipe/2').get_json()
+    assert [(i['line_number'], i['material_code'], i['quantity'], i['project_category']) for i in items] == \
+        [(f'{j * 10:04d}', f'M002{j:02d}', j * 0.5, 'L' if j == 1 else 'N') for j in range(1, 6)]
+
+    # 内容未变化的配方不重写；有变化的配方仍以一条语句批量写入
+    result, inserts = import_with_item_inserts(client, app_module, import_file(40, 5))
+    assert (result['unchanged_count'], result['item_count'], inserts) == (40, 0, 0)
+    result, inserts = import_with_item_inserts(client, app_module, import_file(3, 2))
+    assert (result['updated_count'], result['item_count'], inserts) == (3, 6, 1)
+    assert len(client.get('/api/recipe/2').get_json()) == 2
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+配方列表分页测试
+游标翻页、搜索、类别筛选和类别数量统计与全量数据计算的结果一致
+"""
+
+import pytest
+
+from conftest import seed_recipes
+
+
+def all_pages(client, **params):
+    """沿游标翻完所有页，返回(配方列表, 首页结果)"""
+    first = page = client.get('/api/recipes', query_string=params).get_json()
+    recipes = list(page['recipes'])
+    while page['has_more']:
+        page = client.get('/api/recipes', query_string=dict(params, cursor=page['next_cursor'])).get_json()
+        assert 'facets' not in page
+        recipes.extend(page['recipes'])
+    return recipes, first
+
+
+@pytest.fixture
+def catalog(app_module, client):
+    seed_recipes(app_module, recipe_count=45, items_per_recipe=1)
+    with app_module.app.app_context():
+        recipes = app_module.Recipe.query.all()
+        recipes[0].product_category = None
+        recipes[1].product_category = ''
+        recipes[2].is_active = False
+        recipes[3].description = '含有100%_特殊字符'
+        app_module.db.session.commit()
+    return client.get('/api/recipes').get_json()
+
+
+def test_legacy_full_list_without_params(client, catalog):
+    assert isinstance(catalog, list)
+    assert len(catalog) == 44
+
+
+@pytest.mark.parametrize('sort, key, reverse', [
+    ('name_asc', 'name', False),
+    ('name_desc', 'name', True),
+    ('created_desc', 'created_at', True),
+    ('updated_asc', 'updated_at', False),
+])
+def test_cursor_pages_cover_every_recipe_once(client, catalog, sort, key, reverse):
+    recipes, first = all_pages(client, limit=7, sort=sort)
+    assert sorted(r['id'] for r in recipes) == sorted(r['id'] for r in catalog)
+    # 时间只精确到秒，同一秒内的顺序由完整时间和ID决定
+    assert [r[key] for r in recipes] == sorted((r[key] for r in catalog), reverse=reverse)
+    assert first['total'] == 44
+    assert len(first['recipes']) == 7
+
+
+def test_search_and_category_filters(client, catalog):
+    recipes, first = all_pages(client, limit=5, q='配方001')
+    assert [r['name'] for r in recipes] == [f'配方{i:04d}' for i in range(10, 20)]
+    assert first['total'] == 10
+
+    recipes, first = all_pages(client, limit=5, category='类别1')
+    expected = [r['id'] for r in sorted(catalog, key=lambda r: r['name']) if r['product_category'] == '类别1']
+    assert [r['id'] for r in recipes] == expected
+    assert first['total'] == len(expected)
+
+    recipes, _ = all_pages(client, category='未分类')
+    assert [r['name'] for r in recipes] == ['配方0001', '配方0002']
+
+    # LIKE通配符按字面匹配
+    recipes, _ = all_pages(client, q='100%_')
+    assert [r['name'] for r in recipes] == ['配方0004']
+    assert all_pages(client, q='0%1')[0] == []
+
+
+def test_facets_count_every_category(client, catalog):
+    _, first = all_pages(client, limit=1)
+    counts = {}
+    for recipe in catalog:
+        category = recipe['product_category'] or '未分类'
+        counts[category] = counts.get(category, 0) + 1
+    assert first['facets'][-1] == {'category': '未分类', 'count': 2}
+    assert {f['category']: f['count'] for f in first['facets']} == counts
+
+    # 类别数量受搜索词影响，不受类别筛选影响
+    _, filtered = all_pages(client, q='配方000', category='类别1')
+    assert sum(f['count'] for f in filtered['facets']) == 8
+    assert client.get('/api/recipe/categories').get_json() == [f['category'] for f in first['facets']]
+
+
+def test_ids_only_and_offset(client, catalog):
+    data = client.get('/api/recipes', query_string={'ids_only': 1, 'category': '类别2'}).get_json()
+    expected = [r['id'] for r in sorted(catalog, key=lambda r: r['name']) if r['product_category'] == '类别2']
+    assert data == {'ids': expected, 'total': len(expected)}
+
+    recipes, _ = all_pages(client, limit=10)
+    page = client.get('/api/recipes', query_string={'limit': 10, 'offset': 20}).get_json()
+    assert page['recipes'] == recipes[20:30]
+
+
+def test_invalid_parameters(client, catalog):
+    assert client.get('/api/recipes?cursor=not-a-cursor').status_code == 400
+    assert client.get('/api/recipes?sort=price_asc').status_code == 400
+    assert client.get('/api/recipes?limit=abc').status_code == 400
+    assert len(client.get('/api/recipes?limit=100000').get_json()['recipes']) == 44
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+配方全文搜索测试
+索引随写接口同步更新，全文索引与LIKE查询的结果一致
+"""
+
+import io
+
+import openpyxl
+import pytest
+
+from conftest import seed_recipes
+
+
+def search(client, q, **params):
+    response = client.get('/api/recipe/search', query_string=dict(params, q=q))
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def names(result):
+    return sorted(recipe['name'] for recipe in result['recipes'])
+
+
+@pytest.fixture
+def catalog(app_module):
+    seed_recipes(app_module, recipe_count=30, items_per_recipe=4)
+    with app_module.app.app_context():
+        app_module.rebuild_recipe_search_index()
+        app_module.db.session.commit()
+
+
+def test_search_material_code_and_name(client, catalog):
+    result = search(client, 'M001203')
+    assert result['engine'] == 'fts5'
+    assert names(result) == ['配方0012']
+    assert result['recipes'][0]['matched_items'] == [{
+        'line_number': '0030', 'material_code': 'M001203', 'material_name': '原材料12-3',
+        'quantity': 1.5, 'unit': 'KG'
+    }]
+
+    # 多个搜索词须同时匹配，大小写不敏感
+    assert names(search(client, 'm0012 类别0')) == ['配方0012']
+    assert search(client, '原材料7-')['total'] == 1
+
+
+def test_fts_matches_like_fallback(client, app_module, catalog, monkeypatch):
+    queries = ['M0001', '原材料1', '测试配方2', '类别1 M002', '配方00']
+    fts_results = [search(client, q, limit=200) for q in queries]
+    monkeypatch.setattr(app_module, 'recipe_search_available', lambda: False)
+    for q, expected in zip(queries, fts_results):
+        result = search(client, q, limit=200)
+        assert result['engine'] == 'like'
+        assert names(result) == names(expected)
+        assert result['total'] == expected['total']
+
+    # 少于3个字符的搜索词使用LIKE查询
+    monkeypatch.undo()
+    assert search(client, 'M0')['engine'] == 'like'
+    assert search(client, 'M0')['total'] == 30
+
+
+def test_write_endpoints_update_index(client, catalog):
+    created = client.post('/api/recipe', json={
+        'name': '新配方', 'description': '耐高温涂料', 'product_category': '涂料',
+        'items': [{'material_code': 'X900', 'material_name': '钛白粉', 'quantity': 1,
+                   'unit': 'KG', 'line_number': '0010', 'project_category': 'L'}]
+    }).get_json()
+    assert names(search(client, '耐高温 X900')) == ['新配方']
+
+    client.put(f"/api/recipe/{created['id']}", json={
+        'name': '新配方', 'description': '普通涂料', 'product_category': '涂料',
+        'items': [{'material_code': 'Y800', 'material_name': '钛白粉', 'quantity': 1,
+                   'unit': 'KG', 'line_number': '0010', 'project_category': 'L'}]
+    })
+    assert search(client, '耐高温')['total'] == 0
+    assert search(client, 'X900')['total'] == 0
+    assert names(search(client, 'Y800')) == ['新配方']
+
+    client.delete(f"/api/recipe/{created['id']}")
+    assert search(client, 'Y800')['total'] == 0
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(['配方名称', '配方描述', '行号', '物料编码', '物料名称', '数量', '单位', '类别', '产品类别'])
+    ws.append(['导入配方', '导入说明', '0010', 'Z700', '导入原料', 2, 'KG', 'L', '涂料'])
+    content = io.BytesIO()
+    wb.save(content)
+    content.seek(0)
+    response = client.post('/api/recipe/import', data={'file': (content, 'recipes.xlsx')},
+                           content_type='multipart/form-data')
+    assert response.get_json()['success']
+    assert names(search(client, 'Z700')) == ['导入配方']
+
+
+def test_search_paging_and_errors(client, catalog):
+    first = search(client, '测试配方', limit=20)
+    second = search(client, '测试配方', limit=20, offset=20)
+    assert first['total'] == 30 and first['has_more'] and not second['has_more']
+    assert len({r['id'] for r in first['recipes'] + second['recipes']}) == 30
+
+    assert client.get('/api/recipe/search?q=').status_code == 400
+    assert client.get('/api/recipe/search?q=M001&limit=x').status_code == 400
+    # FTS查询语法字符按字面处理
+    assert search(client, '"M0001 OR*')['total'] == 0
+
+
+def test_search_migration_retried_until_fts_available(client, app_module, catalog, monkeypatch):
+    """无法创建全文索引时迁移不记录为已执行，环境满足后启动时重新执行"""
+    db = app_module.db
+    with app_module.app.app_context():
+        db.session.execute(db.text(f'DROP TABLE {app_module.RECIPE_SEARCH_TABLE}'))
+        db.session.execute(db.text('DELETE FROM schema_migrations WHERE version = 5'))
+        db.session.commit()
+
+        monkeypatch.setattr(app_module, 'RECIPE_SEARCH_TOKENIZER', 'missing_tokenizer')
+        assert app_module.run_migrations() == []
+        assert app_module.run_migrations() == []
+        assert not app_module.recipe_search_available()
+        assert 5 not in {row[0] for row in db.session.execute(db.text('SELECT version FROM schema_migrations'))}
+    assert search(client, 'M001203')['engine'] == 'like'
+
+    monkeypatch.undo()
+    with app_module.app.app_context():
+        assert app_module.run_migrations() == [5]
+        assert app_module.run_migrations() == []
+    result = search(client, 'M001203')
+    assert result['engine'] == 'fts5' and names(result) == ['配方0012']
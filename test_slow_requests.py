@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+慢请求记录测试
+超过阈值的请求保存调用栈采样、SQL及执行计划，记录按数量轮换，管理页面可查看和下载
+"""
+
+import json
+import os
+import shutil
+import time
+
+import pytest
+
+from conftest import seed_recipes
+
+
+@pytest.fixture
+def recorder(app_module, monkeypatch):
+    config = app_module.app.config
+    shutil.rmtree(config['SLOW_REQUEST_DIR'], ignore_errors=True)
+    monkeypatch.setitem(config, 'SLOW_REQUEST_THRESHOLD', 0.05)
+    monkeypatch.setitem(config, 'SLOW_REQUEST_SAMPLE_INTERVAL', 0.005)
+    return app_module.slow_requests
+
+
+def load_dump(recorder, dump_id):
+    with open(recorder.path(dump_id), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_slow_request_dump_contents(client, app_module, recorder, monkeypatch):
+    seed_recipes(app_module)
+    query_recipe_page = app_module.query_recipe_page
+
+    def slow_query_recipe_page(args):
+        deadline = time.perf_counter() + 0.1
+        while time.perf_counter() < deadline:
+            pass
+        return query_recipe_page(args)
+
+    monkeypatch.setattr(app_module, 'query_recipe_page', slow_query_recipe_page)
+    assert client.get('/api/recipes?limit=5&category=类别1').status_code == 200
+
+    [dump_id] = recorder.list_ids()
+    dump = load_dump(recorder, dump_id)
+    assert dump['duration_seconds'] >= 0.1
+    assert dump['request']['path'] == '/api/recipes'
+    assert dump['request']['endpoint'] == 'get_recipes'
+    assert dump['request']['query_string'] == 'limit=5&category=类别1'
+    assert dump['response']['status'] == 200
+
+    assert dump['profile']['samples'] > 0
+    assert any('slow_query_recipe_page (test_slow_requests.py:' in entry['stack']
+               for entry in dump['profile']['stacks'])
+
+    statements = dump['sql']['statements']
+    assert dump['sql']['count'] == sum(entry['count'] for entry in statements) > 0
+    plans = [detail for entry in statements for detail in entry.get('plan', [])]
+    assert any('ix_recipe_active_category_name' in detail for detail in plans)
+
+
+def test_fast_requests_are_discarded_and_dumps_rotate(client, app_module, recorder, monkeypatch):
+    assert client.get('/api/recipes').status_code == 200
+    assert recorder.list_ids() == []
+    assert recorder._active == {}
+
+    monkeypatch.setitem(app_module.app.config, 'SLOW_REQUEST_THRESHOLD', 1e-9)
+    monkeypatch.setitem(app_module.app.config, 'SLOW_REQUEST_MAX_DUMPS', 2)
+    created = []
+    for _ in range(4):
+        before = set(recorder.list_ids())
+        client.get('/api/recipes')
+        created.extend(set(recorder.list_ids()) - before)
+    assert recorder.list_ids() == created[:-3:-1]
+    assert len(os.listdir(app_module.app.config['SLOW_REQUEST_DIR'])) == 2
+
+    # 阈值为0时不记录
+    monkeypatch.setitem(app_module.app.config, 'SLOW_REQUEST_THRESHOLD', 0)
+    client.get('/api/recipes')
+    assert len(recorder.list_ids()) == 2
+
+
+def test_stack_walks_and_pruning_run_outside_the_lock(client, app_module, recorder, monkeypatch):
+    # 锁不可重入：在持有锁的线程里再次获取会超时
+    lock_free = []
+
+    def check_lock():
+        acquired = recorder.lock.acquire(timeout=1)
+        if acquired:
+            recorder.lock.release()
+        lock_free.append(acquired)
+
+    current_frames = app_module.sys._current_frames
+    capture_stack = app_module.RequestTrace.capture_stack.__func__
+    remove = app_module.os.remove
+
+    def checked_current_frames():
+        check_lock()
+        return current_frames()
+
+    def checked_capture_stack(cls, frame):
+        check_lock()
+        return capture_stack(cls, frame)
+
+    def checked_remove(path):
+        check_lock()
+        return remove(path)
+
+    monkeypatch.setattr(app_module.sys, '_current_frames', checked_current_frames)
+    monkeypatch.setattr(app_module.RequestTrace, 'capture_stack', classmethod(checked_capture_stack))
+    monkeypatch.setattr(app_module.os, 'remove', checked_remove)
+    monkeypatch.setitem(app_module.app.config, 'SLOW_REQUEST_MAX_DUMPS', 1)
+    query_recipe_page = app_module.query_recipe_page
+
+    def slow_query_recipe_page(args):
+        time.sleep(0.1)
+        return query_recipe_page(args)
+
+    monkeypatch.setattr(app_module, 'query_recipe_page', slow_query_recipe_page)
+    seed_recipes(app_module)
+    for _ in range(2):
+        assert client.get('/api/recipes?limit=5&category=类别1').status_code == 200
+
+    [dump_id] = recorder.list_ids()
+    assert load_dump(recorder, dump_id)['profile']['samples'] > 0
+    assert len(lock_free) > 3 and all(lock_free)
+
+
+def test_parameters_preview_only_walks_leading_sets(app_module):
+    preview = app_module.slow_requests._preview
+    limit = app_module.SlowRequestRecorder.MAX_PARAMETERS_REPR
+    calls = []
+
+    class Parameters(dict):
+        def __repr__(self):
+            calls.append(1)
+            return dict.__repr__(self)
+
+    # executemany的参数列表：只对前面几组生成repr，结果与完整repr的前limit个字符一致
+    rows = [Parameters(recipe_id=i, material_code=f'M{i:06d}') for i in range(100000)]
+    text = preview(rows)
+    assert len(calls) < 50
+    assert len(text) == limit and text == repr(rows)[:limit]
+
+    for parameters in ((1, 'a', None), (5,), [], {'id': 1}, None, ('x' * 5000,)):
+        assert preview(parameters) == repr(parameters)[:limit]
+
+
+def test_admin_page_lists_and_downloads(client, app_module, recorder, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'SLOW_REQUEST_THRESHOLD', 1e-9)
+    client.get('/api/recipe/categories')
+    monkeypatch.setitem(app_module.app.config, 'SLOW_REQUEST_THRESHOLD', 10)
+    [dump_id] = recorder.list_ids()
+
+    page = client.get('/admin/slow_requests')
+    assert page.status_code == 200
+    assert '/api/recipe/categories' in page.get_data(as_text=True)
+    assert f'/api/admin/slow_requests/{dump_id}' in page.get_data(as_text=True)
+
+    download = client.get(f'/api/admin/slow_requests/{dump_id}')
+    assert download.status_code == 200
+    assert json.loads(download.data)['id'] == dump_id
+    assert client.get('/api/admin/slow_requests/..%2Fbom_system').status_code == 404
+
+    anonymous = app_module.app.test_client()
+    assert anonymous.get('/admin/slow_requests').status_code == 302
+    assert anonymous.get(f'/api/admin/slow_requests/{dump_id}').status_code == 302
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+流式生成下载测试
+一次请求直接返回BOM表内容，结果与先生成再下载的方式一致
+"""
+
+import io
+import threading
+import time
+import zipfile
+
+import openpyxl
+
+from conftest import seed_recipes
+
+
+def sheet_values(content):
+    ws = openpyxl.load_workbook(io.BytesIO(content)).active
+    return [[cell.value for cell in row] for row in ws.iter_rows()]
+
+
+def bom_request(app_module, **extra):
+    seed_recipes(app_module, recipe_count=5)
+    with app_module.app.app_context():
+        recipe_ids = [recipe.id for recipe in app_module.Recipe.query.all()]
+    return dict({
+        'parent_material_code': 'P001', 'parent_material_name': '父物料',
+        'basic_quantity': 3, 'basic_unit': 'KG', 'recipe_ids': recipe_ids
+    }, **extra)
+
+
+def test_stream_generate_bom_matches_download(client, app_module):
+    payload = bom_request(app_module)
+    artifacts_before = app_module.artifact_store.stats()['count']
+
+    streamed = client.post('/api/generate_bom', json=dict(payload, stream=True))
+    assert streamed.status_code == 200
+    assert streamed.is_streamed
+    assert 'BOM' in streamed.headers['Content-Disposition']
+    assert app_module.artifact_store.stats()['count'] == artifacts_before
+
+    download_url = client.post('/api/generate_bom', json=payload).get_json()['download_url']
+    assert sheet_values(streamed.data) == sheet_values(client.get(download_url).data)
+
+
+def test_stream_batch_matches_download(client, app_module):
+    seed_recipes(app_module, recipe_count=5)
+    bom_data = [
+        {'parent_material_code': f'P{i:03d}', 'parent_material_name': f'父物料{i}',
+         'basic_quantity': i, 'basic_unit': 'KG', 'recipe_names': ['配方0001', '配方0003']}
+        for i in range(1, 4)
+    ]
+
+    streamed = client.post('/api/bom/batch_generate_table', json={'bom_data': bom_data, 'stream': True})
+    assert streamed.status_code == 200
+    download_url = client.post('/api/bom/batch_generate_table', json={'bom_data': bom_data}).get_json()['download_url']
+    assert sheet_values(streamed.data) == sheet_values(client.get(download_url).data)
+
+
+def test_streamed_sheet_xml_matches_openpyxl(app_module):
+    """数据行的XML与openpyxl只写模式保存的结果逐字节一致"""
+    Line = app_module.RecipeLine
+    recipe = app_module.CompiledRecipe(None, ' 配方 & <A> ', None, None, True, (
+        Line('0010', 'M001', '=SUM(A1)', 1.1, 'KG', 'L'),
+        Line('0020', '#N/A', None, 3, 'EA', ''),
+        Line('0030', 'M003', '  ', 1e-7, 'M', 'L'),
+    ))
+    parent = {'parent_material_code': 12, 'parent_material_name': '父物料\n换行',
+              'basic_quantity': 2.5, 'basic_unit': 'KG'}
+
+    expected = io.BytesIO()
+    writer = app_module.BOMSheetWriter('BOM表', [15, 10])
+    writer.append_parent(parent, [recipe])
+    writer.save(expected)
+
+    streamed = io.BytesIO()
+    assert app_module.stream_bom_workbook(streamed, 'BOM表', [15, 10], [(parent, [recipe])]) == 3
+
+    sheet = app_module.BOM_SHEET_PART
+    with zipfile.ZipFile(expected) as a, zipfile.ZipFile(streamed) as b:
+        assert sorted(a.namelist()) == sorted(b.namelist())
+        assert a.read(sheet) == b.read(sheet)
+
+
+def test_stream_validation_errors_are_json(client, app_module):
+    response = client.post('/api/bom/batch_generate_table', json={
+        'bom_data': [{'parent_material_code': 'P001', 'parent_material_name': '父物料',
+                      'basic_quantity': 1, 'basic_unit': 'KG', 'recipe_names': ['不存在的配方']}],
+        'stream': True
+    })
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+    response = client.post('/api/bom/batch_generate_table', json={'bom_data': [{}], 'stream': True, 'async': True})
+    assert response.status_code == 400
+
+
+def test_closed_stream_stops_writer(app_module):
+    started = threading.Event()
+
+    def write(target):
+        started.set()
+        while True:
+            target.write(b'x' * 1024)
+
+    stream = app_module.StreamingFile(write)
+    assert started.wait(5)
+    assert stream.read()
+    stream.close()
+
+    deadline = time.monotonic() + 5
+    while stream._thread.is_alive() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not stream._thread.is_alive()
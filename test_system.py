@@ -67,6 +67,21 @@ def test_recipe_management():
     
     return True
 
+def download_generated_file(result):
+    """按生成接口返回的download_url（/api/download/<token>）下载文件，返回是否成功"""
+    download_url = result.get('download_url')
+    if not download_url:
+        print("❌ 响应中没有download_url")
+        return False
+    print(f"   下载地址: {download_url}")
+    
+    response = requests.get(f"{BASE_URL}{download_url}", timeout=TEST_TIMEOUT)
+    if response.status_code == 200 and response.content:
+        print(f"✅ 文件下载成功 ({len(response.content)} bytes)")
+        return True
+    print(f"❌ 文件下载失败: {response.status_code}")
+    return False
+
 def test_bom_generation():
     """测试BOM生成功能"""
     print("\n🔍 测试BOM生成功能...")
@@ -96,7 +111,7 @@ def test_bom_generation():
         "parent_material_name": "测试产品",
         "basic_quantity": 1.0,
         "basic_unit": "PCS",
-        "recipe_id": recipe_id
+        "recipe_ids": [recipe_id]
     }
     
     try:
@@ -110,8 +125,7 @@ def test_bom_generation():
             result = response.json()
             if result.get('success'):
                 print("✅ BOM生成成功")
-                print(f"   文件路径: {result.get('file_path', 'N/A')}")
-                return True
+                return download_generated_file(result)
             else:
                 print(f"❌ BOM生成失败: {result.get('message', '未知错误')}")
                 return False
@@ -123,6 +137,41 @@ def test_bom_generation():
         print(f"❌ BOM生成异常: {e}")
         return False
 
+def test_batch_bom_generation():
+    """测试批量BOM生成功能"""
+    print("\n🔍 测试批量BOM生成功能...")
+    
+    try:
+        recipes = requests.get(f"{BASE_URL}/api/recipes", timeout=TEST_TIMEOUT).json()
+        if not recipes:
+            print("❌ 没有可用的配方")
+            return False
+        
+        bom_data = [{
+            "line_number": i,
+            "parent_material_code": f"TEST10{i}",
+            "parent_material_name": f"测试产品{i}",
+            "basic_quantity": i,
+            "basic_unit": "KG",
+            "recipe_names": [recipes[0]['name']]
+        } for i in (1, 2)]
+        response = requests.post(
+            f"{BASE_URL}/api/bom/batch_generate_table",
+            json={"bom_data": bom_data},
+            timeout=TEST_TIMEOUT
+        )
+        
+        result = response.json()
+        if response.status_code == 200 and result.get('success'):
+            print(f"✅ 批量BOM生成成功，共 {result.get('bom_count')} 个BOM")
+            return download_generated_file(result)
+        print(f"❌ 批量BOM生成失败: {result.get('message', response.status_code)}")
+        return False
+        
+    except Exception as e:
+        print(f"❌ 批量BOM生成异常: {e}")
+        return False
+
 def test_admin_page():
     """测试管理页面"""
     print("\n🔍 测试管理页面...")
@@ -149,6 +198,7 @@ def run_all_tests():
         ("API端点", test_api_endpoints),
         ("配方管理", test_recipe_management),
         ("BOM生成", test_bom_generation),
+        ("批量BOM生成", test_batch_bom_generation),
         ("管理页面", test_admin_page)
     ]
     
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+CSV/TSV输出测试
+文本格式与Excel版本的17列及取值一致（工厂P060、可选BOM编号、KG/M数量换算）
+"""
+
+import csv
+import io
+import time
+
+import openpyxl
+
+from conftest import seed_recipes
+
+
+def xlsx_rows(content):
+    """Excel数据行（第8行起），数值按16位有效数字转为文本"""
+    ws = openpyxl.load_workbook(io.BytesIO(content)).active
+    header = [cell.value for cell in ws[1]]
+    rows = []
+    for row in ws.iter_rows(min_row=8, values_only=True):
+        rows.append(['' if value is None else ('%.16g' % value if isinstance(value, (int, float)) else value)
+                     for value in row])
+    return header, rows
+
+
+def text_rows(content, delimiter):
+    rows = list(csv.reader(io.StringIO(content.decode('utf-8'), newline=''), delimiter=delimiter))
+    return rows[0], rows[1:]
+
+
+def batch_data(count=3):
+    return [
+        {'parent_material_code': f'P{i:03d}', 'parent_material_name': f'父物料,{i}',
+         'basic_quantity': 1.5 * i, 'basic_unit': 'KG', 'recipe_names': ['配方0001', '配方0002', '配方0004']}
+        for i in range(1, count + 1)
+    ]
+
+
+def test_generate_bom_text_formats_match_xlsx(client, app_module):
+    seed_recipes(app_module, recipe_count=4)
+    with app_module.app.app_context():
+        recipe_ids = [recipe.id for recipe in app_module.Recipe.query.all()]
+    payload = {'parent_material_code': 'P001', 'parent_material_name': '父物料',
+               'basic_quantity': 3, 'basic_unit': 'KG', 'recipe_ids': recipe_ids}
+
+    xlsx_url = client.post('/api/generate_bom', json=payload).get_json()['download_url']
+    expected = xlsx_rows(client.get(xlsx_url).data)
+
+    for output_format, delimiter in (('csv', ','), ('tsv', '\t')):
+        data = client.post('/api/generate_bom', json=dict(payload, format=output_format)).get_json()
+        download = client.get(data['download_url'])
+        assert output_format in download.headers['Content-Disposition']
+        assert text_rows(download.data, delimiter) == expected
+
+        streamed = client.post('/api/generate_bom', json=dict(payload, format=output_format, stream=True))
+        assert streamed.is_streamed
+        assert text_rows(streamed.data, delimiter) == expected
+
+    header, rows = expected
+    assert len(rows) == 20
+    assert {row[1] for row in rows} == {'P060'}
+    assert [row[7] for row in rows[::5]] == ['01', '02', '03', '04']
+
+
+def test_batch_text_formats_match_xlsx(client, app_module):
+    seed_recipes(app_module, recipe_count=4)
+    bom_data = batch_data()
+
+    xlsx_url = client.post('/api/bom/batch_generate_table', json={'bom_data': bom_data}).get_json()['download_url']
+    expected = xlsx_rows(client.get(xlsx_url).data)
+
+    data = client.post('/api/bom/batch_generate_table', json={'bom_data': bom_data, 'format': 'csv'}).get_json()
+    assert data['bom_count'] == 3
+    assert text_rows(client.get(data['download_url']).data, ',') == expected
+
+    streamed = client.post('/api/bom/batch_generate_table', json={'bom_data': bom_data, 'format': 'tsv', 'stream': True})
+    assert text_rows(streamed.data, '\t') == expected
+
+
+def test_async_job_text_format(client, app_module):
+    seed_recipes(app_module, recipe_count=4)
+    job = client.post('/api/bom/batch_generate_table',
+                      json={'bom_data': batch_data(), 'format': 'tsv', 'async': True}).get_json()
+
+    deadline = time.monotonic() + 10
+    status = client.get(job['status_url']).get_json()
+    while status['status'] not in ('finished', 'failed') and time.monotonic() < deadline:
+        time.sleep(0.05)
+        status = client.get(job['status_url']).get_json()
+    assert status['status'] == 'finished'
+
+    download = client.get(status['download_url'])
+    assert 'tsv' in download.headers['Content-Disposition']
+    header, rows = text_rows(download.data, '\t')
+    assert len(rows) == 45
+
+
+def test_invalid_format_combinations(client, app_module):
+    seed_recipes(app_module, recipe_count=4)
+    assert client.post('/api/bom/batch_generate_table',
+                       json={'bom_data': batch_data(), 'format': 'xls'}).status_code == 400
+    assert client.post('/api/bom/batch_generate_table',
+                       json={'bom_data': batch_data(), 'format': 'csv', 'parallel': True}).status_code == 400
+    assert client.post('/api/generate_bom', json={
+        'parent_material_code': 'P001', 'parent_material_name': '父物料', 'basic_quantity': 1,
+        'basic_unit': 'KG', 'recipe_ids': [1], 'format': 'pdf'
+    }).status_code == 400
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+物料反查测试
+按物料编码（或前缀）找到使用它的配方、配方项行号和数量，以及用这些配方生成过BOM的父物料
+"""
+
+from conftest import seed_recipes
+
+
+def where_used(client, code, **params):
+    response = client.get('/api/recipe/where_used', query_string=dict(params, material_code=code))
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def generate(client, parent_code, recipe_ids, app_module):
+    response = client.post('/api/generate_bom', json={
+        'parent_material_code': parent_code, 'parent_material_name': f'父物料{parent_code}',
+        'basic_quantity': 1, 'basic_unit': 'KG', 'recipe_ids': recipe_ids
+    })
+    assert response.get_json()['success']
+    app_module.db_writer.join()  # 等待后台写入BOM生成记录
+
+
+def test_lookup_by_code_and_prefix(client, app_module):
+    seed_recipes(app_module, recipe_count=12, items_per_recipe=3)
+    result = where_used(client, 'M000302')
+    assert [r['name'] for r in result['recipes']] == ['配方0003']
+    assert result['recipes'][0]['lines'] == [{
+        'line_number': '0020', 'material_code': 'M000302', 'material_name': '原材料3-2',
+        'quantity': 1.0, 'unit': 'EA'
+    }]
+
+    result = where_used(client, 'M001', prefix=1)
+    assert [r['name'] for r in result['recipes']] == ['配方0010', '配方0011', '配方0012']
+    assert result['line_count'] == 9 and not result['truncated']
+
+    assert where_used(client, 'M001')['recipes'] == []
+    assert client.get('/api/recipe/where_used').status_code == 400
+
+
+def test_consistent_after_writes(client, app_module):
+    seed_recipes(app_module, recipe_count=3, items_per_recipe=2)
+    item = {'material_code': 'NEW01', 'material_name': '新物料', 'quantity': 2,
+            'unit': 'KG', 'line_number': '0010', 'project_category': 'L'}
+    recipe_id = client.post('/api/recipe', json={'name': '新配方', 'description': '', 'items': [item]}).get_json()['id']
+    assert [r['id'] for r in where_used(client, 'NEW01')['recipes']] == [recipe_id]
+
+    client.put(f'/api/recipe/{recipe_id}', json={
+        'name': '新配方', 'description': '', 'items': [dict(item, material_code='NEW02')]})
+    assert where_used(client, 'NEW01')['recipes'] == []
+    assert where_used(client, 'NEW02')['recipe_count'] == 1
+
+    client.delete(f'/api/recipe/{recipe_id}')
+    assert where_used(client, 'NEW02')['recipes'] == []
+
+
+def test_inactive_recipes_do_not_use_up_the_limit(client, app_module, monkeypatch):
+    seed_recipes(app_module, recipe_count=6, items_per_recipe=2)
+    for recipe_id in (1, 2, 3):
+        client.delete(f'/api/recipe/{recipe_id}')
+    monkeypatch.setattr(app_module, 'WHERE_USED_MAX_LINES', 3)
+
+    result = where_used(client, 'M000', prefix=1)
+    assert [line['material_code'] for r in result['recipes'] for line in r['lines']] == [
+        'M000401', 'M000402', 'M000501']
+    assert result['line_count'] == 3 and result['truncated']
+
+    monkeypatch.setattr(app_module, 'WHERE_USED_MAX_LINES', 6)
+    result = where_used(client, 'M000', prefix=1)
+    assert [r['name'] for r in result['recipes']] == ['配方0004', '配方0005', '配方0006']
+    assert result['line_count'] == 6 and not result['truncated']
+
+
+def test_bom_request_parents(client, app_module):
+    seed_recipes(app_module, recipe_count=3, items_per_recipe=2)
+    generate(client, 'P100', [1, 2], app_module)
+    generate(client, 'P100', [1], app_module)
+    generate(client, 'P200', [2, 3], app_module)
+
+    parents = where_used(client, 'M000101')['recipes'][0]['parents']
+    assert [(p['parent_material_code'], p['request_count']) for p in parents] == [('P100', 2)]
+
+    result = where_used(client, 'M0002', prefix=1)
+    assert sorted(p['parent_material_code'] for p in result['recipes'][0]['parents']) == ['P100', 'P200']
+    assert result['parent_count'] == 2
+
+
+def test_migration_backfills_bom_request_links(app_module):
+    db = app_module.db
+    with app_module.app.app_context():
+        db.session.add_all([
+            app_module.BOMRequest(parent_material_code='P1', parent_material_name='父1', basic_quantity=1,
+                                  basic_unit='KG', recipe_ids='1,2, 2,x'),
+            app_module.BOMRequest(parent_material_code='P2', parent_material_name='父2', basic_quantity=1,
+                                  basic_unit='KG', recipe_ids='3'),
+        ])
+        db.session.commit()
+        app_module._migrate_where_used_index()
+        app_module._migrate_where_used_index()  # 可重复执行
+        db.session.commit()
+        links = db.session.query(app_module.BOMRequestRecipe.bom_request_id,
+                                 app_module.BOMRequestRecipe.recipe_id).order_by('bom_request_id', 'recipe_id').all()
+        assert [tuple(link) for link in links] == [(1, 1), (1, 2), (2, 3)]